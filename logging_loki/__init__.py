@@ -1,6 +1,18 @@
 from .handler import LokiHandler
 from .formater import LokiFormatter
+from .lanes import Lane
+from .shipper import LokiShipper, LokiQueueHandler
+from .async_client import AsyncLokiClient, AsyncLokiHandler
 from .version import __version__
 
 
-__all__ = ["LokiHandler", "LokiFormatter", "__version__"]
+__all__ = [
+    "LokiHandler",
+    "LokiFormatter",
+    "Lane",
+    "LokiShipper",
+    "LokiQueueHandler",
+    "AsyncLokiClient",
+    "AsyncLokiHandler",
+    "__version__",
+]
@@ -0,0 +1,399 @@
+"""
+asyncio 版本的 Loki Client
+
+批次合并、刷写计时与推送都在事件循环中完成，使用基于 asyncio streams 的 HTTP/1.1
+长连接池，重试按 RetryPolicy 退避、在事件循环中等待，不额外创建线程。
+"""
+
+import asyncio
+import base64
+import ssl
+import threading
+import time
+import typing
+from urllib.parse import urlparse
+from warnings import warn
+
+import snappy
+
+from logging_loki.handler import LokiHandler
+from logging_loki.loki_client import (
+    DEFAULT_UA,
+    PUSH_PATH,
+    STREAM_OVERHEAD,
+    LokiClient,
+    run_tickers,
+)
+from logging_loki.metrics import Histogram
+from logging_loki.retry import RetryPolicy, parse_retry_after
+from logging_loki.tools import debugger_print
+from logging_loki.wire import StreamBuffer
+
+
+class AsyncConnectionPool:
+    """HTTP/1.1 keep-alive 连接池
+
+    max_size 限制同时进行的请求数；复用的空闲连接如果已被服务端关闭，会重连后重发一次。
+    建立连接与每次请求的往返最多等待 timeout 秒，超时时关闭连接并抛出 TimeoutError。
+    """
+
+    def __init__(
+        self,
+        loki_url: str,
+        max_size: int = 3,
+        ssl_verify: bool = True,
+        timeout: float = 30,
+    ):
+        url = urlparse(loki_url)
+        self.netloc = url.netloc
+        self.host = url.hostname
+        self.ssl = None
+        if url.scheme.upper() == "HTTPS":
+            self.ssl = ssl.create_default_context()
+            if not ssl_verify:
+                self.ssl.check_hostname = False
+                self.ssl.verify_mode = ssl.CERT_NONE
+        self.port = url.port or (443 if self.ssl else 80)
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self._idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._semaphore = asyncio.Semaphore(self.max_size)
+
+    async def _connect(self):
+        try:
+            return await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout
+            )
+        except asyncio.TimeoutError:
+            # Python 3.10 的 asyncio.TimeoutError 不是 OSError，统一为连接错误
+            raise TimeoutError(f"连接 {self.netloc} 超时") from None
+
+    async def request(
+        self, method: str, path: str, body: bytes, headers: dict
+    ) -> tuple[int, dict, bytes]:
+        async with self._semaphore:
+            while True:
+                reused = bool(self._idle)
+                conn = self._idle.pop() if reused else await self._connect()
+                try:
+                    status, resp_headers, resp_body = await asyncio.wait_for(
+                        self._roundtrip(conn, method, path, body, headers), self.timeout
+                    )
+                except asyncio.TimeoutError:
+                    conn[1].close()  # 响应可能稍后到达，连接不能复用
+                    raise TimeoutError(f"请求 {self.netloc} 超时") from None
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    conn[1].close()
+                    if reused:
+                        continue  # 空闲连接已被服务端关闭，重连后重发
+                    raise
+                if resp_headers.get("connection", "").lower() == "close":
+                    conn[1].close()
+                else:
+                    self._idle.append(conn)
+                return status, resp_headers, resp_body
+
+    async def _roundtrip(self, conn, method, path, body, headers):
+        reader, writer = conn
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.netloc}"]
+        head += [f"{k}: {v}" for k, v in headers.items()]
+        head.append(f"Content-Length: {len(body)}")
+        writer.writelines([("\r\n".join(head) + "\r\n\r\n").encode("latin-1"), body])
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("服务端关闭了连接")
+        status = int(status_line.split()[1])
+        resp_headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            k, _, v = line.decode("latin-1").partition(":")
+            resp_headers[k.strip().lower()] = v.strip()
+
+        if resp_headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while size := int((await reader.readline()).split(b";")[0], 16):
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            await reader.readline()
+            resp_body = b"".join(chunks)
+        elif "content-length" in resp_headers:
+            resp_body = await reader.readexactly(int(resp_headers["content-length"]))
+        else:
+            resp_body = await reader.read()
+            resp_headers["connection"] = "close"
+        return status, resp_headers, resp_body
+
+    def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+class AsyncLokiClient:
+    """asyncio 版本的 LokiClient，接口与 LokiClient 相同，flush/push_many/push_once/close 为协程
+
+    push_wait/push_entry 可以在任意线程中调用：在事件循环线程中直接追加到批次，
+    在其他线程中通过 call_soon_threadsafe 转交给事件循环。第一次调用必须发生在事件循环中，
+    或者事先调用 bind 绑定事件循环。
+    """
+
+    labels_key = staticmethod(LokiClient.labels_key)
+    entry_size = staticmethod(LokiClient.entry_size)
+
+    def __init__(
+        self,
+        loki_url: str,
+        username: str = None,
+        password: str = None,
+        flush_interval: int = 2,  # 将缓存刷写到Loki的时间频率， 默认2秒
+        max_cache_size: int = 102400,  # 缓存中的条目允许的内存占用的最大值
+        max_cache_stream: int = 1000,  # 最多缓存的条目
+        thread_pool_size: int = 3,  # 同时进行的推送请求数
+        ssl_verify: bool = True,
+        ua: str = DEFAULT_UA,
+        tags: dict = None,  # 使用的TAG
+        max_retries: int = 5,  # 推送失败后最多重试的次数
+        retry_backoff: float = 0.5,  # 第一次重试前的基础等待时间(秒)，之后每次翻倍
+        retry_max_backoff: float = 60,  # 重试等待时间的上限(秒)
+        request_timeout: float = 30,  # 建立连接与推送请求的超时时间(秒)
+        **kwargs,
+    ):
+        self.loki_url = urlparse(loki_url)
+        self.headers = {
+            "User-Agent": ua or DEFAULT_UA,
+            "Content-Type": "application/x-protobuf",
+            "Content-Encoding": "snappy",
+        }
+        if username:
+            b64 = base64.b64encode(f"{username}:{password}".encode()).decode()
+            self.headers["Authorization"] = f"Basic {b64}"
+
+        self.pool = AsyncConnectionPool(
+            loki_url, thread_pool_size, ssl_verify, timeout=request_timeout
+        )
+        self.streams: dict[tuple, StreamBuffer] = {}
+        self.batch_size = 0
+        self.batch_started = 0.0
+        self.max_cache_size = max_cache_size
+        self.max_cache_stream = max_cache_stream
+        self.flush_interval = flush_interval
+        self.labels = tags or {}
+        self.retry_policy = RetryPolicy(max_retries, retry_backoff, retry_max_backoff)
+        # 与 LokiClient.metrics 同名的计数器，只在事件循环中修改
+        self._counters = dict.fromkeys(
+            (
+                "records_enqueued_total",
+                "records_sent_total",
+                "records_failed_total",
+                "requests_total",
+                "request_errors_total",
+                "retries_total",
+            ),
+            0,
+        )
+        self.push_rtt = Histogram()  # 推送请求的往返时间(秒)
+
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread = None
+        self._closed = False
+        self._wakeup = asyncio.Event()
+        self._closing = asyncio.Event()  # close 时中断重试等待，立即做最后一次推送
+        self._flusher: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+        # 由刷写任务定期调用的函数，见 add_ticker
+        self._tickers: list[typing.Callable[[bool], float | None]] = []
+        self._next_tick: float | None = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop = None):
+        """绑定事件循环并启动刷写任务，需要在事件循环线程中调用"""
+        if self.loop is not None:
+            return
+        self.loop = loop or asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._flusher = self.loop.create_task(self._flush_loop())
+
+    def push_wait(
+        self,
+        labels: dict,
+        lines: list[list[int, str, typing.Optional[dict]]],
+    ):
+        key = self.labels_key({**labels, **self.labels})
+        for line in lines:
+            self.push_entry(key, line[0], line[1], line[2] if len(line) >= 3 else None)
+
+    def push_entry(
+        self, key: tuple, ts_ns: int, line: str, metadata: dict | None = None
+    ):
+        if self._closed:
+            raise RuntimeError()
+        if self.loop is None:
+            self.bind()
+        if threading.get_ident() != self._loop_thread:
+            self.loop.call_soon_threadsafe(self._append, key, ts_ns, line, metadata)
+        else:
+            self._append(key, ts_ns, line, metadata)
+
+    def _append(self, key: tuple, ts_ns: int, line: str, metadata: dict | None):
+        if not self.streams:
+            self.batch_started = time.monotonic()
+            self._wakeup.set()
+        entries = self.streams.get(key)
+        if entries is None:
+            entries = self.streams[key] = StreamBuffer()
+            self.batch_size += STREAM_OVERHEAD + sum(len(k) + len(v) + 5 for k, v in key)
+        entries.append(ts_ns, line, metadata)
+        self._counters["records_enqueued_total"] += 1
+        self.batch_size += self.entry_size(line, metadata)
+        if (
+            self.batch_size > self.max_cache_size
+            or len(self.streams) > self.max_cache_stream
+        ):
+            self._wakeup.set()
+
+    def add_ticker(self, ticker: typing.Callable[[bool], float | None]):
+        """与 LokiClient.add_ticker 相同，ticker 在事件循环中由刷写任务调用"""
+        self._tickers.append(ticker)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def push_many(self, streams: list[dict, list[list]]):
+        [self.push_wait(d, l) for d, l in streams]
+        await self.flush()
+
+    async def push_once(self, labels, lines):
+        self.push_wait(labels, lines)
+        await self.flush()
+
+    def shoud_flush(self) -> bool:
+        """判定需要刷写的条件"""
+        return (
+            self.batch_size > self.max_cache_size
+            or len(self.streams) > self.max_cache_stream
+            or (
+                bool(self.streams)
+                and time.monotonic() - self.batch_started >= self.flush_interval
+            )
+        )
+
+    async def _flush_loop(self):
+        """刷写任务"""
+        while not self._closed:
+            timeout = None
+            if self.streams:
+                timeout = max(
+                    self.batch_started + self.flush_interval - time.monotonic(), 0
+                )
+            if self._next_tick is not None:
+                wait = max(self._next_tick - time.monotonic(), 0)
+                timeout = wait if timeout is None else min(timeout, wait)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._tickers and not self._closed:
+                self._next_tick = run_tickers(self._tickers)
+            if not self._closed and self.shoud_flush():
+                # 推送在独立的任务中进行，刷写任务继续计时
+                task = self.loop.create_task(self.flush())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        """取出当前批次，编码、压缩并推送"""
+        if not self.streams:
+            return
+        batch, self.streams = self.streams, {}
+        self.batch_size = 0
+        entries = sum(len(s) for s in batch.values())
+        body = snappy.compress(
+            memoryview(LokiClient.serialize(batch, "protobuf", release=True))
+        )
+        await self._push(body, entries)
+
+    async def _push(self, body: bytes, entries: int = 0):
+        policy = self.retry_policy
+        counters = self._counters
+        for attempt in range(policy.max_retries + 1):
+            status, retry_after = None, None
+            counters["requests_total"] += 1
+            started = time.monotonic()
+            try:
+                status, resp_headers, resp_body = await self.pool.request(
+                    "POST", PUSH_PATH, body, self.headers
+                )
+            except (OSError, asyncio.IncompleteReadError) as _e:  # 包括超时
+                debugger_print("连接错误:", _e.__class__, _e)
+            else:
+                self.push_rtt.observe(time.monotonic() - started)
+                if 200 <= status <= 299:
+                    debugger_print(f"[{status}]Push Success. {resp_body.decode()}")
+                    counters["records_sent_total"] += entries
+                    return
+                if not policy.should_retry(status):
+                    debugger_print(f"请求错误: {status}: {resp_body.decode()}")
+                    counters["request_errors_total"] += 1
+                    counters["records_failed_total"] += entries
+                    return
+                retry_after = parse_retry_after(resp_headers.get("retry-after"))
+            counters["request_errors_total"] += 1
+            if attempt == policy.max_retries or self._closed:
+                break
+            counters["retries_total"] += 1
+            delay = policy.delay(attempt, status, retry_after)
+            debugger_print(f"推送失败 {status}, {delay:.2f}s后重试")
+            try:
+                await asyncio.wait_for(self._closing.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        debugger_print("多次重试后依旧错误")
+        counters["records_failed_total"] += entries
+
+    def metrics(self) -> dict:
+        """推送过程的指标快照，键名与 LokiClient.metrics 相同(只包含本客户端有的指标)"""
+        return {
+            **self._counters,
+            "queue_records": sum(len(s) for s in self.streams.values()),
+            "push_rtt_seconds": self.push_rtt.snapshot(),
+        }
+
+    async def close(self):
+        """停止刷写任务，推送剩余日志并关闭连接"""
+        if self._closed:
+            return
+        run_tickers(self._tickers, final=True)  # 在停止接收日志之前，写入 ticker 中尚未推送的日志
+        self._closed = True
+        self._closing.set()
+        if self._flusher is not None:
+            self._wakeup.set()
+            await self._flusher
+        await self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+        self.pool.close()
+
+
+class AsyncLokiHandler(LokiHandler):
+    """使用 AsyncLokiClient 的 Handler，参数与 LokiHandler 相同
+
+    emit 不会阻塞事件循环；程序结束前应在事件循环中 await handler.aclose()。
+    """
+
+    def create_client(self, **kwargs):
+        return AsyncLokiClient(**kwargs)
+
+    async def aclose(self):
+        super(LokiHandler, self).close()
+        await self.loki_client.close()
+
+    def close(self) -> None:
+        super(LokiHandler, self).close()
+        loop = self.loki_client.loop
+        if loop is None or loop.is_closed() or self.loki_client._closed:
+            return
+        if threading.get_ident() == self.loki_client._loop_thread:
+            loop.create_task(self.loki_client.close())
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.loki_client.close(), loop).result()
+        else:
+            warn(f"[AsyncLokiHandler]{self.get_name()} 事件循环已停止，缓存的日志无法推送.")
@@ -0,0 +1,104 @@
+"""
+自适应批次大小
+
+根据推送结果调整刷写阈值，目标是在不超过服务端限制的前提下，用尽量少的请求推送日志:
+    - 推送排队(等待推送的批次不少于推送线程数)或往返时间较长时，逐步增大批次
+    - 推送及时且没有排队时，逐步回落到初始阈值，降低日志的延迟
+    - 介于两者之间时保持不变，避免阈值来回震荡
+    - 413 时缩小批次，并把出错的大小记为上限，之后不再超过
+    - 429 时延长刷写间隔以减少请求数，之后推送成功时逐步恢复
+
+批次的估算字节数不超过 burst_size (对应 Loki 的 ingestion_burst_size_mb)，按观测到的
+压缩率换算后请求体不超过 max_request_size，日志条数不超过 max_entries。
+"""
+
+import threading
+
+GROW = 1.25  # 排队时批次的增长倍数
+DECAY = 0.8  # 空闲时向初始值回落的倍数
+EWMA_ALPHA = 0.2  # 往返时间与压缩率的平滑系数
+MAX_INTERVAL_FACTOR = 8  # 限流时刷写间隔最多延长到初始值的倍数
+MIN_BATCH_SIZE = 1024
+
+
+def _ewma(average: float | None, value: float) -> float:
+    return value if average is None else average + EWMA_ALPHA * (value - average)
+
+
+class BatchController:
+    """根据推送的往返时间、压缩率、排队深度与 413/429 调整批次阈值
+
+    max_bytes / max_entries / flush_interval 为当前阈值，刷写线程直接读取；
+    record 由推送线程在每次请求后调用。
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        flush_interval: float,
+        max_entries: int = 50000,
+        burst_size: int = 4 * 1024 * 1024,
+        max_request_size: int = 4 * 1024 * 1024,
+        workers: int = 1,
+    ):
+        self.base_size = min(batch_size, burst_size)
+        self.base_interval = flush_interval
+        self.burst_size = burst_size
+        self.max_request_size = max_request_size
+        self.workers = max(workers, 1)
+
+        self.max_bytes = self.base_size
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.size_limit = burst_size  # 收到 413 后学到的上限
+        self.rtt: float | None = None  # 推送成功的往返时间(秒)
+        self.ratio: float | None = None  # 请求体字节数 / 估算字节数
+        self.lock = threading.Lock()
+
+    def size_cap(self) -> int:
+        """当前允许的批次估算字节数上限"""
+        cap = min(self.burst_size, self.size_limit)
+        if self.ratio:
+            cap = min(cap, int(self.max_request_size / self.ratio))
+        return max(cap, MIN_BATCH_SIZE)
+
+    def record(
+        self,
+        size: int,
+        body_size: int,
+        entries: int,
+        rtt: float,
+        status: int | None,
+        backlog: int,
+    ):
+        """记录一次推送的结果
+
+        size      -- 批次的估算字节数
+        body_size -- 压缩后的请求体字节数
+        entries   -- 批次中的日志条数
+        rtt       -- 请求的往返时间(秒)
+        backlog   -- 推送完成时等待推送的批次数
+        """
+        with self.lock:
+            if status == 413:
+                self.size_limit = max(int(size * DECAY), MIN_BATCH_SIZE)
+                self.max_entries = max(min(self.max_entries, int(entries * DECAY)), 1)
+                self.max_bytes = min(self.max_bytes, self.size_cap())
+                return
+            if status == 429:
+                self.flush_interval = min(
+                    self.flush_interval * 2, self.base_interval * MAX_INTERVAL_FACTOR
+                )
+                return
+            if status is None or not 200 <= status <= 299:
+                return
+
+            if size > 0:
+                self.ratio = _ewma(self.ratio, body_size / size)
+            self.rtt = _ewma(self.rtt, rtt)
+            self.flush_interval = max(self.flush_interval * DECAY, self.base_interval)
+            if backlog >= self.workers or self.rtt >= self.base_interval / 2:
+                self.max_bytes = int(self.max_bytes * GROW)
+            elif backlog == 0 and self.rtt < self.base_interval / 8:
+                self.max_bytes = max(int(self.max_bytes * DECAY), self.base_size)
+            self.max_bytes = min(self.max_bytes, self.size_cap())
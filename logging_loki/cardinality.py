@@ -0,0 +1,56 @@
+"""
+标签基数限制
+
+record.tags 中的每个键都会成为 stream 的标签。把 user_id、request_id 之类取值很多的字段写进
+tags 时，每个取值都是一个新的 stream: 批次中只有大量单条日志的 stream，Loki 也会因 stream 数
+超限而拒绝推送。CardinalityGuard 记录每个标签键出现过的取值(最多 max_values 个)，取值超过
+max_values 个的标签键之后不再作为标签，改为写入 structuredMetadata。
+"""
+
+import threading
+from warnings import warn
+
+
+class CardinalityGuard:
+    """按标签键统计不同取值的个数，超过 max_values 的标签键降级为 metadata
+
+    每个标签键最多保存 max_values 个取值，降级后释放。已见过的取值不加锁检查，
+    只有新的取值需要加锁。
+    """
+
+    def __init__(self, max_values: int = 100):
+        self.max_values = max_values
+        self._values: dict[str, set] = {}
+        self.demoted: set[str] = set()  # 已降级的标签键
+        self.lock = threading.Lock()
+
+    def split(self, tags: dict[str, str]) -> tuple[dict, dict | None]:
+        """返回 (作为标签的, 降级为 metadata 的)，没有降级的标签时后者为 None"""
+        demoted = None
+        for key, value in tags.items():
+            if key not in self.demoted:
+                values = self._values.get(key)
+                if values is not None and value in values:
+                    continue
+                if self._add(key, value):
+                    continue
+            if demoted is None:
+                demoted = {}
+            demoted[key] = value
+        if demoted is None:
+            return tags, None
+        return {k: v for k, v in tags.items() if k not in demoted}, demoted
+
+    def _add(self, key: str, value: str) -> bool:
+        """记录新的取值，返回该标签键是否仍作为标签"""
+        with self.lock:
+            if key in self.demoted:
+                return False
+            values = self._values.setdefault(key, set())
+            values.add(value)
+            if len(values) <= self.max_values:
+                return True
+            self.demoted.add(key)
+            del self._values[key]
+        warn(f"标签 {key} 的取值超过 {self.max_values} 个，之后写入 structuredMetadata")
+        return False
@@ -0,0 +1,195 @@
+"""
+请求体的编码与压缩
+
+Loki 的 push 接口接受:
+    snappy -- protobuf，整体使用 snappy (raw block) 压缩，Content-Encoding: snappy
+    gzip   -- JSON，Content-Encoding: gzip
+    zstd   -- JSON，Content-Encoding: zstd，需要安装 zstandard，且服务端(或前置网关)支持 zstd
+auto 在这些编码中按 CPU 与字节数的代价选择，见 AutoCodec；zstd 需要服务端支持，只在明确列为候选时使用。
+"""
+
+import abc
+import gzip
+import threading
+import time
+
+import snappy
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖
+    zstandard = None
+
+MIB = 1024 * 1024
+
+
+class Codec(abc.ABC):
+    """编码方式: 序列化格式(protobuf/json) + 压缩算法"""
+
+    name = ""
+    format = "protobuf"
+    content_type = "application/x-protobuf"
+    content_encoding = ""
+    default_level: int | None = None
+
+    def __init__(self, level: int = None):
+        self.level = self.default_level if level is None else level
+
+    @property
+    def headers(self) -> dict:
+        return {"Content-Type": self.content_type, "Content-Encoding": self.content_encoding}
+
+    @abc.abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        """压缩按 format 序列化的请求体"""
+
+    def __repr__(self):
+        level = "" if self.level is None else f":{self.level}"
+        return f"<{self.__class__.__name__} {self.name}{level}>"
+
+
+class SnappyCodec(Codec):
+    name = "snappy"
+    content_encoding = "snappy"
+
+    def compress(self, data: bytes) -> bytes:
+        return snappy.compress(data)
+
+
+class GzipCodec(Codec):
+    name = "gzip"
+    format = "json"
+    content_type = "application/json"
+    content_encoding = "gzip"
+    default_level = 6
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+
+class ZstdCodec(Codec):
+    name = "zstd"
+    format = "json"
+    content_type = "application/json"
+    content_encoding = "zstd"
+    default_level = 3
+
+    def __init__(self, level: int = None):
+        if zstandard is None:
+            raise ImportError("使用 zstd 编码需要安装 zstandard: pip install zstandard")
+        super().__init__(level)
+        self._local = threading.local()  # ZstdCompressor 不是线程安全的
+
+    def compress(self, data: bytes) -> bytes:
+        try:
+            compressor = self._local.compressor
+        except AttributeError:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return compressor.compress(data)
+
+
+CODECS = {c.name: c for c in (SnappyCodec, GzipCodec, ZstdCodec)}
+
+
+def get_codec(codec: "str | Codec", level: int = None) -> Codec:
+    """由名称(可带级别，如 "gzip:9")创建编码，auto 返回 AutoCodec"""
+    if isinstance(codec, Codec):
+        return codec
+    name, _, _level = codec.partition(":")
+    if _level:
+        level = int(_level)
+    if name == "auto":
+        return AutoCodec()
+    if name not in CODECS:
+        raise ValueError(f"codec 必须是 {tuple(CODECS) + ('auto',)} 之一, 而不是 {codec}")
+    return CODECS[name](level)
+
+
+class AutoCodec(Codec):
+    """按代价在候选编码中选择
+
+    每 probe_interval 个批次用全部候选编码各编码一次，记录每字节的 CPU 时间与压缩率，
+    之后选择 cpu_seconds + body_bytes / MiB * cpu_per_mb 最低的编码。
+
+    cpu_per_mb 是愿意为少发送 1 MiB 付出的 CPU 秒数，乘以当前进程的 CPU 余量
+    (1 - 最近一段时间占用的单核比例): CPU 空闲时偏向压缩率高的编码，CPU 紧张时偏向快的编码。
+    候选编码的序列化格式不同时(snappy 为 protobuf，gzip/zstd 为 JSON)，每条日志在合并到批次时
+    按两种格式各编码一次，这部分 CPU 与内存不计入代价；只用一种格式的候选(如 ["gzip", "zstd"])可以避免。
+
+    candidates 默认为 snappy 与 gzip。Loki 本身不接受 zstd，服务端(或前置网关)支持时才把它列为候选，
+    否则选中 zstd 后的推送都会失败。
+    """
+
+    name = "auto"
+
+    def __init__(
+        self,
+        candidates: list = None,
+        cpu_per_mb: float = 0.2,
+        probe_interval: int = 50,
+    ):
+        super().__init__()
+        if candidates is None:
+            candidates = ["snappy", "gzip"]
+        self.candidates = [get_codec(c) for c in candidates]
+        self.cpu_per_mb = cpu_per_mb
+        self.probe_interval = probe_interval
+        # 编码名称 -> [每字节 CPU 秒数, 压缩率]，按 EWMA 平滑
+        self.stats: dict[str, list[float]] = {}
+        self.current = self.candidates[0]
+        self._count = 0
+        self._cpu_mark = (time.process_time(), time.monotonic())
+        self._headroom = 1.0
+        self.lock = threading.Lock()
+
+    @property
+    def format(self) -> str:
+        return self.current.format
+
+    @property
+    def headers(self) -> dict:
+        return self.current.headers
+
+    def compress(self, data: bytes) -> bytes:
+        """用 choose() 选出的编码压缩，data 需按选出后的 format 序列化"""
+        return self.choose().compress(data)
+
+    def should_probe(self) -> bool:
+        with self.lock:
+            self._count += 1
+            return (
+                len(self.stats) < len(self.candidates)
+                or self._count % self.probe_interval == 1
+            )
+
+    def record(self, codec: Codec, raw_size: int, body_size: int, cpu: float):
+        """记录一次编码的结果(raw_size 为序列化后压缩前的字节数)"""
+        if raw_size <= 0:
+            return
+        sample = [cpu / raw_size, body_size / raw_size]
+        with self.lock:
+            old = self.stats.get(codec.name)
+            if old is None:
+                self.stats[codec.name] = sample
+            else:
+                self.stats[codec.name] = [o + 0.3 * (n - o) for o, n in zip(old, sample)]
+
+    def headroom(self) -> float:
+        """进程 CPU 余量，按单核计(受 GIL 限制，压缩与编码只能使用一个核)"""
+        cpu, now = time.process_time(), time.monotonic()
+        last_cpu, last = self._cpu_mark
+        if now - last >= 1:
+            self._headroom = max(0.0, 1 - (cpu - last_cpu) / (now - last))
+            self._cpu_mark = (cpu, now)
+        return self._headroom
+
+    def choose(self) -> Codec:
+        """当前代价最低的编码"""
+        weight = self.cpu_per_mb * self.headroom() / MIB
+        with self.lock:
+            if self.stats:
+                self.current = min(
+                    (c for c in self.candidates if c.name in self.stats),
+                    key=lambda c: self.stats[c.name][0] + self.stats[c.name][1] * weight,
+                )
+        return self.current
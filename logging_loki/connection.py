@@ -0,0 +1,152 @@
+"""
+HTTP keep-alive 连接池
+
+推送线程从池中取出空闲连接，使用完归还。取出前检查连接是否仍然可用(空闲超时、
+服务端已关闭)，复用的连接在发送时发现已被服务端关闭会重连并重发一次。
+HTTPS 连接复用上一次握手得到的 TLS session，避免每次重连都进行完整握手。
+"""
+
+import select
+import ssl
+import threading
+import time
+import http.client as http_client
+from http.client import HTTPConnection, HTTPSConnection
+from urllib.parse import urlparse
+
+# 复用的连接在发送或读取响应时出现这些错误，说明连接已被服务端关闭
+STALE_ERRORS = (
+    http_client.RemoteDisconnected,
+    http_client.CannotSendRequest,
+    http_client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+class _HTTPSConnection(HTTPSConnection):
+    """握手时复用连接池保存的 TLS session"""
+
+    def __init__(self, host: str, pool: "ConnectionPool", **kwargs):
+        super().__init__(host, context=pool.ssl_context, **kwargs)
+        self.pool = pool
+
+    def connect(self):
+        HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=self.host, session=self.pool.tls_session
+        )
+
+
+class ConnectionPool:
+    """线程安全的 HTTP/HTTPS 连接池
+
+    max_size     -- 最多保留的空闲连接数
+    idle_timeout -- 空闲超过该时间(秒)的连接不再复用
+    timeout      -- socket 超时时间(秒)
+    """
+
+    def __init__(
+        self,
+        loki_url: str,
+        max_size: int = 3,
+        idle_timeout: float = 30,
+        ssl_verify: bool = True,
+        timeout: float = 30,
+    ):
+        url = urlparse(loki_url)
+        self.netloc = url.netloc
+        self.https = url.scheme.upper() == "HTTPS"
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = None
+        self.tls_session: ssl.SSLSession | None = None
+        if self.https:
+            self.ssl_context = ssl.create_default_context()
+            if not ssl_verify:
+                self.ssl_context.check_hostname = False
+                self.ssl_context.verify_mode = ssl.CERT_NONE
+        self.lock = threading.Lock()
+        self._idle: list[tuple[HTTPConnection, float]] = []
+        self.created = 0  # 建立过的连接数，用于观察复用情况
+
+    def _new_connection(self) -> HTTPConnection:
+        self.created += 1
+        if self.https:
+            return _HTTPSConnection(self.netloc, self, timeout=self.timeout)
+        return HTTPConnection(self.netloc, timeout=self.timeout)
+
+    @staticmethod
+    def is_alive(conn: HTTPConnection) -> bool:
+        """空闲连接上不应有可读数据，可读说明服务端已关闭(或发送了意外的数据)"""
+        if conn.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def get(self) -> tuple[HTTPConnection, bool]:
+        """取出一个可用的连接，返回 (连接, 是否为复用的连接)"""
+        now = time.monotonic()
+        while True:
+            with self.lock:
+                if not self._idle:
+                    break
+                conn, since = self._idle.pop()
+            if now - since < self.idle_timeout and self.is_alive(conn):
+                return conn, True
+            conn.close()
+        return self._new_connection(), False
+
+    def put(self, conn: HTTPConnection):
+        """归还连接"""
+        if conn.sock is None:
+            return
+        if self.https and getattr(conn.sock, "session", None) is not None:
+            # TLS 1.3 的 session ticket 在握手之后才到达，归还时再保存
+            self.tls_session = conn.sock.session
+        with self.lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        body: bytes = None,
+        headers: dict = None,
+        *,
+        encode_chunked=False,
+    ) -> tuple[int, http_client.HTTPMessage, bytes]:
+        """发送请求并读取完整响应，返回 (状态码, 响应头, 响应体)"""
+        while True:
+            conn, reused = self.get()
+            try:
+                conn.request(method, url, body, headers or {}, encode_chunked=encode_chunked)
+                resp = conn.getresponse()
+                resp_body = resp.read()
+            except STALE_ERRORS:
+                conn.close()
+                if reused:
+                    continue  # 复用的连接已被服务端关闭，重连后重发
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self.put(conn)
+            return resp.status, resp.headers, resp_body
+
+    def close(self):
+        with self.lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
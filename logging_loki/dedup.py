@@ -0,0 +1,80 @@
+"""
+重复日志的合并
+
+出错时同一处的 logger.error(...) 可能每秒记录成千上万次。Deduplicator 按指纹(标签、消息模板、
+异常类型与代码位置)在 window 秒的窗口内合并相同的日志: 第一次出现时立即推送，窗口内之后的重复
+只计数，窗口结束时推送一条汇总(最后一次重复的日志，metadata 中带 repeat_count)，并开始下一个
+窗口；窗口内没有重复时不再跟踪该指纹。持续的日志风暴每个窗口只推送一条。
+"""
+
+import threading
+import time
+from logging import LogRecord
+
+REPEAT_COUNT = "repeat_count"  # 汇总日志 metadata 中的重复次数
+
+
+def fingerprint(record: LogRecord, key: tuple) -> tuple:
+    """日志的指纹，key 为日志的标签键"""
+    msg = record.msg if isinstance(record.msg, str) else str(record.msg)
+    exc_type = record.exc_info[0] if record.exc_info else None
+    return key, record.levelno, record.pathname, record.lineno, msg, exc_type
+
+
+class Deduplicator:
+    """滑动窗口内相同指纹的日志只推送第一条与一条汇总
+
+    offer 由记录日志的线程调用，expire 由 LokiClient 的刷写线程定期调用。
+    跟踪的指纹超过 max_keys 时，新的指纹不再合并。
+    """
+
+    def __init__(self, window: float = 1.0, max_keys: int = 10000):
+        self.window = window
+        self.max_keys = max_keys
+        # 指纹 -> [窗口结束时间(monotonic), 重复次数, 最后一次重复的日志]，按窗口结束时间排序
+        self._seen: dict[tuple, list] = {}
+        self.suppressed = 0  # 被合并的日志数
+        self.lock = threading.Lock()
+
+    def offer(self, key: tuple, item) -> bool:
+        """返回 True 表示需要立即推送，False 表示已计入窗口内的重复"""
+        with self.lock:
+            state = self._seen.get(key)
+            if state is not None:
+                state[1] += 1
+                state[2] = item
+                self.suppressed += 1
+                return False
+            if len(self._seen) < self.max_keys:
+                self._seen[key] = [time.monotonic() + self.window, 0, None]
+            return True
+
+    def next_due(self) -> float | None:
+        """最早结束的窗口"""
+        with self.lock:
+            for state in self._seen.values():
+                return state[0]
+        return None
+
+    def expire(self, final: bool = False) -> list[tuple]:
+        """结束到期的窗口，返回需要推送的汇总 [(最后一次重复的日志, 重复次数), ...]
+
+        final 时结束所有窗口。
+        """
+        now = time.monotonic()
+        summaries = []
+        with self.lock:
+            while self._seen:
+                key, state = next(iter(self._seen.items()))
+                if state[0] > now and not final:
+                    break
+                del self._seen[key]
+                if state[1]:
+                    summaries.append((state[2], state[1]))
+                    if not final:
+                        # 仍在重复，开始下一个窗口
+                        self._seen[key] = [now + self.window, 0, None]
+        return summaries
+
+    def __len__(self):
+        return len(self._seen)
@@ -1,7 +1,11 @@
 import socket
+import time
 from logging import Formatter, LogRecord
 from typing import Any, Literal, Mapping
 
+from logging_loki.cardinality import CardinalityGuard
+from logging_loki.labels import labels_key
+
 DEFAULT_FIELD_MAX = (
     "asctime",  # 表示人类易读的 LogRecord 生成时间。 默认形式为 '2003-07-08 16:49:45,896' （逗号之后的数字为时间的毫秒部分）。
     "created",  # LogRecord 被创建的时间（即 time.time() 的返回值）。
@@ -35,13 +39,24 @@ DEFAULT_FIELD_MIN = (
 )
 
 
+_MISSING = object()
+
+
 def json_s(v):
     if isinstance(v, set):
         return list(v)
 
 
 class LokiFormatter(Formatter):
-    """"""
+    """格式化为 Loki 的 stream
+
+    初始化时预先计算不变的部分(标签键、metadata)，之后修改 tags/metadata/included_field
+    需要调用 compile。同一秒内的 asctime 与同一个异常的 traceback 只格式化一次。
+    format_entry 返回 (标签键, ts_ns, line, metadata)，供 LokiHandler 直接写入客户端。
+
+    record.tags 中不同取值超过 max_label_values 个的标签键之后写入 metadata (见 cardinality.py)，
+    max_label_values 为 0 时不限制。
+    """
 
     def __init__(
         self,
@@ -55,6 +70,7 @@ class LokiFormatter(Formatter):
         included_field: tuple | list | set = None,
         fqdn: bool = False,
         defaults: Mapping[str, Any] | None = None,
+        max_label_values: int = 100,
     ) -> None:
         super().__init__(fmt, datefmt, style, validate, defaults=defaults)
 
@@ -66,41 +82,93 @@ class LokiFormatter(Formatter):
         self.tags = tags if tags else dict()
 
         assert isinstance(
-            tags, dict | None
-        ), f"metadata 参数必须是dict or None, 而不是{type(tags)}"
+            metadata, dict | None
+        ), f"metadata 参数必须是dict or None, 而不是{type(metadata)}"
         self.metadata = metadata if metadata else dict()
 
         self.included_field = included_field if included_field else DEFAULT_FIELD_MIN
+        self.cardinality = CardinalityGuard(max_label_values) if max_label_values else None
+        self._time_cache = (None, "")  # (秒, 该秒格式化后的时间)
+        self.compile()
+
+    def compile(self):
+        """预先计算不变的标签与 metadata"""
+        self._stream = {"instance": self.hostname, **self.tags}
+        self._key = labels_key(self._stream)
+        self._metadata = {str(k): str(v) for k, v in self.metadata.items()}
+        # 按 DEFAULT_FIELD_MAX 的顺序，与 record.__dict__ 的顺序一致
+        fields = set(self.included_field)
+        self._fields = tuple(
+            [f for f in DEFAULT_FIELD_MAX if f in fields]
+            + sorted(f for f in fields if f not in DEFAULT_FIELD_MAX)
+        )
+
+    def formatTime(self, record: LogRecord, datefmt: str = None) -> str:
+        """默认格式下，同一秒内只调用一次 strftime"""
+        if datefmt:
+            return super().formatTime(record, datefmt)
+        second = int(record.created)
+        cached_second, text = self._time_cache
+        if second != cached_second:
+            text = time.strftime(self.default_time_format, self.converter(record.created))
+            self._time_cache = (second, text)
+        if self.default_msec_format:
+            return self.default_msec_format % (text, record.msecs)
+        return text
+
+    def formatException(self, ei) -> str:
+        """同一个异常(且 traceback 未变)只格式化一次，结果保存在异常对象上"""
+        exc = ei[1]
+        cached = getattr(exc, "_loki_exc_text", None)
+        if cached is not None and cached[0] is exc.__traceback__:
+            return cached[1]
+        text = super().formatException(ei)
+        try:
+            exc._loki_exc_text = (exc.__traceback__, text)
+        except AttributeError:  # 没有 __dict__ 的异常
+            pass
+        return text
+
+    def record_labels(self, record: LogRecord) -> tuple[tuple, dict | None]:
+        """日志的标签键与降级为 metadata 的 record.tags，没有 record.tags 时使用预先计算的标签键"""
+        record_tags = getattr(record, "tags", None)
+        if not record_tags or not isinstance(record_tags, dict):
+            return self._key, None
+        tags = {str(k): str(v) for k, v in record_tags.items()}
+        demoted = None
+        if self.cardinality is not None:
+            tags, demoted = self.cardinality.split(tags)
+        return labels_key({**self._stream, **tags}), demoted
+
+    def record_key(self, record: LogRecord) -> tuple:
+        """日志的标签键"""
+        return self.record_labels(record)[0]
+
+    def record_metadata(self, record: LogRecord) -> dict:
+        metadata = self._metadata.copy()
+        recode_meta = getattr(record, "metadata", None)
+        if recode_meta and isinstance(recode_meta, dict):
+            metadata.update({str(k): str(v) for k, v in recode_meta.items()})
+        for name in self._fields:
+            value = getattr(record, name, _MISSING)
+            if value is not _MISSING:
+                metadata[name] = str(value)
+        return metadata
+
+    def format_entry(self, record: LogRecord) -> tuple[tuple, int, str, dict]:
+        """返回 (标签键, ts_ns, line, metadata)"""
+        key, demoted = self.record_labels(record)
+        metadata = self.record_metadata(record)
+        if demoted:
+            for k, v in demoted.items():
+                metadata.setdefault(k, v)
+        return (
+            key,
+            int(record.created * 1_000_000_000),
+            super().format(record),
+            metadata,
+        )
 
     def format(self, record: LogRecord) -> dict:
-        record_tags = getattr(record, "tags", dict())
-        if not isinstance(record_tags, dict):
-            record_tags = dict()
-
-        recode_meta = getattr(record, "metadata", dict())
-        if not isinstance(recode_meta, dict):
-            recode_meta = dict()
-
-        metadata = {
-            **self.metadata,
-            **{str(k): str(v) for k, v in recode_meta.items()},
-            **{
-                i: str(record.__dict__[i])
-                for i in record.__dict__
-                if i in self.included_field
-            },
-        }
-        return {
-            "stream": {
-                "instance": self.hostname,
-                **self.tags,
-                **{str(k): str(v) for k, v in record_tags.items()},
-            },
-            "values": [
-                [
-                    int(record.created * 1_000_000_000),
-                    super().format(record=record),
-                    metadata,
-                ],
-            ],
-        }
+        key, ts_ns, line, metadata = self.format_entry(record)
+        return {"stream": dict(key), "values": [[ts_ns, line, metadata]]}
@@ -1,8 +1,12 @@
+import copy
+from time import perf_counter
 from warnings import warn
-from logging import Formatter, Handler
+from logging import Formatter, Handler, LogRecord
 
+from logging_loki.dedup import REPEAT_COUNT, Deduplicator, fingerprint
 from logging_loki.loki_client import LokiClient
 from logging_loki.formater import LokiFormatter
+from logging_loki.metrics import ThreadLocalHistogram, prometheus_text
 
 
 class LokiHandler(Handler):
@@ -25,12 +29,16 @@ class LokiHandler(Handler):
             included_field: tuple | list | set = None,  # 包含的logging字段，默认全部字段
             fmt: str = None,  # message的格式，默认simple
             fqdn: bool = False,  # 主机名是否是FQDN格式
+            dedup_window: float = 0,  # 合并重复日志的窗口(秒)，0 表示不合并
+            dedup_max_keys: int = 10000,  # 最多同时跟踪的重复日志指纹数
+            max_label_values: int = 100,  # record.tags 中标签键的取值超过该数时改为 metadata，0 表示不限制
             **kwargs,
     ) -> None:
         super().__init__(level)
 
         self.loki_tags = tags or {}
-        self.loki_client = LokiClient(
+        self.emit_time = ThreadLocalHistogram()  # 记录日志的线程在 emit 中花费的秒数
+        self.loki_client = self.create_client(
             loki_url=loki_url,
             username=username,
             password=password,
@@ -49,35 +57,112 @@ class LokiHandler(Handler):
                 metadata=metadata,
                 included_field=included_field,
                 fqdn=fqdn,
+                max_label_values=max_label_values,
             )
         )
+        # 配置了 lanes 时按日志选择推送通道，见 lanes.py
+        self._use_lanes = len(getattr(self.loki_client, "lanes", ())) > 1
+        # 相同的日志在窗口内只推送第一条与一条带 repeat_count 的汇总，见 dedup.py
+        self.dedup = Deduplicator(dedup_window, dedup_max_keys) if dedup_window > 0 else None
+        if self.dedup is not None:
+            self.loki_client.add_ticker(self._flush_repeats)
+
+    def create_client(self, **kwargs):
+        """创建负责推送的客户端，子类可以替换为其他实现"""
+        return LokiClient(**kwargs)
 
     def setFormatter(self, fmt: Formatter | None) -> None:
         if not isinstance(fmt, LokiFormatter):
             raise TypeError(f"fmt 必须是 LokiFormater 或其子类 [{type(fmt)}]")
 
+        # 没有重写 format 的格式化器可以直接输出 (标签键, ts_ns, line, metadata)
+        self._fast_format = (
+            type(fmt).format is LokiFormatter.format and not self.loki_client.labels
+        )
         return super().setFormatter(fmt)
 
     @staticmethod
     def is_stream(stream) -> bool:
         return isinstance(stream, dict) and "stream" in stream and "values" in stream
 
-    def emit(self, record) -> None:
-        """记录一条日志到缓存，并按需生成一个定时器，在定时器结束时将日志实际Push到Loki。
+    def handle(self, record) -> bool:
+        """与 Handler.handle 相同，但不获取 Handler 的锁。
 
-        如果在定时器开始前就已经将日志推送，则会有推送线程取消该定时器。
+        emit 只把日志写入 LokiClient 的线程缓冲区，本身是线程安全的，
+        多线程同时记录日志时不需要互相等待。
         """
+        rv = self.filter(record)
+        if isinstance(rv, LogRecord):
+            record = rv
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record) -> None:
+        """记录一条日志到缓存，由 LokiClient 的刷写线程在达到阈值或超时后推送到Loki。"""
         # noinspection PyUnresolvedReferences
         if self._closed:
             warn(f"[LokiHandler]{self.get_name()} 已经关闭，日志无法再被记录到Loki.")
             return  # 如果Handler已经关闭, 不再添加日志
 
+        started = perf_counter()
+        if self.dedup is None or self.dedup.offer(
+            fingerprint(record, self.formatter.record_key(record)), record
+        ):
+            self._ship(record)
+        self.emit_time.observe(perf_counter() - started)
+
+    def _ship(self, record) -> None:
+        """格式化并写入 LokiClient"""
+        # 其他实现的客户端(如 LokiShipper)没有通道参数
+        lane = (self.loki_client.lane_for(record),) if self._use_lanes else ()
+        if self._fast_format:
+            key, ts_ns, line, metadata = self.formatter.format_entry(record)
+            self.loki_client.push_entry(key, ts_ns, line, metadata, *lane)
+            return
+
         stream = self.formatter.format(record=record)
         if not self.is_stream(stream):
             self.handleError(record)  # "self.formatter.format 必须返回一个Dict"
             return
+        self.loki_client.push_wait(stream["stream"], stream["values"], *lane)
+
+    def _flush_repeats(self, final: bool) -> float | None:
+        """在刷写线程中推送到期窗口的汇总，汇总为最后一次重复的日志，metadata 中带重复次数"""
+        for record, count in self.dedup.expire(final):
+            summary = copy.copy(record)
+            metadata = getattr(record, "metadata", None)
+            summary.metadata = {
+                **(metadata if isinstance(metadata, dict) else {}),
+                REPEAT_COUNT: count,
+            }
+            try:
+                self._ship(summary)
+            except Exception:
+                self.handleError(summary)
+        return self.dedup.next_due()
+
+    def metrics(self) -> dict:
+        """客户端的 metrics() 加上 emit 的耗时直方图、合并的重复日志数与降级为 metadata 的标签键数
+
+        客户端没有 metrics() 时只包含 Handler 自身的指标。
+        """
+        client_metrics = getattr(self.loki_client, "metrics", None)
+        metrics = {
+            **(client_metrics() if client_metrics is not None else {}),
+            "emit_seconds": self.emit_time.snapshot(),
+        }
+        if self.dedup is not None:
+            metrics["records_collapsed_total"] = self.dedup.suppressed
+            metrics["dedup_keys"] = len(self.dedup)
+        cardinality = getattr(self.formatter, "cardinality", None)
+        if cardinality is not None:
+            metrics["label_keys_demoted_total"] = len(cardinality.demoted)
+        return metrics
 
-        self.loki_client.push_wait(stream["stream"], stream["values"])
+    def prometheus(self, prefix: str = "loki_client", labels: dict = None) -> str:
+        """metrics() 的 Prometheus 文本格式"""
+        return prometheus_text(self.metrics(), prefix, labels)
 
     def close(self) -> None:
         super().close()
@@ -0,0 +1,60 @@
+"""
+标签集合的驻留缓存
+
+同一组标签在每条日志上都会出现，而不同的标签集合通常只有几十个。labels_key 以标签的
+(key, value) 元组为键缓存其规范形式(按键排序、标签名合法化)，stream_selector 与
+stream_hash 缓存渲染好的、正确转义的 stream 选择器与稳定的 stream hash，
+每条日志只需要一次字典查找。缓存都是有界的 LRU。
+"""
+
+import re
+from functools import lru_cache
+from hashlib import blake2b
+
+CACHE_SIZE = 1024  # 缓存的标签集合数
+_INVALID_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def sanitize_name(name: str) -> str:
+    """标签名只能包含字母、数字与下划线，且不能以数字开头"""
+    name = _INVALID_NAME.sub("_", name)
+    if not name or name[0].isdigit():
+        name = "_" + name
+    return name
+
+
+def escape_value(value: str) -> str:
+    """选择器中双引号字符串的转义"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_key(items: tuple) -> tuple:
+    # 合法化后重名的标签，后出现的覆盖先出现的
+    labels = {sanitize_name(str(k)): str(v) for k, v in items}
+    return tuple(sorted(labels.items()))
+
+
+_cached_labels_key = lru_cache(maxsize=CACHE_SIZE)(_labels_key)
+
+
+def labels_key(labels: dict) -> tuple:
+    """标签的规范形式: 按键排序的 (key, value) 元组，用于合并同一 stream"""
+    items = tuple(labels.items())
+    try:
+        return _cached_labels_key(items)
+    except TypeError:  # 标签值不可哈希，不缓存
+        return _labels_key(items)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def stream_selector(key: tuple) -> str:
+    """标签键对应的 stream 选择器，如 { app="a", level="INFO" }"""
+    items = [f'{k}="{escape_value(v)}"' for k, v in key]
+    return f"{{ {', '.join(items)} }}"
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def stream_hash(key: tuple) -> int:
+    """稳定的 stream hash (uint64)，不随进程变化"""
+    digest = blake2b(stream_selector(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
@@ -0,0 +1,78 @@
+"""
+推送通道
+
+所有日志共用一个批次时，ERROR 要在一大批 INFO 之后等待 flush_interval 才推送，推送失败时也与它们
+一起丢失。LokiClient 可以配置多个通道，每个通道有独立的批次、刷写阈值与推送并发:
+
+    LokiClient(url, lanes=[Lane("error", level=logging.ERROR, flush_interval=0, workers=1)])
+
+列在前面的通道优先推送，缓存超限时最后的通道最先被丢弃；客户端总会在最后附加默认通道
+(使用 batcher 的自适应阈值)。flush_interval 为 0 的通道在日志到达时立即唤醒刷写线程，
+日志在几毫秒内推送。
+"""
+
+import logging
+import typing
+from collections import deque
+from logging import LogRecord
+
+
+class Lane:
+    """一个推送通道
+
+    level          -- 日志等级不低于 level 的日志进入该通道
+    predicate      -- 或者 predicate(record) 为真的日志进入该通道，与 level 同时设置时需要都满足
+    flush_interval -- 批次中最早的日志最多等待的秒数，None 使用 batcher 的阈值
+    max_bytes      -- 批次的估算字节数上限，None 使用 batcher 的阈值
+    max_entries    -- 批次的日志条数上限，None 使用 batcher 的阈值
+    workers        -- 最多同时推送的请求数，并为该通道预留同样数量的推送线程；None 时与其他
+                      未设置的通道(包括默认通道)共用其余的推送线程
+
+    批次状态由 LokiClient 的刷写线程维护，outbox/inflight 在持有 LokiClient._space 时修改。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        level: int | str = None,
+        predicate: typing.Callable[[LogRecord], bool] = None,
+        flush_interval: float = None,
+        max_bytes: int = None,
+        max_entries: int = None,
+        workers: int = None,
+    ):
+        self.name = name
+        if isinstance(level, str):
+            level = logging.getLevelName(level.upper())  # "ERROR" -> 40
+        self.level = level
+        self.predicate = predicate
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.workers = workers
+
+        self.streams: dict = {}  # 标签键 -> StreamBuffer
+        self.batch_size = 0
+        self.batch_entries = 0
+        self.batch_started = 0.0
+        # 等待推送的 (批次, 估算字节数, 环形缓存位置, 分区)，以及正在推送的请求数
+        self.outbox: deque[tuple[dict, int, int | None, int]] = deque()
+        self.inflight = 0
+
+    @property
+    def urgent(self) -> bool:
+        """日志到达时立即刷写"""
+        return self.flush_interval == 0
+
+    def matches(self, record: LogRecord) -> bool:
+        if self.level is not None and record.levelno < self.level:
+            return False
+        if self.predicate is not None and not self.predicate(record):
+            return False
+        return self.level is not None or self.predicate is not None
+
+    def has_capacity(self) -> bool:
+        return self.workers is None or self.inflight < self.workers
+
+    def __repr__(self):
+        return f"<Lane {self.name}>"
@@ -4,27 +4,73 @@ Loki Client for Python
 负责处理Loki上传相关事宜
 """
 
-import os
 import base64
 import threading
 import time
 import typing
-import socket
 import http.client as http_client
 from sys import version as py_version
 from urllib.parse import urlparse
-from http.client import HTTPConnection, HTTPSConnection
-from collections import defaultdict
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 
-import snappy
 
-from logging_loki import loki_push_pb2
-from logging_loki.tools import debugger_print, beautify_size
+try:
+    from logging_loki import loki_push_pb2
+except ImportError:  # 可选依赖，推送使用 wire 中的编码，不需要 protobuf 运行时
+    loki_push_pb2 = None
+from logging_loki.batcher import BatchController
+from logging_loki.compression import AutoCodec, Codec, get_codec
+from logging_loki.connection import ConnectionPool
+from logging_loki.labels import labels_key, stream_hash, stream_selector
+from logging_loki.lanes import Lane
+from logging_loki.metrics import COUNT_BUCKETS, SIZE_BUCKETS, Histogram, prometheus_text
+from logging_loki.rejects import bisect_batch, fit_line, parse_rejection, split_rejected
+from logging_loki.retry import RetryPolicy, RetryQueue, parse_retry_after
+from logging_loki.ring import MmapRing, encode_record, decode_record
+from logging_loki.spool import DiskSpool
+from logging_loki.tools import debugger_print, beautify_size, refresh_debug
+from logging_loki.wire import StreamBuffer, finalize_json, finalize_protobuf
 from logging_loki.version import __version__
 
 
 DEFAULT_UA = f"logging-loki/{__version__} Python {py_version}"
+PUSH_PATH = "/loki/api/v1/push"
+# 估算序列化大小用的固定开销: entry 的 tag/长度前缀/时间戳，metadata 的 map entry，stream 的 tag/长度前缀
+ENTRY_OVERHEAD = 16
+METADATA_OVERHEAD = 6
+STREAM_OVERHEAD = 8
+DRAIN_INTERVAL = 0.05  # 有待发送日志时，刷写线程合并各线程缓冲区的周期
+# 缓存超过 max_buffer_size 时的处理策略
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest", "sample")
+# 超过 max_line_size 的行的处理方式: 截断，或拆分为多条日志
+LINE_OVERFLOW = ("truncate", "chunk")
+# 推送失败时写入磁盘缓存的 4xx 状态码，其余 4xx 表示请求本身有误，重放也不会成功
+SPOOL_STATUS = {401, 403, 404, 408, 429}
+SPOOL_RETRY_INTERVAL = 30  # 没有新的成功推送时，重放磁盘缓存的间隔(秒)
+# metrics() 中由推送线程累加的计数器
+COUNTERS = (
+    "records_sent_total",  # 推送成功的日志条数
+    "bytes_sent_total",  # 推送成功的请求体字节数
+    "requests_total",
+    "request_errors_total",  # 连接错误与非 2xx 响应
+    "retries_total",
+    "throttled_total",  # 收到 429 的次数
+    "records_spooled_total",  # 写入磁盘缓存的日志条数
+    "records_failed_total",  # 放弃推送的日志条数
+    "batches_split_total",  # 收到 413 后对半拆分的批次数
+    "lines_truncated_total",  # 超过 max_line_size 被截断或拆分的行数
+)
+
+
+def run_tickers(tickers: list, final: bool = False) -> float | None:
+    """依次调用 ticker(final)，返回最早的下一次调用时间(monotonic)，都不需要时为 None"""
+    due = None
+    for ticker in list(tickers):
+        next_due = ticker(final)
+        if next_due is not None and (due is None or next_due < due):
+            due = next_due
+    return due
 
 
 def all_thread_ids() -> set:
@@ -35,6 +81,77 @@ class NeedRetryError(Exception):
     """"""
 
 
+class _Shard:
+    """单个线程的入队缓冲区
+
+    entries 只由所属线程追加、由持有 p_lock 的刷写方取出；
+    nbytes/enqueued/overflow/dropped/dropped_size 只由所属线程写，drained 只由刷写方写，
+    因此都不需要加锁。
+    """
+
+    __slots__ = (
+        "thread",
+        "entries",
+        "nbytes",
+        "enqueued",
+        "drained",
+        "overflow",
+        "dropped",
+        "dropped_size",
+    )
+
+    def __init__(self, thread: threading.Thread):
+        self.thread = thread
+        self.entries = deque()
+        self.nbytes = 0
+        self.enqueued = 0  # 已接收的日志数
+        self.drained = 0
+        self.overflow = 0  # 超限后到达的日志数，用于采样
+        self.dropped = 0
+        self.dropped_size = 0
+
+
+class _Payload:
+    """编码后等待推送(或等待重试)的请求体"""
+
+    __slots__ = (
+        "body",
+        "headers",
+        "size",
+        "entries",
+        "ring_end",
+        "attempts",
+        "oldest_ns",
+        "lane",
+        "partition",
+        "batch",
+    )
+
+    def __init__(
+        self,
+        body: bytes,
+        headers: dict,
+        size: int,
+        entries: int,
+        ring_end: int | None,
+        oldest_ns: int = 0,
+        lane: Lane = None,
+        partition: int = 0,
+        batch: dict = None,
+    ):
+        self.body = body
+        self.headers = headers
+        self.size = size  # 批次的估算字节数，计入 backlog_size
+        self.entries = entries
+        self.ring_end = ring_end
+        self.attempts = 0
+        self.oldest_ns = oldest_ns  # 最早一条日志的时间戳，用于统计推送时日志的延迟
+        self.lane = lane
+        self.partition = partition
+        # 未压缩的批次，推送完成前保留，用于 413/400 时拆分或修正后重新推送
+        self.batch = batch
+
+
 class LokiClient(ThreadPoolExecutor):
     """向Loki Push 数据 使用 /loki/api/v1/push
 
@@ -42,6 +159,47 @@ class LokiClient(ThreadPoolExecutor):
         1. 立即push一条数据  -- push_once
         2. 立即push多条数据  -- push_many
         3. 收到一条数据，并在合适的适合push服务器 -- push_wait
+
+    push_wait 只负责写入当前线程的缓冲区(不加锁)，由后台刷写线程(loki-flusher)
+    周期性地合并各线程缓冲区，并在以下任一条件满足时刷写:
+        1. 批次字节数超过 batcher.max_bytes (初始为 max_cache_size)
+        2. 批次日志条数达到 batcher.max_entries (初始为 max_batch_entries)
+        3. 批次stream数超过 max_cache_stream
+        4. 批次中最早的日志已经等待了 batcher.flush_interval 秒 (初始为 flush_interval)
+    batcher 根据推送的往返时间、压缩率、排队深度与 413/429 调整这些阈值(见 batcher.py)，
+    批次不超过 ingestion_burst_size 与 max_request_size。
+    没有限流时，任何日志在缓存中停留的上限为 flush_interval + DRAIN_INTERVAL 秒。
+
+    lanes 配置额外的推送通道(见 lanes.py)，每个通道有独立的批次、刷写阈值与推送并发，
+    push_entry 的 lane 参数为通道在 lanes 中的序号，LokiHandler 按日志等级选择通道。
+    排在前面的通道优先推送，默认通道在最后。
+
+    尚未推送成功的日志(线程缓冲区、当前批次、等待推送与正在推送的批次)总量不超过
+    max_buffer_size，超出时按 overflow_policy 处理:
+        block       -- 记录日志的线程等待，直到有空间
+        drop_oldest -- 丢弃最早的等待推送的批次 (默认)
+        drop_newest -- 丢弃新到达的日志
+        sample      -- 新到达的日志每 sample_rate 条保留一条
+    丢弃的数量见 dropped_records / dropped_size。
+
+    推送失败(连接错误、5xx、408、429)的请求体放入重试队列，按指数退避加随机抖动
+    等待(服务端返回 Retry-After 时以其为准)，到期后由刷写线程重新提交，最多重试
+    max_retries 次。收到 429 后，之后的批次也等到限流结束再推送。
+
+    codec 指定请求体的编码: snappy (protobuf，默认)、gzip、zstd (JSON)，可以用
+    codec_level 或 "gzip:9" 的形式指定压缩级别；auto 根据 CPU 余量与压缩后的字节数
+    在候选编码中选择(见 compression.AutoCodec)。各编码的批次数、字节数与 CPU 时间见 codec_stats。
+
+    设置 spool_dir 后，重试后依旧失败或可恢复的 4xx 错误的请求体会写入磁盘缓存，
+    在之后推送成功时(或每 SPOOL_RETRY_INTERVAL 秒)以及进程重启后按顺序重放。
+
+    metrics() 返回接收/推送/丢弃的日志数、压缩前后的字节数、批次大小与推送往返时间的
+    直方图、重试次数、排队深度等指标的快照，prometheus() 返回其 Prometheus 文本格式。
+
+    设置 ring_path 后，待发送的日志不再写入线程缓冲区，而是写入 mmap 环形缓存文件
+    (写入时加锁)，批次推送完成后才释放其在文件中的空间。进程崩溃后使用同一文件重新创建
+    LokiClient，尚未推送完成的日志会被重新推送。环形缓存写满时，block 策略等待，
+    其余策略丢弃新日志。
     """
 
     def __init__(
@@ -56,57 +214,233 @@ class LokiClient(ThreadPoolExecutor):
         ssl_verify: bool = True,
         ua: str = DEFAULT_UA,
         tags: dict = None,  # 使用的TAG
+        max_buffer_size: int = 16 * 1024 * 1024,  # 未推送日志允许的最大估算字节数
+        overflow_policy: str = "drop_oldest",  # 超出 max_buffer_size 时的处理策略
+        sample_rate: int = 10,  # sample 策略下每多少条保留一条
+        spool_dir: str = None,  # 推送失败的请求体的磁盘缓存目录，None 表示不缓存
+        spool_max_size: int = 256 * 1024 * 1024,  # 磁盘缓存的最大字节数
+        spool_fsync_interval: float = 1.0,  # 磁盘缓存两次 fsync 的最小间隔(秒)
+        ring_path: str = None,  # 待发送日志的 mmap 环形缓存文件，None 表示使用内存
+        ring_size: int = 64 * 1024 * 1024,  # 环形缓存的容量(字节)，已存在的文件沿用原容量
+        pool_idle_timeout: float = 30,  # 空闲超过该时间(秒)的连接不再复用
+        request_timeout: float = 30,  # 推送请求的 socket 超时时间(秒)
+        max_retries: int = 5,  # 推送失败后最多重试的次数
+        retry_backoff: float = 0.5,  # 第一次重试前的基础等待时间(秒)，之后每次翻倍
+        retry_max_backoff: float = 60,  # 重试等待时间的上限(秒)
+        close_timeout: float = 10,  # close 时同步重试失败的推送的最长时间(秒)
+        max_batch_entries: int = 50000,  # 每个请求最多的日志条数
+        ingestion_burst_size: int = 4 * 1024 * 1024,  # 每个请求最多的日志字节数(ingestion_burst_size_mb)
+        max_request_size: int = 4 * 1024 * 1024,  # 压缩后的请求体的最大字节数
+        codec: str | Codec = None,  # 请求体的编码，默认 snappy
+        codec_level: int = None,  # 压缩级别，None 使用编码的默认级别
+        lanes: list[Lane] = None,  # 默认通道之前的推送通道，按优先级排列
+        max_line_size: int = 256 * 1024,  # 每行日志的最大字节数(Loki 的 max_line_size)，0 表示不限制
+        line_overflow: str = "truncate",  # 超过 max_line_size 的行截断(truncate)或拆分为多条(chunk)
         **kwargs,
     ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"overflow_policy 必须是 {OVERFLOW_POLICIES} 之一, 而不是 {overflow_policy}"
+            )
+        if line_overflow not in LINE_OVERFLOW:
+            raise ValueError(
+                f"line_overflow 必须是 {LINE_OVERFLOW} 之一, 而不是 {line_overflow}"
+            )
+        if lanes and ring_path:
+            # 环形缓存按写入顺序释放空间，各通道的批次无法按顺序完成
+            raise ValueError("lanes 与 ring_path 不能同时使用")
         super().__init__(
             max(thread_pool_size, 1),
             thread_name_prefix="loki-push",
         )
         self.loki_url = urlparse(loki_url)
-        self.headers = {
-            "User-Agent": ua or DEFAULT_UA,
-            "Content-Type": "application/x-protobuf",
-            "Content-Encoding": "snappy",
-        }
+        if codec is None:
+            # 兼容旧版本的 gzipped 参数
+            codec = "gzip" if kwargs.get("gzipped") else "snappy"
+        self.codec = get_codec(codec, codec_level)
+        if isinstance(self.codec, AutoCodec):
+            self._formats = tuple(sorted({c.format for c in self.codec.candidates}))
+        else:
+            self._formats = (self.codec.format,)
+        # 编码名称 -> [批次数, 序列化后字节数, 压缩后字节数, CPU 秒数]
+        self.codec_stats: dict[str, list] = {}
+        self._stats_lock = threading.Lock()
+        self._counters = dict.fromkeys(COUNTERS, 0)  # 持有 _stats_lock 时修改
+        self.push_rtt = Histogram()  # 推送请求的往返时间(秒)
+        self.batch_records = Histogram(COUNT_BUCKETS)  # 推送成功的批次的日志条数
+        self.batch_bytes = Histogram(SIZE_BUCKETS)  # 推送成功的请求体字节数
+        self.record_age = Histogram()  # 推送成功时批次中最早的日志距其时间戳的秒数
+        self.debug = refresh_debug().upper() == "TRUE"
+        self.headers = {"User-Agent": ua or DEFAULT_UA, **self.codec.headers}
         if username:
             self.set_auth(username, password)
 
         self.__closed = False
         self.p_lock = threading.Lock()
-        self.push_request = loki_push_pb2.PushRequest()
-        self.connections = defaultdict(
-            lambda: (
-                HTTPSConnection
-                if self.loki_url.scheme.upper() == "HTTPS"
-                else HTTPConnection
-            )(self.loki_url.netloc)
+        # 各通道的当前批次: 标签键 -> 已编码的日志，合并时按 codec 需要的格式编码；
+        # 批次的估算字节数随追加增量更新
+        self.lanes: list[Lane] = [*(lanes or ()), Lane("default")]
+        self.lane = self.lanes[-1]  # 默认通道
+        # 批次按 stream hash 拆分到各分区，每个通道的每个分区同时只推送一个请求(见 _partition)
+        self.partitions = max(thread_pool_size, 1)
+        # 正在推送或等待重试的 (通道, 分区)，持有 _space 时修改
+        self._busy: set[tuple[Lane, int]] = set()
+        self.batch_size = 0  # 各通道当前批次的估算字节数之和
+        self.batch_entries = 0
+        self.pool = ConnectionPool(
+            loki_url,
+            max_size=max(thread_pool_size, 1) + 1,  # 推送线程 + 刷写线程
+            idle_timeout=pool_idle_timeout,
+            ssl_verify=ssl_verify,
+            timeout=request_timeout,
         )
 
         self.last_flush = 0
         self.max_cache_size = max_cache_size
-        self.cache_size = max_cache_size
+        self.batcher = BatchController(
+            max_cache_size,
+            flush_interval,
+            max_entries=max_batch_entries,
+            burst_size=min(ingestion_burst_size, max_buffer_size // 4),
+            max_request_size=max_request_size,
+            workers=max(thread_pool_size, 1),
+        )
         self.max_cache_stream = max_cache_stream
         self.flush_interval = flush_interval
         self.pool_size = thread_pool_size
+        # 设置了 workers 的通道预留同样数量的推送线程，其余通道共用剩下的推送线程(至少一个)
+        self._shared_workers = max(
+            max(thread_pool_size, 1)
+            - sum(lane.workers for lane in self.lanes if lane.workers is not None),
+            1,
+        )
         self.ssl_verify = ssl_verify
         self.labels = tags or {}
+        self.max_buffer_size = max_buffer_size
+        self.overflow_policy = overflow_policy
+        self.sample_rate = max(sample_rate, 1)
+        self.max_line_size = max_line_size  # 收到 Loki 的行过长错误后降为其上限
+        self.line_overflow = line_overflow
+
+        # 等待推送的批次在各通道的 outbox 中，推送线程从左侧取出；
+        # _space 在缓存减少时通知阻塞的生产者
+        self._space = threading.Condition()
+        self.outbox_size = 0
+        self.inflight_size = 0
+        self.retry_size = 0  # 重试队列中请求体对应的估算字节数
+        self._dropped = 0  # 刷写方丢弃的记录数与字节数，以及已回收线程缓冲区的计数
+        self._dropped_size = 0
+        # 写入环形缓存的日志数(持有 _ring_lock)与已回收线程缓冲区接收的日志数(持有 _space)，
+        # 两者不会同时出现: 使用环形缓存时不创建线程缓冲区
+        self._enqueued = 0
+
+        self.spool = (
+            DiskSpool(
+                spool_dir,
+                max_size=spool_max_size,
+                fsync_interval=spool_fsync_interval,
+            )
+            if spool_dir
+            else None
+        )
+        self.retry_policy = RetryPolicy(max_retries, retry_backoff, retry_max_backoff)
+        self.close_timeout = close_timeout
+        self._close_deadline = float("inf")  # close 后同步重试的截止时间(monotonic)
+        self._retries = RetryQueue()
+        self._throttled_until = 0.0  # 收到 429 后，在此之前(monotonic)不推送新的批次
+        self._replay_lock = threading.Lock()
+        self._last_replay = -float("inf")
+
+        self.ring = MmapRing(ring_path, ring_size) if ring_path else None
+        self._ring_lock = threading.Lock()
+        self._ring_read = self.ring.head if self.ring else 0  # 已合并到批次的位置
+        # 已刷写批次在环形缓存中的结束位置与尚未推送完成的分区数，按顺序释放空间
+        self._ring_batches: deque[list] = deque()
+
+        # 由刷写线程定期调用的函数，见 add_ticker
+        self._tickers: list[typing.Callable[[bool], float | None]] = []
+        self._next_tick: float | None = None
+
+        self._local = threading.local()
+        self._shards: list[_Shard] = []
+        self._shards_lock = threading.Lock()
+        # 磁盘缓存或环形缓存中有数据时，启动后立即重放
+        self._idle = not self.spool and not self._ring_pending()
+        self._wakeup = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name="loki-flusher", daemon=True
+        )
+        self._flusher.start()
 
     def close(self):
+        self._tick(final=True)  # 在停止接收日志之前，写入 ticker 中尚未推送的日志
+        self._close_deadline = time.monotonic() + self.close_timeout
         self.__closed = True
+        self._wakeup.set()
+        if self._flusher is not threading.current_thread():
+            self._flusher.join()
         self.flush()
         self.shutdown(wait=True)
+        self._retry_due(final=True)  # 等待重试的请求体再推送一次，失败时写入磁盘缓存
+        if self.spool is not None:
+            self.spool.close()
+        if self.ring is not None:
+            self.ring.close()
+        self.pool.close()
 
     def __exit__(self):
         self.close()
 
+    @property
+    def streams(self) -> dict[tuple, StreamBuffer]:
+        """默认通道的当前批次"""
+        return self.lane.streams
+
+    @property
+    def outbox_batches(self) -> int:
+        """等待推送的批次数"""
+        return sum(len(lane.outbox) for lane in self.lanes)
+
+    def lane_for(self, record) -> int:
+        """日志所属的通道序号，没有匹配的通道时为默认通道(-1)"""
+        for i in range(len(self.lanes) - 1):
+            if self.lanes[i].matches(record):
+                return i
+        return -1
+
+    @property
+    def backlog_size(self) -> int:
+        """已合并但尚未推送成功的估算字节数"""
+        return self.batch_size + self.outbox_size + self.inflight_size + self.retry_size
+
+    @property
+    def dropped_records(self) -> int:
+        return self._dropped + sum(s.dropped for s in list(self._shards))
+
+    @property
+    def dropped_size(self) -> int:
+        return self._dropped_size + sum(s.dropped_size for s in list(self._shards))
+
     def set_auth(self, username: str, password: str = ""):
         b64 = base64.b64encode(f"{username}:{password}".encode()).decode()
         self.headers["Authorization"] = f"Basic {b64}"
 
     @staticmethod
-    def label_to_string(labels: dict):
-        items = [f'{k}="{v}"' for k, v in labels.items()]
-        return f"{{ {', '.join(items)} }}"
+    def label_to_string(labels: dict) -> str:
+        """按键排序、转义后的 stream 选择器(有缓存)"""
+        return stream_selector(labels_key(labels))
+
+    # 标签的规范形式: 按键排序的 (key, value) 元组，用于合并同一stream(有缓存)
+    labels_key = staticmethod(labels_key)
+
+    @staticmethod
+    def entry_size(line: str, metadata: dict | None) -> int:
+        """估算一条日志序列化后的字节数(按字符数计，不做编码)"""
+        size = ENTRY_OVERHEAD + len(line)
+        if metadata:
+            for k, v in metadata.items():
+                size += METADATA_OVERHEAD + len(k) + len(v)
+        return size
 
     def push_many(self, streams: list[dict, list[list]]):
         [self.push_wait(d, l) for d, l in streams]
@@ -119,68 +453,742 @@ class LokiClient(ThreadPoolExecutor):
     def push_wait(
         self,
         labels: dict,
-        lines: list[list[loki_push_pb2.Timestamp, str, typing.Optional[dict]]],
+        lines: list[list[int, str, typing.Optional[dict]]],
+        lane: int = -1,
     ):
         """"""
+        key = self.labels_key({**labels, **self.labels})
+        for line in lines:
+            self.push_entry(
+                key, line[0], line[1], line[2] if len(line) >= 3 else None, lane
+            )
+
+    def push_entry(
+        self,
+        key: tuple,
+        ts_ns: int,
+        line: str,
+        metadata: dict | None = None,
+        lane: int = -1,
+    ):
+        """缓存一条日志，只保存轻量的元组，编码在刷写线程合并批次时完成，压缩在推送线程中完成
+
+        key: labels_key 返回的标签键
+        lane: 通道在 lanes 中的序号，默认为默认通道(使用环形缓存时总是默认通道)
+        """
         if self.__closed:
             raise RuntimeError()
 
-        labels.update(self.labels)
-        stream = loki_push_pb2.StreamAdapter(labels=self.label_to_string(labels))
+        size = self.entry_size(line, metadata)
+        if self.ring is not None:
+            return self._push_ring(key, ts_ns, line, metadata, size)
 
-        for line in lines:
-            # debugger_print("> Push Line:", line)
-            stream.entries.append(
-                loki_push_pb2.EntryAdapter(
-                    timestamp=loki_push_pb2.Timestamp(
-                        seconds=line[0] // 1_000_000_000,
-                        nanos=line[0] % 1_000_000_000,
-                    ),
-                    line=line[1],
-                    structuredMetadata=(
-                        line[2] if len(line) >= 3 and line[2] is not None else dict()
-                    ),
+        shard = self._shard()
+        if (
+            self.backlog_size + shard.nbytes - shard.drained + size
+            > self.max_buffer_size
+            and not self._accept_overflow(shard, size)
+        ):
+            return
+        shard.entries.append((key, ts_ns, line, metadata, size, lane))
+        shard.nbytes += size
+        shard.enqueued += 1
+        # 空闲时需要唤醒刷写线程开始计时；本线程缓存达到阈值或需要立即刷写的通道时立即唤醒刷写
+        if (
+            self._idle
+            or shard.nbytes - shard.drained > self.max_cache_size
+            or (lane != -1 and self.lanes[lane].urgent)
+        ):
+            if not self._wakeup.is_set():
+                self._idle = False
+                self._wakeup.set()
+
+    def _push_ring(self, key, ts_ns, line, metadata, size):
+        """写入环形缓存，写满时按策略等待或丢弃"""
+        payload = encode_record(key, ts_ns, line, metadata)
+        if not self.ring.fits(payload):
+            # 超过环形缓存容量的记录永远无法写入，直接丢弃
+            debugger_print(f"日志 {beautify_size(len(payload))} 超过环形缓存的容量，已丢弃")
+            with self._space:
+                self._dropped += 1
+                self._dropped_size += size
+            return
+        with self._ring_lock:
+            ok = self.ring.append(payload)
+            self._enqueued += ok
+        while not ok:
+            if self.overflow_policy != "block" or self.__closed:
+                with self._space:
+                    self._dropped += 1
+                    self._dropped_size += size
+                return
+            self._wakeup.set()
+            with self._space:
+                self._space.wait(DRAIN_INTERVAL)
+            with self._ring_lock:
+                ok = self.ring.append(payload)
+                self._enqueued += ok
+        if self._idle or self.ring.tail - self._ring_read > self.max_cache_size:
+            if not self._wakeup.is_set():
+                self._idle = False
+                self._wakeup.set()
+
+    def _ring_pending(self) -> bool:
+        return self.ring is not None and self.ring.tail > self._ring_read
+
+    def _ring_release(self, end: int):
+        """批次推送完成(或被丢弃)，按顺序释放环形缓存的空间"""
+        with self._ring_lock:
+            for item in self._ring_batches:
+                if item[0] == end:
+                    item[1] -= 1
+                    break
+            while self._ring_batches and not self._ring_batches[0][1]:
+                self.ring.head = self._ring_batches.popleft()[0]
+
+    def _accept_overflow(self, shard: _Shard, size: int) -> bool:
+        """缓存超限时按策略决定是否接收新日志"""
+        policy = self.overflow_policy
+        if policy == "drop_oldest":
+            return True  # 由刷写方丢弃最早的批次
+        if policy == "block":
+            self._wakeup.set()
+            with self._space:
+                while not self.__closed:
+                    pending = self.backlog_size + shard.nbytes - shard.drained
+                    # 单条日志超过 max_buffer_size 时永远等不到足够的空间，缓存为空时接收
+                    if pending + size <= self.max_buffer_size or not pending:
+                        break
+                    self._space.wait(DRAIN_INTERVAL)
+            return True
+        if policy == "sample":
+            shard.overflow += 1
+            if shard.overflow % self.sample_rate == 1 or self.sample_rate == 1:
+                return True
+        shard.dropped += 1
+        shard.dropped_size += size
+        return False
+
+    def _shard(self) -> "_Shard":
+        """当前线程的入队缓冲区"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._shards_lock:
+                self._shards.append(shard)
+            return shard
+
+    def _drain(self) -> int:
+        """将各线程缓冲区中的日志合并到当前批次，调用方需持有 p_lock
+
+        通道的批次达到字节数或条数上限时立即移入 outbox，之后的日志进入新的批次；
+        返回移入 outbox 的批次数，调用方需为每个批次提交一次 _push_next。
+        """
+        cut = 0
+        for shard in list(self._shards):
+            queue = shard.entries
+            for _ in range(len(queue)):
+                key, ts_ns, line, metadata, size, lane = queue.popleft()
+                lane = self.lanes[lane]
+                self._add_to_batch(key, ts_ns, line, metadata, size, lane)
+                shard.drained += size
+                if self._batch_full(lane):
+                    cut += self._cut_batch(lane)
+        if self.ring is not None:
+            for record, end in self.ring.read(self._ring_read):
+                key, ts_ns, line, metadata = decode_record(record)
+                record.release()
+                self._add_to_batch(
+                    key, ts_ns, line, metadata, self.entry_size(line, metadata), self.lane
                 )
-            )
+                self._ring_read = end
+                if self._batch_full(self.lane):
+                    cut += self._cut_batch(self.lane)
+        return cut
 
-        with self.p_lock:
-            self.push_request.streams.append(stream)
-        if self.shoud_flush():
-            self.flush()
-
-    def shoud_flush(self) -> bool:
-        """判定需要刷写的条件"""
-        if self._work_queue.qsize() > 1:
-            self.max_cache_size *= 2
+    def _add_to_batch(self, key, ts_ns, line, metadata, size, lane: Lane):
+        lines = None
+        # 字符数的 4 倍不超过上限时 UTF-8 编码一定不超过，不需要编码检查
+        if self.max_line_size and len(line) > self.max_line_size >> 2:
+            lines = fit_line(line, self.max_line_size, self.line_overflow == "chunk")
+            if lines[0] is line:
+                lines = None
+            else:
+                self._count(lines_truncated_total=1)
+                line = lines.pop()
+        streams = lane.streams
+        if not streams:
+            lane.batch_started = time.monotonic()
+        # 相同标签的日志合并到同一个stream中
+        entries = streams.get(key)
+        if entries is None:
+            entries = streams[key] = StreamBuffer(self._formats)
+            # stream 自身的tag与长度前缀、标签字符串，按估算计入
+            size += STREAM_OVERHEAD + sum(len(k) + len(v) + 5 for k, v in key)
+        count = 1
+        if lines:
+            for part in lines:
+                entries.append(ts_ns, part, metadata)
+            count += len(lines)
+        entries.append(ts_ns, line, metadata)
+        lane.batch_size += size
+        lane.batch_entries += count
+        self.batch_size += size
+        self.batch_entries += count
+
+    def _prune_shards(self):
+        """移除已退出线程的空缓冲区"""
+        with self._shards_lock:
+            shards = []
+            for s in self._shards:
+                if s.entries or s.thread.is_alive():
+                    shards.append(s)
+                else:
+                    with self._space:
+                        self._dropped += s.dropped
+                        self._enqueued += s.enqueued
+                        self._dropped_size += s.dropped_size
+            self._shards = shards
+
+    def _check_idle(self):
+        """没有任何待发送日志时进入空闲状态，由下一条日志唤醒刷写线程"""
+        if self.batch_entries:
+            return
+        self._idle = True
+        # 先置空闲再检查，避免与生产者的竞争导致丢失唤醒
+        if any(s.entries for s in self._shards) or self._ring_pending():
+            self._idle = False
+
+    def add_ticker(self, ticker: typing.Callable[[bool], float | None]):
+        """注册由刷写线程调用的函数 ticker(final)，返回下一次需要调用的时间(monotonic)或 None
+
+        刷写线程每次醒来时调用，且最晚在返回的时间醒来；close 时以 final=True 再调用一次。
+        ticker 可以在其中调用 push_entry。
+        """
+        self._tickers.append(ticker)
+        self._wakeup.set()
+
+    def _tick(self, final: bool = False):
+        self._next_tick = run_tickers(self._tickers, final)
+
+    def _flush_timeout(self) -> float | None:
+        """刷写线程下一次检查前的等待时间，空闲时一直等待(有磁盘缓存时定期重放)
+
+        有等待中的重试或 ticker 时，最多等到最早的重试或 ticker 到期。
+        """
+        now = time.monotonic()
+        if self._idle:
+            timeout = SPOOL_RETRY_INTERVAL if self.spool else None
+        elif not self.batch_entries:
+            timeout = DRAIN_INTERVAL
         else:
-            self.max_cache_size = self.cache_size
+            deadline = min(
+                lane.batch_started + self._flush_interval(lane)
+                for lane in self.lanes
+                if lane.streams
+            )
+            timeout = max(min(deadline - now, DRAIN_INTERVAL), 0)
+        for due in (self._retries.next_due(), self._next_tick):
+            if due is not None:
+                wait = max(due - now, 0)
+                timeout = wait if timeout is None else min(timeout, wait)
+        return timeout
+
+    def _flush_loop(self):
+        """后台刷写线程"""
+        while not self.__closed:
+            self._wakeup.wait(self._flush_timeout())
+            self._wakeup.clear()
+            if self.__closed:
+                break
+            try:
+                if self._tickers:
+                    self._tick()
+                with self.p_lock:
+                    cut = self._drain()
+                for _ in range(cut):
+                    self._submit(self._push_next)
+                lanes = [lane for lane in self.lanes if self.shoud_flush(lane)]
+                if lanes:
+                    self.flush(lanes)
+                    self._prune_shards()
+                self._retry_due()
+                if (
+                    self.spool is not None
+                    and time.monotonic() - self._last_replay >= SPOOL_RETRY_INTERVAL
+                    and self.spool
+                ):
+                    self._submit(self._replay_spool)
+                self._check_idle()
+            except Exception as _e:
+                print("[ClassName:]", _e.__class__, "[Message:]", _e)
+
+    def _flush_interval(self, lane: Lane) -> float:
+        return self.batcher.flush_interval if lane.flush_interval is None else lane.flush_interval
+
+    def shoud_flush(self, lane: Lane = None) -> bool:
+        """判定通道(默认为任一通道)需要刷写的条件，未在通道中指定的阈值由 batcher 根据推送结果调整"""
+        batcher = self.batcher
+        # 线程缓冲区超过该值时立即唤醒刷写线程
+        self.max_cache_size = batcher.max_bytes
+        if lane is None:
+            return any(self.shoud_flush(lane) for lane in self.lanes)
+        if not lane.streams:
+            return False
         return (
-            self.push_request.ByteSize() > self.max_cache_size
-            or len(self.push_request.streams) > self.max_cache_stream
-            or time.time() - self.last_flush > self.flush_interval
+            self._batch_full(lane)
+            or len(lane.streams) > self.max_cache_stream
+            or time.monotonic() - lane.batch_started >= self._flush_interval(lane)
         )
 
-    def flush(self):
-        """提交"""
+    def _batch_full(self, lane: Lane) -> bool:
+        """通道的批次超过字节数上限或达到条数上限"""
+        batcher = self.batcher
+        max_bytes = batcher.max_bytes if lane.max_bytes is None else lane.max_bytes
+        max_entries = batcher.max_entries if lane.max_entries is None else lane.max_entries
+        return lane.batch_size > max_bytes or lane.batch_entries >= max_entries
+
+    def flush(self, lanes: list[Lane] = None):
+        """取出各通道(或指定通道)的当前批次，交给推送线程编码、压缩并提交"""
         with self.p_lock:
-            _push_size = self.push_request.ByteSize()
-            if _push_size == 0:
-                return
-            # debugger_print("> Push Data: ", self.push_request.SerializeToString())
-            count_request = len(self.push_request.streams)
-            push_req_data: bytes = snappy.compress(
-                self.push_request.SerializeToString()
+            flushed = self._drain()
+            for lane in lanes or self.lanes:
+                flushed += self._cut_batch(lane)
+
+        for _ in range(flushed):
+            self._submit(self._push_next)
+
+    def _cut_batch(self, lane: Lane) -> int:
+        """把通道的当前批次按分区移入 outbox，返回移入的批次数，调用方需持有 p_lock"""
+        if not lane.streams:
+            return 0
+        batch, lane.streams = lane.streams, {}
+        size, lane.batch_size = lane.batch_size, 0
+        self.batch_size -= size
+        self.batch_entries -= lane.batch_entries
+        lane.batch_entries = 0
+        parts = self._partition(batch, size)
+        ring_end = None
+        if self.ring is not None:  # 使用环形缓存时只有默认通道
+            ring_end = self._ring_read
+            with self._ring_lock:
+                self._ring_batches.append([ring_end, len(parts)])
+        with self._space:
+            for partition, part, part_size in parts:
+                lane.outbox.append((part, part_size, ring_end, partition))
+                self.outbox_size += part_size
+            if self.overflow_policy == "drop_oldest":
+                self._drop_oldest()
+        self.last_flush = time.time()
+        return len(parts)
+
+    def _partition(self, batch: dict, size: int) -> list[tuple[int, dict, int]]:
+        """按 stream hash 把批次拆分到各分区，返回 [(分区, 批次, 估算字节数), ...]
+
+        同一通道同一分区的批次依次推送，同一通道内同一个 stream 的日志总是按刷写顺序推送。
+        分区按通道区分，默认通道的请求(包括等待重试的请求)不会阻塞其他通道；代价是同一个
+        stream 分别进入不同通道的日志之间不保证顺序，例如 ERROR 可能先于更早的 INFO 到达。
+        估算字节数按各分区已编码的字节数分配。
+        """
+        if self.partitions == 1:
+            return [(0, batch, size)]
+        parts: dict[int, dict] = {}
+        for key, stream in batch.items():
+            parts.setdefault(stream_hash(key) % self.partitions, {})[key] = stream
+        if len(parts) == 1:
+            return [(*parts, batch, size)]
+        sizes = self._shares(size, list(parts.values()))
+        return [(p, part, part_size) for (p, part), part_size in zip(parts.items(), sizes)]
+
+    def _shares(self, size: int, batches: list[dict]) -> list[int]:
+        """按各批次已编码的字节数分配估算字节数，余数计入最后一个批次"""
+        fmt = self._formats[0]
+        encoded = [sum(len(s.data[fmt]) for s in batch.values()) for batch in batches]
+        total = sum(encoded) or 1
+        sizes = [size * n // total for n in encoded[:-1]]
+        return [*sizes, size - sum(sizes)]
+
+    def _drop_oldest(self):
+        """从优先级最低的通道开始丢弃最早的等待推送的批次直到不超限，调用方需持有 _space"""
+        for lane in reversed(self.lanes):
+            while (
+                lane.outbox
+                and self.outbox_batches > 1
+                and self.backlog_size > self.max_buffer_size
+            ):
+                batch, size, ring_end, _ = lane.outbox.popleft()
+                self.outbox_size -= size
+                self._dropped += sum(len(e) for e in batch.values())
+                self._dropped_size += size
+                if ring_end is not None:
+                    self._ring_release(ring_end)
+                debugger_print(f"缓存超限，丢弃{lane.name}通道最早的批次 {beautify_size(size)}")
+
+    def _next_batch(self) -> tuple[Lane, int] | None:
+        """优先级最高、推送数未达上限的通道中，最早的所属(通道, 分区)空闲的批次，调用方需持有 _space
+
+        未设置 workers 的通道合计最多占用 _shared_workers 个推送线程，其余留给设置了 workers 的通道。
+        """
+        shared = sum(lane.inflight for lane in self.lanes if lane.workers is None)
+        for lane in self.lanes:
+            if not lane.outbox or not lane.has_capacity():
+                continue
+            if lane.workers is None and shared >= self._shared_workers:
+                continue
+            for i, item in enumerate(lane.outbox):
+                if (lane, item[3]) not in self._busy:
+                    return lane, i
+        return None
+
+    def _push_next(self):
+        """推送线程: 取出一个等待推送的批次并推送
+
+        每个通道的每个分区同时只有一个请求在推送或等待重试，完成后再推送该分区的下一个批次。
+        """
+        with self._space:
+            found = self._next_batch()
+            if found is None:
+                return  # 已被丢弃，或由正在推送的请求完成后继续
+            lane, i = found
+            batch, size, ring_end, partition = lane.outbox[i]
+            del lane.outbox[i]
+            self._busy.add((lane, partition))
+            lane.inflight += 1
+            self.outbox_size -= size
+            self.inflight_size += size
+        entries = sum(len(e) for e in batch.values())
+        oldest_ns = min((min(e.ts) for e in batch.values() if len(e)), default=0)
+        payload = _Payload(
+            None, None, size, entries, ring_end, oldest_ns, lane, partition, batch
+        )
+        try:
+            payload.body, payload.headers = self._encode_batch(batch)
+        except BaseException:
+            self._finish(payload)
+            raise
+        self._send(payload)
+
+    @classmethod
+    def build_push_request(cls, batch: dict[tuple, list[tuple]]):
+        """由 标签键 -> [(ts_ns, line, metadata), ...] 构建 PushRequest，需要安装 protobuf
+
+        与 wire 的编码相同，各 stream 内的日志按时间戳排序。
+        """
+        if loki_push_pb2 is None:
+            raise ImportError("build_push_request 需要安装 protobuf: pip install protobuf")
+        push_request = loki_push_pb2.PushRequest()
+        for key, entries in batch.items():
+            stream = push_request.streams.add(
+                labels=stream_selector(key), hash=stream_hash(key)
             )
-            self.last_flush = time.time()
-            self.push_request.Clear()
+            for ts_ns, line, metadata in sorted(entries, key=lambda e: e[0]):
+                stream.entries.add(
+                    timestamp=loki_push_pb2.Timestamp(
+                        seconds=ts_ns // 1_000_000_000,
+                        nanos=ts_ns % 1_000_000_000,
+                    ),
+                    line=line,
+                    structuredMetadata=metadata or {},
+                )
+        return push_request
 
-        if os.getenv("LOKI_LOGGING_DEBUG", "").upper() == "TRUE":
+    @classmethod
+    def serialize(
+        cls, batch: dict[tuple, StreamBuffer], fmt: str, release: bool = False
+    ) -> bytearray:
+        """拼接批次中已编码的日志，得到 protobuf 或 json 格式的请求体(未压缩)
+
+        release: 拼接后释放各 stream 的编码
+        """
+        if fmt == "json":
+            return finalize_json(batch, release)
+        return finalize_protobuf(batch, release)
+
+    def _compress(self, codec: Codec, batch, serialized: dict) -> tuple[bytes, int, float]:
+        """序列化(同一格式只序列化一次)并压缩，返回 (请求体, 序列化后字节数, CPU 秒数)"""
+        if codec.format not in serialized:
+            started = time.thread_time()
+            # 不释放各 stream 的编码，推送被拒绝(413/400)时据此拆分批次
+            data = self.serialize(batch, codec.format)
+            serialized[codec.format] = data, time.thread_time() - started
+        data, cpu = serialized[codec.format]
+        started = time.thread_time()
+        body = codec.compress(memoryview(data))
+        return body, len(data), cpu + time.thread_time() - started
+
+    def _encode_batch(self, batch: dict[tuple, list[tuple]]) -> tuple[bytes, dict]:
+        """在推送线程中执行: 编码、压缩，返回 (请求体, 请求头)"""
+        codec = self.codec
+        serialized = {}
+        results = {}
+        if isinstance(codec, AutoCodec):
+            if codec.should_probe():
+                # 用全部候选编码各编码一次，更新代价
+                for candidate in codec.candidates:
+                    results[candidate.name] = result = self._compress(
+                        candidate, batch, serialized
+                    )
+                    codec.record(candidate, result[1], len(result[0]), result[2])
+            codec = codec.choose()
+        push_req_data, raw_size, cpu = results.get(codec.name) or self._compress(
+            codec, batch, serialized
+        )
+        with self._stats_lock:
+            stats = self.codec_stats.setdefault(codec.name, [0, 0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += raw_size
+            stats[2] += len(push_req_data)
+            stats[3] += cpu
+        if self.debug:
             print(
-                f"[{time.strftime('%Y-%m-%d %H:%M:%S.')}]LOKI LOGGING flush logs {count_request}, "
-                f"data size {beautify_size(len(push_req_data))}"
+                f"[{time.strftime('%Y-%m-%d %H:%M:%S.')}]LOKI LOGGING flush logs "
+                f"{sum(len(e) for e in batch.values())}, "
+                f"data size {beautify_size(len(push_req_data))} ({codec.name})"
             )
+        return push_req_data, codec.headers
+
+    def _send(self, payload: "_Payload") -> bool:
+        """推送一个请求体
+
+        可重试的失败放入重试队列，由刷写线程到期后重新提交，不占用推送线程；
+        close 之后没有刷写线程，在当前线程等待后重试，直到 close_timeout 到期。
+        不再重试且可恢复的失败写入磁盘缓存。
+        """
+        now = time.monotonic()
+        if now < self._throttled_until and not self.__closed:
+            # 服务端限流中，推迟到限流结束，不计入重试次数
+            self._schedule_retry(payload, self._throttled_until - now)
+            return False
+        started = time.monotonic()
+        errors = []
+        status, retry_after = self._request(
+            "POST", PUSH_PATH, payload.body, payload.headers, errors=errors
+        )
+        rtt = time.monotonic() - started
+        self.push_rtt.observe(rtt)
+        self.batcher.record(
+            payload.size,
+            len(payload.body),
+            payload.entries,
+            rtt,
+            status,
+            self.outbox_batches,
+        )
+        try:
+            if status is not None and 200 <= status <= 299:
+                self._count(
+                    records_sent_total=payload.entries,
+                    bytes_sent_total=len(payload.body),
+                )
+                self.batch_records.observe(payload.entries)
+                self.batch_bytes.observe(len(payload.body))
+                if payload.oldest_ns:
+                    self.record_age.observe((time.time_ns() - payload.oldest_ns) / 1e9)
+                if self.spool is not None and not self.__closed and self.spool:
+                    self._submit(self._replay_spool)
+                return True
+            if (
+                status in (400, 413)
+                and payload.batch is not None
+                and self._salvage(payload, status, "".join(errors))
+            ):
+                return False
+            policy = self.retry_policy
+            remaining = self._close_deadline - time.monotonic()
+            if (
+                policy.should_retry(status)
+                and payload.attempts < policy.max_retries
+                and (not self.__closed or remaining > 0)
+            ):
+                delay = policy.delay(payload.attempts, status, retry_after)
+                if self.__closed:
+                    delay = min(delay, remaining)
+                    debugger_print(f"推送失败 {status}, 关闭中, {delay:.2f}s后重试")
+                    self._count(retries_total=1, throttled_total=status == 429)
+                    payload.attempts += 1
+                    time.sleep(delay)
+                    retry, payload = payload, None
+                    return self._send(retry)
+                if status == 429:
+                    # 限流对所有请求生效，之后的批次也等到限流结束再推送
+                    self._throttled_until = max(self._throttled_until, now + delay)
+                    self._count(throttled_total=1)
+                debugger_print(f"推送失败 {status}, {delay:.2f}s后重试")
+                self._count(retries_total=1)
+                payload.attempts += 1
+                self._schedule_retry(payload, delay)
+                payload = None
+                return False
+            if status == 429:
+                self._count(throttled_total=1)
+            if self.spool is not None and self.is_recoverable(status):
+                self.spool.append(payload.body, payload.headers)
+                self._last_replay = time.monotonic()  # 刚失败过，等待下一次成功推送或定期重放
+                self._count(records_spooled_total=payload.entries)
+            else:
+                self._count(records_failed_total=payload.entries)
+            return False
+        finally:
+            if payload is not None:
+                self._finish(payload)
+
+    def _salvage(self, payload: "_Payload", status: int, text: str) -> bool:
+        """413 时对半拆分批次，400 时只处理被拒绝的日志，需要推送的批次放回所属通道的队首
+
+        返回 False 表示无法处理(只有一条日志仍然过大，或无法识别 400 的错误信息)，整个批次按失败处理。
+        """
+        if status == 413:
+            halves = bisect_batch(payload.batch)
+            if not halves:
+                return False
+            debugger_print(f"请求体过大，拆分 {payload.entries} 条日志后重新推送")
+            self._count(batches_split_total=1)
+            self._requeue(payload, halves, payload.size)
+            return True
+        rejection = parse_rejection(text)
+        if rejection is None:
+            return False
+        if rejection.max_line_size and (
+            not self.max_line_size or rejection.max_line_size < self.max_line_size
+        ):
+            self.max_line_size = rejection.max_line_size  # 之后的行在合并到批次时截断
+        resend, fixed, rejected = split_rejected(
+            payload.batch, rejection, self.line_overflow == "chunk"
+        )
+        debugger_print(f"Loki 拒绝了 {rejected + fixed} 条日志，其中 {fixed} 条截断后重新推送")
+        self._count(
+            records_sent_total=payload.entries - rejected - fixed,
+            records_failed_total=rejected,
+            lines_truncated_total=fixed,
+        )
+        if resend:
+            self._requeue(payload, [resend], payload.size * fixed // max(payload.entries, 1))
+        return True
+
+    def _requeue(self, payload: "_Payload", batches: list[dict], size: int):
+        """把由 payload 拆分出的批次放回所属通道的队首，在原分区中先于之后的批次推送"""
+        if payload.ring_end is not None:
+            with self._ring_lock:
+                for item in self._ring_batches:
+                    if item[0] == payload.ring_end:
+                        item[1] += len(batches)
+                        break
+        lane = payload.lane or self.lane
+        with self._space:
+            sizes = self._shares(size, batches)
+            for batch, batch_size in reversed(list(zip(batches, sizes))):
+                lane.outbox.appendleft(
+                    (batch, batch_size, payload.ring_end, payload.partition)
+                )
+                self.outbox_size += batch_size
+
+    def _count(self, **values: int):
+        """累加计数器"""
+        with self._stats_lock:
+            for name, value in values.items():
+                self._counters[name] += value
+
+    def metrics(self) -> dict:
+        """推送过程的指标快照
+
+        *_total 为计数器，直方图为 {"buckets": {上界: 累计数}, "sum": 总和, "count": 次数}，
+        其余为当前值。
+        """
+        shards = list(self._shards)
+        with self._stats_lock:
+            snapshot = dict(self._counters)
+            codec_stats = [list(stats) for stats in self.codec_stats.values()]
+        snapshot.update(
+            records_enqueued_total=self._enqueued + sum(s.enqueued for s in shards),
+            records_dropped_total=self.dropped_records,
+            bytes_dropped_total=self.dropped_size,
+            batches_encoded_total=sum(s[0] for s in codec_stats),
+            bytes_raw_total=sum(s[1] for s in codec_stats),
+            bytes_compressed_total=sum(s[2] for s in codec_stats),
+            compress_seconds_total=sum(s[3] for s in codec_stats),
+            queue_records=sum(len(s.entries) for s in shards) + self.batch_entries,
+            outbox_batches=self.outbox_batches,
+            retry_batches=len(self._retries),
+            backlog_bytes=self.backlog_size,
+            spool_bytes=self.spool.size if self.spool is not None else 0,
+            push_rtt_seconds=self.push_rtt.snapshot(),
+            batch_records=self.batch_records.snapshot(),
+            batch_bytes=self.batch_bytes.snapshot(),
+            record_age_seconds=self.record_age.snapshot(),
+        )
+        return snapshot
+
+    def prometheus(self, prefix: str = "loki_client", labels: dict = None) -> str:
+        """metrics() 的 Prometheus 文本格式"""
+        return prometheus_text(self.metrics(), prefix, labels)
+
+    def _finish(self, payload: "_Payload"):
+        """请求体已推送成功、写入磁盘缓存或被放弃，释放其占用的缓存"""
+        if payload.ring_end is not None:
+            self._ring_release(payload.ring_end)
+        with self._space:
+            self.inflight_size -= payload.size
+            self._busy.discard((payload.lane, payload.partition))
+            if payload.lane is not None:
+                payload.lane.inflight -= 1
+            # 因分区或通道的推送数达到上限而等待的批次
+            resubmit = self.outbox_batches > 0
+            self._space.notify_all()
+        if resubmit:
+            self._submit(self._push_next)
+
+    def _schedule_retry(self, payload: "_Payload", delay: float):
+        """等待重试期间仍占用所属通道的分区，该通道中同一 stream 之后的批次不会先于它推送"""
+        with self._space:
+            self.inflight_size -= payload.size
+            self.retry_size += payload.size
+            resubmit = False
+            if payload.lane is not None:
+                payload.lane.inflight -= 1
+                resubmit = self.outbox_batches > 0
+        self._retries.push(payload, delay)
+        self._wakeup.set()  # 刷写线程按最早到期的重试重新计算等待时间
+        if resubmit:
+            self._submit(self._push_next)
+
+    def _retry_due(self, final: bool = False):
+        """重新提交已到期的重试，final 时不论是否到期全部同步推送一次"""
+        payloads = self._retries.drain() if final else self._retries.pop_due()
+        for payload in payloads:
+            with self._space:
+                self.retry_size -= payload.size
+                self.inflight_size += payload.size
+                if payload.lane is not None:
+                    payload.lane.inflight += 1  # 重试不受通道推送数的限制
+            if final:
+                self._send(payload)
+            else:
+                self._submit(self._send, payload)
+
+    @staticmethod
+    def is_recoverable(status: int | None) -> bool:
+        """稍后重试可能成功的失败: 连接错误、5xx、部分 4xx"""
+        return status is None or status >= 500 or status in SPOOL_STATUS
 
-        self.api_push(push_req_data, headers=self.headers)
+    def _replay_spool(self):
+        """按顺序重放磁盘缓存，遇到可恢复的失败时停止，等待下一次重放"""
+        if not self._replay_lock.acquire(blocking=False):
+            return  # 已有线程在重放
+        try:
+            self._last_replay = time.monotonic()
+            while not self.__closed and time.monotonic() >= self._throttled_until:
+                record = self.spool.peek()
+                if record is None:
+                    break
+                body, headers = record
+                status, _ = self._request("POST", PUSH_PATH, body, headers)
+                if self.is_recoverable(status):
+                    break
+                # 成功，或请求本身有误(重放也不会成功)
+                self.spool.commit()
+        finally:
+            self._replay_lock.release()
 
     def _request(
         self,
@@ -190,75 +1198,54 @@ class LokiClient(ThreadPoolExecutor):
         headers: dict = None,
         *,
         encode_chunked=False,
-        retry=3,
-    ):
+        errors: list = None,
+    ) -> tuple[int | None, float | None]:
         """
-        连接错误 - 关闭并重建错误，丢弃现有连接，将新连接放入池，递归
-        500错误  - 1s后重试，1s后递归
-        400错误  - 警告，并存储当前body到文件
+        发送一次请求，失败时不在此处重试(推送的重试由 _send 交给重试队列)
+        连接错误 - 连接池丢弃出错的连接，状态码返回 None
+        400错误  - 警告
 
         body: json 或 protobuf
+        errors: 非 2xx 响应时追加响应内容
+        返回 (响应状态码, Retry-After 秒数)
         """
         headers = {} if headers is None else headers
         [headers.setdefault(k, v) for k, v in self.headers.items()]
 
-        if retry == 0:
-            debugger_print("多次重试后依旧错误")
-            # TODO 保存Body
-            return
         try:
-            conn = self.connections[threading.get_ident()]
             # debugger_print("> URI:", url, "[ALL]:", str(self.loki_url))
             # debugger_print("> HEADER: ", headers)
             # debugger_print("> BODY: ", body)
-            conn.request(method, url, body, headers, encode_chunked=encode_chunked)
-            resp = conn.getresponse()
-            resp_body = resp.read().decode()
-            if 200 <= resp.status <= 299:
-                debugger_print(f"[{resp.status}]Push Success. {resp_body}")
-                return
-            elif 300 <= resp.status <= 399:
+            status, resp_headers, resp_body = self.pool.request(
+                method, url, body, headers, encode_chunked=encode_chunked
+            )
+            resp_body = resp_body.decode(errors="replace")
+            if 200 <= status <= 299:
+                debugger_print(f"[{status}]Push Success. {resp_body}")
+            elif 300 <= status <= 399:
                 debugger_print("请求已经重定向...")
 
-            elif 400 <= resp.status <= 499:
-                debugger_print(f"请求错误: {resp.status}: {resp.read().decode()}")
+            elif 400 <= status <= 499:
+                debugger_print(f"请求错误: {status}: {resp_body}")
 
-            elif 500 <= resp.status <= 599:
-                debugger_print("服务器错误， 1s后重试")
-                raise NeedRetryError()
+            elif 500 <= status <= 599:
+                debugger_print(f"服务器错误: {status}: {resp_body}")
             else:
-                debugger_print(f"未知状态码: {resp.status}: {resp.read()}")
-
-            # print(resp.status, resp.read().decode())
-        except NeedRetryError:
-            time.sleep(1)
-            self._request(
-                method,
-                url,
-                body,
-                headers,
-                encode_chunked=encode_chunked,
-                retry=retry - 1,
-            )
-        except (socket.gaierror, ConnectionRefusedError, http_client.CannotSendRequest):
-            del self.connections[threading.get_ident()]
-            self._request(
-                method,
-                url,
-                body,
-                headers,
-                encode_chunked=encode_chunked,
-                retry=retry - 1,
-            )
+                debugger_print(f"未知状态码: {status}: {resp_body}")
+
+            if errors is not None and not 200 <= status <= 299:
+                errors.append(resp_body)
+            self._count(requests_total=1, request_errors_total=not 200 <= status <= 299)
+            return status, parse_retry_after(resp_headers.get("Retry-After"))
+        except (OSError, http_client.HTTPException) as _e:
+            # 连接池已经丢弃出错的连接
+            debugger_print("连接错误:", _e.__class__, _e)
 
         except Exception as _e:
             print("[ClassName:]", _e.__class__, "[Message:]", _e)
             # raise _e
-
-        finally:
-            # Clear 关闭的线程的连接
-            for _i in self.connections.keys() - all_thread_ids():
-                del self.connections[_i]
+        self._count(requests_total=1, request_errors_total=1)
+        return None, None
 
     def request(
         self,
@@ -270,22 +1257,29 @@ class LokiClient(ThreadPoolExecutor):
         encode_chunked=False,
     ):
         """在线程池中提交请求"""
+        self._submit(
+            self._request,
+            method,
+            url,
+            body=body,
+            headers=headers,
+            encode_chunked=encode_chunked,
+        )
+
+    def _submit(self, fn, *args, **kwargs):
+        """有线程池时提交到线程池，否则(或线程池已开始关闭)在当前线程同步执行"""
         if self.pool_size > 0 and not self._shutdown:
-            self.submit(
-                self._request,
-                method,
-                url,
-                body=body,
-                headers=headers,
-                encode_chunked=encode_chunked,
-            )
-        else:
-            self._request(method, url, body, headers, encode_chunked=encode_chunked)
+            try:
+                self.submit(fn, *args, **kwargs)
+                return
+            except RuntimeError:  # 检查之后 close 关闭了线程池
+                pass
+        fn(*args, **kwargs)
 
     def api_push(self, body, headers: dict = None, encode_chunked=False):
         return self.request(
             "POST",
-            "/loki/api/v1/push",
+            PUSH_PATH,
             body,
             headers,
             encode_chunked=encode_chunked,
@@ -0,0 +1,108 @@
+"""
+推送过程的指标
+
+LokiClient.metrics() 返回快照字典:
+    *_total  -- 计数器
+    直方图   -- {"buckets": {上界: 累计数}, "sum": 总和, "count": 次数}
+    其余数值 -- 当前值(gauge)
+prometheus_text 把快照转换为 Prometheus 的文本格式。
+"""
+
+import threading
+from bisect import bisect_left
+
+from logging_loki.labels import escape_value
+
+# 秒
+TIME_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 日志条数
+COUNT_BUCKETS = (1, 10, 100, 1000, 5000, 10000, 50000)
+# 字节
+SIZE_BUCKETS = (1024, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """固定上界的直方图，线程安全"""
+
+    def __init__(self, buckets: tuple = TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def _merge(self, counts: list, total: float, count: int) -> dict:
+        cumulative, running = {}, 0
+        for le, n in zip(self.buckets + (float("inf"),), counts):
+            running += n
+            cumulative[le] = running
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return self._merge(list(self.counts), self.sum, self.count)
+
+
+class ThreadLocalHistogram(Histogram):
+    """每个线程写自己的计数，记录时不加锁，适合在记录日志的线程中使用"""
+
+    def __init__(self, buckets: tuple = TIME_BUCKETS):
+        super().__init__(buckets)
+        self._local = threading.local()
+        self._parts: list[list] = []  # 每个线程的 [counts, sum, count]
+
+    def observe(self, value: float):
+        try:
+            part = self._local.part
+        except AttributeError:
+            part = self._local.part = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            with self.lock:
+                self._parts.append(part)
+        part[0][bisect_left(self.buckets, value)] += 1
+        part[1] += value
+        part[2] += 1
+
+    def snapshot(self) -> dict:
+        counts = [0] * (len(self.buckets) + 1)
+        total, count = 0.0, 0
+        with self.lock:
+            parts = list(self._parts)
+        for part_counts, part_sum, part_count in parts:
+            for i, n in enumerate(part_counts):
+                counts[i] += n
+            total += part_sum
+            count += part_count
+        return self._merge(counts, total, count)
+
+
+def _format_le(le: float) -> str:
+    return "+Inf" if le == float("inf") else repr(float(le))
+
+
+def prometheus_text(snapshot: dict, prefix: str = "loki_client", labels: dict = None) -> str:
+    """Prometheus 文本格式，labels 为附加到每个指标上的标签(值按文本格式转义)"""
+    base = ",".join(f'{k}="{escape_value(str(v))}"' for k, v in (labels or {}).items())
+    lines = []
+    for name, value in snapshot.items():
+        metric = f"{prefix}_{name}"
+        if isinstance(value, dict) and "buckets" in value:
+            lines.append(f"# TYPE {metric} histogram")
+            for le, n in value["buckets"].items():
+                sep = "," if base else ""
+                lines.append(f'{metric}_bucket{{{base}{sep}le="{_format_le(le)}"}} {n}')
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"{metric}_sum{suffix} {value['sum']}")
+            lines.append(f"{metric}_count{suffix} {value['count']}")
+        elif isinstance(value, (int, float)):
+            kind = "counter" if name.endswith("_total") else "gauge"
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.append(f"{metric}{suffix} {value}")
+    return "\n".join(lines) + "\n"
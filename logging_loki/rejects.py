@@ -0,0 +1,170 @@
+"""
+推送被拒绝时的处理
+
+请求体过大时 Loki 返回 413，个别日志不合法(行过长、时间戳过旧或过新、stream 的标签不合法)时
+返回 400。重试也不会成功，但出错的只是批次中的部分日志，不必丢弃整个批次:
+
+- 413: bisect_batch 把批次对半拆分(多个 stream 时按 stream，单个 stream 时按日志)，
+  分别重新推送，直到只剩一条日志仍然过大时才丢弃
+- 400: Loki 只跳过不合法的日志，其余日志已经写入。parse_rejection 解析错误信息，
+  split_rejected 找出被拒绝的日志: 行过长的截断后重新推送，其余丢弃
+
+过长的行在合并到批次时就按 max_line_size 截断或拆分(fit_line)，通常不会到达 Loki。
+"""
+
+import json
+import re
+from datetime import datetime
+
+from logging_loki.wire import StreamBuffer
+
+_LINE_TOO_LONG = re.compile(r"Max entry size '(\d+)' bytes exceeded")
+_OLDEST = re.compile(r"oldest acceptable timestamp is: (\S+?),?$")
+_TOO_NEW = re.compile(r"timestamp too new: (\S+?),?$")
+# stream 级别的错误: 标签过多、标签名或值过长、重复的标签名、无法解析的标签
+_STREAM = re.compile(r"(?:stream|labels) '(\{.*?\})'.*label")
+_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def fit_line(line: str, max_size: int, chunk: bool = False) -> list[str]:
+    """UTF-8 编码超过 max_size 字节的行截断为一行，或按 max_size 拆分为多行
+
+    不会从多字节字符的中间切开；没有超过时返回 [line]。
+    """
+    data = line.encode()
+    if len(data) <= max_size:
+        return [line]
+    lines, start = [], 0
+    while start < len(data):
+        end = min(start + max_size, len(data))
+        # 回退到字符的起始字节
+        while start + 1 < end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        lines.append(data[start:end].decode(errors="ignore"))
+        if not chunk:
+            break
+        start = end
+    return lines
+
+
+def bisect_batch(batch: dict) -> list[dict]:
+    """把批次对半拆分为两个批次，只有一条日志时返回 []
+
+    多个 stream 时按已编码的字节数把 stream 分为两组，单个 stream 时按时间戳顺序把日志分为两半。
+    """
+    if len(batch) > 1:
+        sizes = [max(map(len, s.data.values())) for s in batch.values()]
+        half, total, cut = sum(sizes) / 2, 0, 1
+        for cut, size in enumerate(sizes[:-1], 1):
+            total += size
+            if total >= half:
+                break
+        items = list(batch.items())
+        return [dict(items[:cut]), dict(items[cut:])]
+    (key, stream), = batch.items()
+    if len(stream) < 2:
+        return []
+    stream.sort()
+    middle = len(stream) // 2
+    return [
+        {key: stream.take(range(middle))},
+        {key: stream.take(range(middle, len(stream)))},
+    ]
+
+
+def _parse_time(value: str) -> int | None:
+    """RFC3339 时间转为纳秒时间戳，无法解析时返回 None"""
+    try:
+        seconds = datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+    return int(seconds) * 1_000_000_000
+
+
+def _parse_labels(selector: str) -> frozenset:
+    labels = []
+    for name, value in _LABEL.findall(selector):
+        try:
+            value = json.loads(f'"{value}"')
+        except ValueError:
+            pass
+        labels.append((name, value))
+    return frozenset(labels)
+
+
+class Rejection:
+    """400 响应中可以识别的拒绝原因
+
+    max_line_size -- Loki 允许的最大行字节数
+    oldest_ns     -- 早于该时间戳的日志被拒绝
+    newest_ns     -- 不早于该时间戳(所在的秒)的日志被拒绝
+    streams       -- 整个被拒绝的 stream 的标签集合
+    """
+
+    def __init__(self):
+        self.max_line_size: int | None = None
+        self.oldest_ns: int | None = None
+        self.newest_ns: int | None = None
+        self.streams: set[frozenset] = set()
+
+    def __bool__(self):
+        return bool(
+            self.max_line_size or self.oldest_ns or self.newest_ns or self.streams
+        )
+
+    def rejects(self, ts_ns: int) -> bool:
+        """时间戳是否被拒绝"""
+        return (self.oldest_ns is not None and ts_ns < self.oldest_ns) or (
+            self.newest_ns is not None and ts_ns >= self.newest_ns
+        )
+
+
+def parse_rejection(text: str) -> Rejection | None:
+    """解析 Loki 400 响应的错误信息(每行一个错误)，没有可以识别的原因时返回 None"""
+    rejection = Rejection()
+    for line in text.splitlines():
+        line = line.strip()
+        if m := _LINE_TOO_LONG.search(line):
+            size = int(m.group(1))
+            if rejection.max_line_size is None or size < rejection.max_line_size:
+                rejection.max_line_size = size
+        elif m := _OLDEST.search(line):
+            ts_ns = _parse_time(m.group(1))
+            if ts_ns is not None:
+                rejection.oldest_ns = max(rejection.oldest_ns or 0, ts_ns)
+        elif m := _TOO_NEW.search(line):
+            ts_ns = _parse_time(m.group(1))
+            if ts_ns is not None:
+                rejection.newest_ns = min(rejection.newest_ns or ts_ns, ts_ns)
+        elif m := _STREAM.search(line):
+            rejection.streams.add(_parse_labels(m.group(1)))
+    return rejection or None
+
+
+def split_rejected(
+    batch: dict, rejection: Rejection, chunk: bool = False
+) -> tuple[dict, int, int]:
+    """找出批次中被拒绝的日志，其余日志已被 Loki 写入
+
+    返回 (行过长的日志截断或拆分后组成的批次, 截断的日志条数, 被拒绝且无法修正的日志条数)。
+    """
+    limit = rejection.max_line_size
+    resend, fixed_count, rejected = {}, 0, 0
+    for key, stream in batch.items():
+        if rejection.streams and frozenset(key) in rejection.streams:
+            rejected += len(stream)
+            continue
+        fixed = None
+        for i, ts_ns in enumerate(stream.ts):
+            if rejection.rejects(ts_ns):
+                rejected += 1
+            elif limit and stream.entry_size(i) > limit:
+                ts_ns, line, metadata = stream.entry(i)
+                if len(line.encode()) <= limit:
+                    continue
+                if fixed is None:
+                    fixed = resend[key] = StreamBuffer(tuple(stream.data))
+                for part in fit_line(line, limit, chunk):
+                    fixed.append(ts_ns, part, metadata)
+                fixed_count += 1
+    return resend, fixed_count, rejected
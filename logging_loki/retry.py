@@ -0,0 +1,98 @@
+"""
+推送失败后的重试调度
+
+失败的请求体放入延迟队列，由刷写线程在到期后重新提交给推送线程，推送线程不会因为
+等待重试而被占用。等待时间按指数退避加随机抖动计算，服务端给出 Retry-After 时以其为准。
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+RETRY_STATUS = {408, 429}  # 需要重试的 4xx，另外连接错误与 5xx 也会重试
+THROTTLE_MIN_DELAY = 1.0  # 429 且没有 Retry-After 时的最小等待时间(秒)
+MAX_RETRY_AFTER = 300  # Retry-After 的上限(秒)，避免异常的响应让日志无限期等待
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """解析 Retry-After 响应头(秒数或 HTTP 日期)，返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), MAX_RETRY_AFTER)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return min(max(when.timestamp() - time.time(), 0.0), MAX_RETRY_AFTER)
+
+
+class RetryPolicy:
+    """重试策略
+
+    max_retries -- 最多重试的次数，0 表示不重试
+    backoff     -- 第一次重试前的基础等待时间(秒)，之后每次翻倍
+    max_backoff -- 退避等待时间的上限(秒)
+    """
+
+    def __init__(self, max_retries: int = 5, backoff: float = 0.5, max_backoff: float = 60):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    @staticmethod
+    def should_retry(status: int | None) -> bool:
+        return status is None or status >= 500 or status in RETRY_STATUS
+
+    def delay(self, attempt: int, status: int | None, retry_after: float | None = None) -> float:
+        """第 attempt 次(从 0 开始)失败后的等待时间
+
+        退避时间的一半固定、一半随机，避免多个客户端在同一时刻重试。
+        """
+        if retry_after is not None:
+            return retry_after
+        delay = min(self.backoff * 2**attempt, self.max_backoff)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if status == 429:
+            delay = max(delay, THROTTLE_MIN_DELAY)
+        return delay
+
+
+class RetryQueue:
+    """按到期时间排序的延迟队列，线程安全"""
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, object]] = []
+        self._seq = itertools.count()  # 到期时间相同时按加入顺序
+        self.lock = threading.Lock()
+
+    def push(self, item, delay: float):
+        with self.lock:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), item))
+
+    def next_due(self) -> float | None:
+        """最早到期的时间(monotonic)，队列为空时返回 None"""
+        with self.lock:
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float = None) -> list:
+        """取出所有已到期的元素"""
+        now = time.monotonic() if now is None else now
+        items = []
+        with self.lock:
+            while self._heap and self._heap[0][0] <= now:
+                items.append(heapq.heappop(self._heap)[2])
+        return items
+
+    def drain(self) -> list:
+        """按到期顺序取出全部元素"""
+        with self.lock:
+            heap, self._heap = self._heap, []
+        return [item for _, _, item in sorted(heap)]
+
+    def __len__(self):
+        return len(self._heap)
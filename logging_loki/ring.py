@@ -0,0 +1,153 @@
+"""
+基于 mmap 的环形缓存文件
+
+日志以长度前缀的形式追加写入固定大小的映射文件，head/tail 保存在文件头中。
+进程崩溃后重新打开同一文件，head 与 tail 之间尚未推送完成的日志会被重新读取并推送。
+缓存大小不计入进程的匿名内存，由操作系统按需换入换出。
+
+文件头: [magic 8s][capacity u64][head u64][tail u64]，之后是 capacity 字节的数据区。
+head/tail 是单调递增的逻辑偏移，数据区中的位置为 offset % capacity。
+数据区末尾放不下一条记录时写入 WRAP 标记(剩余不足 4 字节时直接跳过)，从头开始写。
+
+记录: [长度 u32][ts_ns i64][标签数 u16][metadata数 u16][字符串...]
+字符串依次为 标签键/值、日志内容、metadata 键/值，每个为 [长度 u32][utf-8]。
+"""
+
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Iterator
+
+MAGIC = b"LOKIRING"
+_HEADER = struct.Struct("<8sQQQ")
+HEADER_SIZE = 64
+_LEN = struct.Struct("<I")
+_RECORD = struct.Struct("<qHH")
+WRAP = 0xFFFFFFFF
+
+
+def encode_record(key: tuple, ts_ns: int, line: str, metadata: dict | None) -> bytes:
+    metadata = metadata or {}
+    parts = [_RECORD.pack(ts_ns, len(key), len(metadata))]
+    strings = [s for kv in key for s in kv]
+    strings.append(line)
+    strings += [s for kv in metadata.items() for s in kv]
+    for string in strings:
+        data = string.encode()
+        parts.append(_LEN.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def decode_record(data: memoryview) -> tuple[tuple, int, str, dict | None]:
+    """直接从映射区解码，只为最终的字符串分配对象"""
+    ts_ns, n_labels, n_meta = _RECORD.unpack_from(data)
+    pos = _RECORD.size
+    strings = []
+    for _ in range(n_labels * 2 + 1 + n_meta * 2):
+        (size,) = _LEN.unpack_from(data, pos)
+        pos += _LEN.size
+        strings.append(str(data[pos : pos + size], "utf-8"))
+        pos += size
+    labels = strings[: n_labels * 2]
+    meta = strings[n_labels * 2 + 1 :]
+    return (
+        tuple(zip(labels[::2], labels[1::2])),
+        ts_ns,
+        strings[n_labels * 2],
+        dict(zip(meta[::2], meta[1::2])) if meta else None,
+    )
+
+
+class MmapRing:
+    """单写多次读的环形缓存，调用方负责对 append 加锁"""
+
+    def __init__(self, path: str | os.PathLike, capacity: int = 64 * 1024 * 1024):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            if size > HEADER_SIZE:
+                # 已存在的文件沿用原来的容量，以便恢复其中的日志
+                capacity = size - HEADER_SIZE
+            else:
+                os.ftruncate(fd, HEADER_SIZE + capacity)
+            self.mm = mmap.mmap(fd, HEADER_SIZE + capacity)
+        finally:
+            os.close(fd)
+        self.capacity = capacity
+        self.data = memoryview(self.mm)[HEADER_SIZE:]
+
+        magic, _capacity, head, tail = _HEADER.unpack_from(self.mm)
+        if magic != MAGIC or _capacity != capacity or not head <= tail <= head + capacity:
+            head = tail = 0
+            _HEADER.pack_into(self.mm, 0, MAGIC, capacity, head, tail)
+        self._head = head
+        self._tail = tail
+
+    @property
+    def head(self) -> int:
+        return self._head
+
+    @head.setter
+    def head(self, value: int):
+        self._head = value
+        struct.pack_into("<Q", self.mm, 16, value)
+
+    @property
+    def tail(self) -> int:
+        return self._tail
+
+    def fits(self, payload: bytes) -> bool:
+        """记录不超过容量，环形缓存为空时一定可以写入(跳过的数据区末尾不占用容量)"""
+        return _LEN.size + len(payload) <= self.capacity
+
+    def append(self, payload: bytes) -> bool:
+        """写入一条记录，空间不足时返回 False"""
+        need = _LEN.size + len(payload)
+        tail = self._tail
+        pos = tail % self.capacity
+        skip = self.capacity - pos if self.capacity - pos < need else 0
+        if skip and self._head == tail and need <= self.capacity:
+            # 环形缓存为空，跳过的数据区末尾不占用容量。记录会覆盖 WRAP 标记，读取时从 head 开始
+            self.head = tail + skip
+        if tail + skip + need - self._head > self.capacity:
+            return False
+        if skip:
+            if skip >= _LEN.size:
+                _LEN.pack_into(self.data, pos, WRAP)
+            tail += skip
+            pos = 0
+        _LEN.pack_into(self.data, pos, len(payload))
+        self.data[pos + _LEN.size : pos + need] = payload
+        # 先写数据再更新 tail，崩溃时不会读到不完整的记录
+        self._tail = tail + need
+        struct.pack_into("<Q", self.mm, 24, self._tail)
+        return True
+
+    def read(self, start: int) -> Iterator[tuple[memoryview, int]]:
+        """从逻辑偏移 start 读取到当前 tail，返回 (记录, 下一条记录的偏移)
+
+        start 早于 head 时从 head 开始读取(空缓存写入时 head 跳过了数据区末尾)。
+        """
+        # 先取 tail 再取 head: append 先更新 head 后更新 tail
+        tail = self._tail
+        offset = max(start, self._head)
+        while offset < tail:
+            pos = offset % self.capacity
+            if self.capacity - pos < _LEN.size:
+                offset += self.capacity - pos
+                continue
+            (size,) = _LEN.unpack_from(self.data, pos)
+            if size == WRAP:
+                offset += self.capacity - pos
+                continue
+            offset += _LEN.size + size
+            yield self.data[pos + _LEN.size : pos + _LEN.size + size], offset
+
+    def close(self):
+        self.data.release()
+        self.mm.flush()
+        self.mm.close()
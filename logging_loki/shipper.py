@@ -0,0 +1,152 @@
+"""
+多进程部署时的日志推送
+
+gunicorn / multiprocessing 等多进程场景下，每个工作进程各自创建 LokiClient 会产生
+N 份批次、N 个线程池和大量小而压缩率低的推送。LokiShipper 在单独的进程中运行唯一的
+LokiClient，工作进程的 LokiQueueHandler 只把格式化后的轻量元组写入 multiprocessing 队列，
+批次合并与压缩在每台主机上只进行一次。
+
+用法 (在主进程中 fork 工作进程之前创建):
+
+    shipper = LokiShipper(loki_url=..., username=..., password=...)
+    shipper.start()
+    # 工作进程中
+    logging.getLogger().addHandler(shipper.handler(tags={"service_name": "web"}))
+    # 主进程退出前
+    shipper.stop()
+"""
+
+import multiprocessing
+import signal
+import threading
+import time
+import typing
+
+from logging_loki.handler import LokiHandler
+from logging_loki.loki_client import LokiClient, run_tickers
+
+
+class QueueClient:
+    """工作进程中替代 LokiClient 的客户端，只负责把日志写入队列
+
+    工作进程中没有刷写线程，注册 ticker 时启动一个后台线程按 ticker 返回的时间调用。
+    """
+
+    labels_key = staticmethod(LokiClient.labels_key)
+
+    def __init__(self, queue, tags: dict = None):
+        self.queue = queue
+        self.labels = tags or {}
+        self._tickers: list[typing.Callable[[bool], float | None]] = []
+        self._ticker_thread: threading.Thread | None = None
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._enqueued = 0
+        self._lock = threading.Lock()
+
+    def push_wait(self, labels: dict, lines: list[list]):
+        key = self.labels_key({**labels, **self.labels})
+        for line in lines:
+            self.push_entry(key, line[0], line[1], line[2] if len(line) >= 3 else None)
+
+    def push_entry(self, key: tuple, ts_ns: int, line: str, metadata: dict = None):
+        self.queue.put((key, ts_ns, line, metadata))
+        with self._lock:
+            self._enqueued += 1
+
+    def flush(self):
+        """由推送进程负责刷写"""
+
+    def add_ticker(self, ticker: typing.Callable[[bool], float | None]):
+        """与 LokiClient.add_ticker 相同，由本进程的后台线程调用"""
+        self._tickers.append(ticker)
+        if self._ticker_thread is None:
+            self._ticker_thread = threading.Thread(
+                target=self._tick_loop, name="loki-queue-ticker", daemon=True
+            )
+            self._ticker_thread.start()
+        self._wakeup.set()
+
+    def _tick_loop(self):
+        due = None
+        while True:
+            self._wakeup.wait(None if due is None else max(due - time.monotonic(), 0))
+            self._wakeup.clear()
+            if self._closed:
+                return
+            due = run_tickers(self._tickers)
+
+    def metrics(self) -> dict:
+        """本进程写入队列的日志数，推送的指标在推送进程中"""
+        return {"records_enqueued_total": self._enqueued}
+
+    def close(self):
+        """停止 ticker 线程并最后调用一次 ticker；队列由 LokiShipper 管理，这里不关闭"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._ticker_thread is not None:
+            self._wakeup.set()
+            self._ticker_thread.join()
+            run_tickers(self._tickers, final=True)
+
+
+class LokiQueueHandler(LokiHandler):
+    """把日志写入 LokiShipper 队列的 Handler，格式化参数与 LokiHandler 相同"""
+
+    def __init__(self, queue, level: int | str = "ERROR", **kwargs) -> None:
+        self.queue = queue
+        super().__init__(loki_url=None, level=level, **kwargs)
+
+    def create_client(self, **kwargs):
+        return QueueClient(self.queue)
+
+
+def _ship(queue, client_kwargs: dict):
+    """推送进程的主循环"""
+    # 由主进程通过 stop() 结束，避免 Ctrl-C 时丢失尚未刷写的日志
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    client = LokiClient(**client_kwargs)
+    try:
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            client.push_entry(*item)
+    finally:
+        client.close()
+
+
+class LokiShipper:
+    """运行唯一 LokiClient 的推送进程，参数与 LokiClient 相同"""
+
+    def __init__(self, loki_url: str, *, queue_size: int = 0, context=None, **kwargs):
+        ctx = context or multiprocessing.get_context()
+        self.queue = ctx.Queue(queue_size)
+        kwargs["loki_url"] = loki_url
+        self.process = ctx.Process(
+            target=_ship,
+            args=(self.queue, kwargs),
+            name="loki-shipper",
+            daemon=True,
+        )
+
+    def start(self):
+        self.process.start()
+        return self
+
+    def handler(self, level: int | str = "ERROR", **kwargs) -> LokiQueueHandler:
+        """创建写入本推送进程的 Handler"""
+        return LokiQueueHandler(self.queue, level=level, **kwargs)
+
+    def stop(self, timeout: float = None):
+        """通知推送进程刷写剩余日志并退出"""
+        if self.process.is_alive():
+            self.queue.put(None)
+            self.process.join(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
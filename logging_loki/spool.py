@@ -0,0 +1,216 @@
+"""
+推送失败日志的磁盘缓存
+
+按顺序追加写入分段文件，每条记录保存已经压缩好的请求体及其 Content-Type/Content-Encoding，
+重放时直接复用这些字节，无需重新编码。
+
+记录格式: [长度 u32][crc32 u32][头部长度 u16][头部][请求体]
+头部为 "Content-Type\\nContent-Encoding"。
+读取进度保存在 cursor 文件中，进程重启后从上次的位置继续重放。
+"""
+
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from logging_loki.tools import debugger_print
+
+_RECORD = struct.Struct(">IIH")
+SEGMENT_SUFFIX = ".spool"
+CURSOR_FILE = "cursor"
+
+
+class DiskSpool:
+    """追加写入的分段文件队列
+
+    max_size     -- 所有分段文件的总大小上限，超出时删除最早的分段
+    segment_size -- 单个分段文件的大小，超出后写入新的分段
+    fsync_interval -- 两次 fsync 之间的最小间隔(秒)，0 表示每条记录都 fsync
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        max_size: int = 256 * 1024 * 1024,
+        segment_size: int = 16 * 1024 * 1024,
+        fsync_interval: float = 1.0,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.segment_size = min(segment_size, max_size)
+        self.fsync_interval = fsync_interval
+        self.lock = threading.RLock()
+        self.dropped = 0  # 因超出 max_size 被删除的记录数
+        self.dropped_size = 0
+
+        self._segments: list[int] = sorted(
+            int(p.stem) for p in self.directory.glob(f"*{SEGMENT_SUFFIX}")
+        )
+        self._read_seq, self._read_offset = self._load_cursor()
+        self._reader = None
+        self._peeked: tuple[int, bytes, dict] | None = None  # (下一条的偏移, body, headers)
+        self._last_fsync = time.monotonic()
+        self._writer = None
+        self._write_seq = (self._segments[-1] + 1) if self._segments else 1
+        self._segments.append(self._write_seq)
+        self._writer = open(self._segment_path(self._write_seq), "ab")
+
+    def _segment_path(self, seq: int) -> Path:
+        return self.directory / f"{seq:020d}{SEGMENT_SUFFIX}"
+
+    def _load_cursor(self) -> tuple[int, int]:
+        try:
+            seq, offset = (self.directory / CURSOR_FILE).read_text().split()
+            return int(seq), int(offset)
+        except (OSError, ValueError):
+            return (self._segments[0] if self._segments else 0), 0
+
+    def _save_cursor(self):
+        tmp = self.directory / f"{CURSOR_FILE}.tmp"
+        tmp.write_text(f"{self._read_seq} {self._read_offset}")
+        os.replace(tmp, self.directory / CURSOR_FILE)
+
+    @property
+    def size(self) -> int:
+        """尚未重放的分段文件总大小"""
+        with self.lock:
+            total = 0
+            for seq in self._segments:
+                try:
+                    total += self._segment_path(seq).stat().st_size
+                except OSError:
+                    pass
+            if self._segments and self._segments[0] == self._read_seq:
+                total -= self._read_offset
+            return max(total, 0)
+
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+    def append(self, body: bytes, headers: dict):
+        meta = "\n".join(
+            (headers.get("Content-Type", ""), headers.get("Content-Encoding", ""))
+        ).encode()
+        header = _RECORD.pack(
+            len(meta) + len(body), zlib.crc32(body, zlib.crc32(meta)), len(meta)
+        )
+        with self.lock:
+            if self._writer.tell() + len(header) + len(meta) + len(body) > self.segment_size:
+                self._rotate()
+            self._writer.write(header)
+            self._writer.write(meta)
+            self._writer.write(body)
+            self._writer.flush()
+            if time.monotonic() - self._last_fsync >= self.fsync_interval:
+                os.fsync(self._writer.fileno())
+                self._last_fsync = time.monotonic()
+            self._enforce_max_size()
+
+    def _rotate(self):
+        """关闭当前分段，开始写入新的分段"""
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._writer.close()
+        self._write_seq += 1
+        self._segments.append(self._write_seq)
+        self._writer = open(self._segment_path(self._write_seq), "ab")
+
+    def _enforce_max_size(self):
+        """删除最早的分段直到总大小不超过 max_size，不删除正在写入的分段"""
+        while len(self._segments) > 1 and self.size > self.max_size:
+            seq = self._segments[0]
+            self.dropped += self._count_records(seq)
+            self.dropped_size += self._segment_path(seq).stat().st_size
+            debugger_print(f"磁盘缓存超限，删除分段 {seq}")
+            self._remove_segment(seq)
+
+    def _count_records(self, seq: int) -> int:
+        count = 0
+        offset = self._read_offset if seq == self._read_seq else 0
+        with open(self._segment_path(seq), "rb") as f:
+            f.seek(offset)
+            while header := f.read(_RECORD.size):
+                if len(header) < _RECORD.size:
+                    break
+                f.seek(_RECORD.unpack(header)[0], os.SEEK_CUR)
+                count += 1
+        return count
+
+    def _remove_segment(self, seq: int):
+        if self._reader is not None and seq == self._read_seq:
+            self._reader.close()
+            self._reader = None
+            self._peeked = None
+        self._segment_path(seq).unlink(missing_ok=True)
+        self._segments.remove(seq)
+        if seq == self._read_seq or self._read_seq not in self._segments:
+            self._read_seq, self._read_offset = self._segments[0], 0
+            self._save_cursor()
+
+    def peek(self) -> tuple[bytes, dict] | None:
+        """返回下一条待重放的 (body, headers)，没有时返回 None"""
+        with self.lock:
+            while self._peeked is None:
+                if self._read_seq not in self._segments:
+                    self._read_seq, self._read_offset = self._segments[0], 0
+                if self._reader is None:
+                    if self._read_seq == self._write_seq:
+                        self._writer.flush()
+                    self._reader = open(self._segment_path(self._read_seq), "rb")
+                    self._reader.seek(self._read_offset)
+                record = self._read_record()
+                if record is not None:
+                    self._peeked = record
+                elif self._read_seq == self._write_seq:
+                    self._reader.close()
+                    self._reader = None
+                    return None
+                else:
+                    # 当前分段已读完(或尾部不完整)，删除后读取下一个分段
+                    self._remove_segment(self._read_seq)
+            return self._peeked[1], self._peeked[2]
+
+    def _read_record(self) -> tuple[int, bytes, dict] | None:
+        header = self._reader.read(_RECORD.size)
+        if len(header) < _RECORD.size:
+            return None
+        length, crc, meta_len = _RECORD.unpack(header)
+        data = self._reader.read(length)
+        if len(data) < length or zlib.crc32(data) != crc:
+            debugger_print(f"磁盘缓存分段 {self._read_seq} 记录损坏，跳过剩余部分")
+            if self._read_seq == self._write_seq:
+                self._rotate()
+            return None
+        content_type, content_encoding = data[:meta_len].decode().split("\n")
+        headers = {"Content-Type": content_type}
+        if content_encoding:
+            headers["Content-Encoding"] = content_encoding
+        return self._reader.tell(), data[meta_len:], headers
+
+    def commit(self):
+        """确认 peek 返回的记录已经重放成功"""
+        with self.lock:
+            if self._peeked is None:
+                return
+            self._read_offset = self._peeked[0]
+            self._peeked = None
+            self._save_cursor()
+            if self._read_seq == self._write_seq and self._read_offset >= self._writer.tell():
+                # 已全部重放，重新开始一个空的分段
+                self._reader.close()
+                self._reader = None
+                self._rotate()
+                self._remove_segment(self._read_seq)
+
+    def close(self):
+        with self.lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._writer.close()
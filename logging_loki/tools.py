@@ -2,8 +2,19 @@ import os
 import time
 
 
+# 调试输出开关，只在导入与创建 LokiClient 时读取环境变量，不在每次输出时读取
+DEBUG = os.getenv("LOKI_LOGGING_DEBUG", "")
+
+
+def refresh_debug() -> str:
+    """重新读取 LOKI_LOGGING_DEBUG 环境变量，返回其值"""
+    global DEBUG
+    DEBUG = os.getenv("LOKI_LOGGING_DEBUG", "")
+    return DEBUG
+
+
 def debugger_print(*args, **kwargs):
-    if os.getenv("LOKI_LOGGING_DEBUG"):
+    if DEBUG:
         print(f'[{time.strftime("%Y-%m-%d %H:%M:%S")}]', *args, **kwargs)
 
 
@@ -0,0 +1,275 @@
+"""
+批次的增量编码
+
+日志在合并到批次时就编码为最终请求体中的字节(protobuf 的 EntryAdapter 或 JSON 的
+values 元素)，追加到所属 stream 的 StreamBuffer 中，刷写时只需要拼接各 stream，不再
+构建 protobuf 对象树。拼接时各 stream 内的日志按时间戳排序，乱序到达(如来自不同线程)的日志
+不会被 Loki 当作乱序写入拒绝。
+
+protobuf 按 loki_push.proto 直接写出 wire format，与 loki_push_pb2 的序列化结果逐字节
+相同(structuredMetadata 按 dict 的顺序写出)，推送不依赖 protobuf 运行时。
+
+压缩仍然在刷写时一次完成: protobuf 请求体使用的 raw snappy 是单个 block，无法流式写入；
+JSON 的各 stream 交错到达，也无法按最终顺序流式压缩。
+"""
+
+import json
+from array import array
+from functools import lru_cache
+
+from logging_loki.labels import CACHE_SIZE, stream_hash, stream_selector
+
+# 小于 16384 的 varint 编码，覆盖绝大多数长度前缀
+_VARINTS = [
+    bytes([v]) if v < 0x80 else bytes([(v & 0x7F) | 0x80, v >> 7]) for v in range(1 << 14)
+]
+
+
+def encode_varint(value: int) -> bytes:
+    """protobuf varint 编码，负数按 64 位补码"""
+    if 0 <= value < 1 << 14:
+        return _VARINTS[value]
+    if value < 0:
+        value += 1 << 64
+    out = []
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(tag: bytes, data: bytes) -> bytes:
+    """长度前缀的字段(string / bytes / message)"""
+    return tag + encode_varint(len(data)) + data
+
+
+@lru_cache(maxsize=256)
+def _seconds_field(seconds: int) -> bytes:
+    """Timestamp.seconds 字段，同一秒内的日志共用"""
+    return b"\x08" + encode_varint(seconds) if seconds else b""
+
+
+def encode_timestamp(ts_ns: int) -> bytes:
+    """Timestamp 消息"""
+    seconds, nanos = divmod(ts_ns, 1_000_000_000)
+    if nanos:
+        return _seconds_field(seconds) + b"\x10" + encode_varint(nanos)
+    return _seconds_field(seconds)
+
+
+def encode_entry(ts_ns: int, line: str, metadata: dict | None = None) -> bytes:
+    """EntryAdapter 消息(不含外层的字段标签与长度前缀)"""
+    ts = encode_timestamp(ts_ns)
+    parts = [b"\x0a", _VARINTS[len(ts)], ts]
+    if line:
+        line = line.encode()
+        parts += (b"\x12", encode_varint(len(line)), line)
+    if metadata:
+        for k, v in metadata.items():
+            pair = _field(b"\x0a", str(k).encode()) + _field(b"\x12", str(v).encode())
+            parts += (b"\x1a", encode_varint(len(pair)), pair)
+    return b"".join(parts)
+
+
+def decode_varint(data, pos: int) -> tuple[int, int]:
+    """读取 pos 处的 varint，返回 (值, 之后的位置)"""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _fields(data):
+    """逐个读取 (字段号, 值)，值为 varint 或长度前缀字段的内容"""
+    pos = 0
+    while pos < len(data):
+        tag, pos = decode_varint(data, pos)
+        if tag & 7 == 2:
+            length, pos = decode_varint(data, pos)
+            yield tag >> 3, data[pos : pos + length]
+            pos += length
+        else:
+            value, pos = decode_varint(data, pos)
+            yield tag >> 3, value
+
+
+def decode_entry(data) -> tuple[int, str, dict | None]:
+    """encode_entry 的逆过程，返回 (ts_ns, line, metadata)"""
+    ts_ns, line, metadata = 0, "", None
+    for number, value in _fields(data):
+        if number == 1:
+            for part, v in _fields(value):
+                if part == 1:
+                    if v >= 1 << 63:
+                        v -= 1 << 64  # int64 的 seconds
+                    ts_ns += v * 1_000_000_000
+                else:
+                    ts_ns += v
+        elif number == 2:
+            line = bytes(value).decode()
+        elif number == 3:
+            pair = dict(_fields(value))
+            if metadata is None:
+                metadata = {}
+            metadata[bytes(pair.get(1, b"")).decode()] = bytes(pair.get(2, b"")).decode()
+    return ts_ns, line, metadata
+
+
+def encode_json_entry(ts_ns: int, line: str, metadata: dict | None = None) -> bytes:
+    """JSON values 的一个元素，末尾带逗号"""
+    value = [str(ts_ns), line, metadata] if metadata else [str(ts_ns), line]
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode() + b","
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def stream_fields(key: tuple) -> tuple[bytes, bytes]:
+    """StreamAdapter 中位于 entries 之前的 labels 字段与之后的 hash 字段"""
+    labels = stream_selector(key).encode()
+    _hash = stream_hash(key)
+    return _field(b"\x0a", labels), b"\x18" + encode_varint(_hash) if _hash else b""
+
+
+class StreamBuffer:
+    """一个 stream 的已编码日志
+
+    data[fmt] -- 按到达顺序拼接的各条日志的编码
+    ends[fmt] -- 每条日志在 data[fmt] 中的结束位置
+    ts        -- 每条日志的时间戳
+    ordered   -- 日志是否按时间戳排列，拼接请求体前由 sort 排序
+    """
+
+    __slots__ = ("data", "ends", "ts", "ordered")
+
+    def __init__(self, formats: tuple = ("protobuf",)):
+        self.data = {fmt: bytearray() for fmt in formats}
+        self.ends = {fmt: array("Q") for fmt in formats}
+        self.ts = array("q")
+        self.ordered = True
+
+    def append(self, ts_ns: int, line: str, metadata: dict | None = None):
+        for fmt, data in self.data.items():
+            if fmt == "protobuf":
+                # StreamAdapter.entries 字段，直接写入，避免再拼接一次
+                entry = encode_entry(ts_ns, line, metadata)
+                data += b"\x12"
+                data += encode_varint(len(entry))
+                data += entry
+            else:
+                data += encode_json_entry(ts_ns, line, metadata)
+            self.ends[fmt].append(len(data))
+        if self.ts and ts_ns < self.ts[-1]:
+            self.ordered = False
+        self.ts.append(ts_ns)
+
+    def __len__(self):
+        return len(self.ts)
+
+    def _format(self) -> str:
+        """任一未释放的格式"""
+        for fmt, ends in self.ends.items():
+            if len(ends) == len(self.ts):
+                return fmt
+        raise ValueError("StreamBuffer 的编码已释放")
+
+    def entry_size(self, i: int) -> int:
+        """第 i 条日志编码后的字节数，不小于其 UTF-8 编码的行长度"""
+        ends = self.ends[self._format()]
+        return ends[i] - (ends[i - 1] if i else 0)
+
+    def entry(self, i: int) -> tuple[int, str, dict | None]:
+        """解码第 i 条日志，返回 (ts_ns, line, metadata)"""
+        fmt = self._format()
+        ends = self.ends[fmt]
+        chunk = memoryview(self.data[fmt])[ends[i - 1] if i else 0 : ends[i]]
+        if fmt == "protobuf":
+            _, pos = decode_varint(chunk, 1)  # 跳过 entries 字段的标签与长度前缀
+            return decode_entry(chunk[pos:])
+        value = json.loads(bytes(chunk[:-1]))
+        return int(value[0]), value[1], value[2] if len(value) > 2 else None
+
+    def take(self, indices) -> "StreamBuffer":
+        """由第 indices 条日志(按给出的顺序)组成的新 StreamBuffer，已释放的格式仍为已释放"""
+        buffer = StreamBuffer(tuple(self.data))
+        indices = list(indices)
+        for fmt, data in self.data.items():
+            ends = self.ends[fmt]
+            if len(ends) != len(self.ts):
+                continue
+            view, out, new_ends = memoryview(data), buffer.data[fmt], buffer.ends[fmt]
+            for i in indices:
+                out += view[ends[i - 1] if i else 0 : ends[i]]
+                new_ends.append(len(out))
+            view.release()
+        for i in indices:
+            if buffer.ts and self.ts[i] < buffer.ts[-1]:
+                buffer.ordered = False
+            buffer.ts.append(self.ts[i])
+        return buffer
+
+    def sort(self):
+        """按时间戳重新排列各格式的编码(时间戳相同时保持到达顺序)"""
+        if self.ordered:
+            return
+        ts = self.ts
+        order = sorted(range(len(ts)), key=ts.__getitem__)
+        for fmt, data in self.data.items():
+            ends = self.ends[fmt]
+            if len(ends) != len(ts):
+                continue  # 已释放
+            view = memoryview(data)
+            out, new_ends = bytearray(), array("Q")
+            for i in order:
+                out += view[ends[i - 1] if i else 0 : ends[i]]
+                new_ends.append(len(out))
+            view.release()
+            self.data[fmt], self.ends[fmt] = out, new_ends
+        self.ts = array("q", (ts[i] for i in order))
+        self.ordered = True
+
+    def release(self, fmt: str):
+        """释放某一格式的编码"""
+        self.data[fmt] = bytearray()
+        self.ends[fmt] = array("Q")
+
+
+def finalize_protobuf(batch: dict, release: bool = False) -> bytearray:
+    """拼接为 PushRequest 的编码
+
+    batch   -- 标签键 -> StreamBuffer
+    release -- 拼接后释放各 stream 的编码，降低峰值内存
+    """
+    out = bytearray()
+    for key, stream in batch.items():
+        stream.sort()
+        entries = stream.data["protobuf"]
+        head, tail = stream_fields(key)
+        out += b"\x0a" + encode_varint(len(head) + len(entries) + len(tail)) + head
+        out += entries
+        out += tail
+        if release:
+            stream.release("protobuf")
+    return out
+
+
+def finalize_json(batch: dict, release: bool = False) -> bytearray:
+    """拼接为 JSON 格式的请求体"""
+    out = bytearray(b'{"streams":[')
+    for i, (key, stream) in enumerate(batch.items()):
+        stream.sort()
+        values = stream.data["json"]
+        if i:
+            out += b","
+        out += b'{"stream":'
+        out += json.dumps(dict(key), ensure_ascii=False, separators=(",", ":")).encode()
+        out += b',"values":['
+        out += memoryview(values)[:-1]  # 去掉最后一条日志末尾的逗号
+        out += b"]}"
+        if release:
+            stream.release("json")
+    out += b"]}"
+    return out
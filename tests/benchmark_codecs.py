@@ -0,0 +1,98 @@
+"""各编码的压缩率与 CPU 开销
+
+encode 为合并批次时增量编码的 CPU 时间，compress 为刷写时拼接与压缩的 CPU 时间。
+
+python tests/benchmark_codecs.py [批次条数] [重复次数] [--json]
+"""
+
+import json
+import random
+import sys
+import time
+
+from logging_loki.compression import get_codec, zstandard
+from logging_loki.loki_client import LokiClient
+from logging_loki.wire import StreamBuffer
+
+CODECS = ["snappy", "gzip:1", "gzip:6", "gzip:9"]
+if zstandard is not None:
+    CODECS += ["zstd:1", "zstd:3", "zstd:9"]
+
+MESSAGES = [
+    "GET /api/v1/users/{} 200 {}ms",
+    "user {} logged in from 10.0.{}.{}",
+    "cache miss for key order:{}, fetching from db",
+    "Traceback (most recent call last):\n  File \"app.py\", line {}, in handle\nZeroDivisionError: division by zero",
+]
+
+
+def make_records(count: int) -> list[tuple]:
+    records = []
+    now = time.time_ns()
+    for i in range(count):
+        key = LokiClient.labels_key(
+            {"app": "benchmark", "level": random.choice(["INFO", "ERROR"])}
+        )
+        fmt = random.choice(MESSAGES)
+        line = (
+            f"[2024-05-01 12:00:{i % 60:02d}] - app:{i % 300} - "
+            + fmt.format(*(random.randint(0, 999) for _ in range(fmt.count("{}"))))
+        )
+        metadata = {"thread": f"worker-{i % 8}"} if i % 3 == 0 else None
+        records.append((key, now + i, line, metadata))
+    return records
+
+
+def bench(spec: str, records: list, repeat: int) -> dict:
+    codec = get_codec(spec)
+    encode_cpu = cpu = 0.0
+    for _ in range(repeat):
+        started = time.process_time()
+        batch = {}
+        for key, ts_ns, line, metadata in records:
+            if key not in batch:
+                batch[key] = StreamBuffer((codec.format,))
+            batch[key].append(ts_ns, line, metadata)
+        encode_cpu += time.process_time() - started
+        started = time.process_time()
+        raw = LokiClient.serialize(batch, codec.format)
+        body = codec.compress(memoryview(raw))
+        cpu += time.process_time() - started
+    records = len(records)
+    total = encode_cpu + cpu
+    return {
+        "codec": spec,
+        "raw_bytes": len(raw),
+        "body_bytes": len(body),
+        "ratio": len(body) / len(raw),
+        "bytes_per_record": len(body) / records,
+        "encode_ms_per_batch": encode_cpu / repeat * 1000,
+        "compress_ms_per_batch": cpu / repeat * 1000,
+        "records_per_cpu_second": records * repeat / total if total else float("inf"),
+    }
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    count = int(args[0]) if args else 10000
+    repeat = int(args[1]) if len(args) > 1 else 10
+    records = make_records(count)
+    results = [bench(spec, records, repeat) for spec in CODECS]
+    if "--json" in sys.argv:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{count} records/batch, {repeat} rounds")
+    print(
+        f"{'codec':<8} {'raw':>10} {'body':>10} {'ratio':>6} {'B/rec':>7} "
+        f"{'encode ms':>10} {'compress ms':>12} {'rec/CPU s':>11}"
+    )
+    for r in results:
+        print(
+            f"{r['codec']:<8} {r['raw_bytes']:>10} {r['body_bytes']:>10} {r['ratio']:>6.3f} "
+            f"{r['bytes_per_record']:>7.1f} {r['encode_ms_per_batch']:>10.2f} "
+            f"{r['compress_ms_per_batch']:>12.2f} {r['records_per_cpu_second']:>11.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""离线的 LokiHandler / FileHandler 对比测试
+
+推送到本进程中的 FakeLoki (解码 snappy+protobuf 请求)，可以模拟延迟、5xx 与 429，结果可以在不同
+提交之间比较。每个场景在单独的子进程中记录日志，统计:
+    records_per_second -- 从开始记录到全部推送(写入)完成的吞吐
+    emit_us            -- 记录日志的线程中单次调用的耗时分位数(微秒)
+    cpu_seconds        -- 子进程的 CPU 时间(包括推送线程)
+    peak_rss_mb        -- 子进程的峰值常驻内存
+    bytes_per_record   -- 推送成功的请求体(或日志文件)平均每条日志的字节数
+    failed             -- 重试后依旧失败或因缓存超限丢弃的日志数
+
+PYTHONPATH=. python tests/benchmark_offline.py [日志条数] [线程数] [场景 ...] [--json]
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from logging_loki.handler import LokiHandler
+from logging_loki.version import __version__
+
+from benchmark_codecs import MESSAGES
+from fake_loki import FakeLoki
+
+FMT = "[%(asctime)s] - %(module)s:%(lineno)d - %(levelname)s - %(message)s"
+# 场景名 -> 使用的 Handler 与 FakeLoki 的故障参数
+SCENARIOS = {
+    "file": {"handler": "file"},
+    "loki": {"handler": "loki"},
+    "loki-latency": {"handler": "loki", "latency": 0.05},
+    "loki-5xx": {"handler": "loki", "error_rate": 0.05},
+    "loki-429": {"handler": "loki", "throttle_rate": 0.02},
+}
+PERCENTILES = (50, 90, 99, 99.9)
+ERROR_EVERY = 10  # 每多少条日志记录一条带异常栈的 ERROR
+
+
+def _exc_info():
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        return sys.exc_info()
+
+
+def _percentiles(latencies: list[array]) -> dict:
+    values = sorted(v for part in latencies for v in part)
+    if not values:
+        return {}
+    result = {
+        f"p{p:g}": values[min(int(len(values) * p / 100), len(values) - 1)] * 1e6
+        for p in PERCENTILES
+    }
+    result["max"] = values[-1] * 1e6
+    return result
+
+
+def run(handler_type: str, url: str, count: int, threads: int, path: str) -> dict:
+    """在子进程中记录 count 条日志并关闭 Handler，返回测量结果"""
+    logger = logging.getLogger("benchmark_offline")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if handler_type == "file":
+        handler = logging.FileHandler(path, mode="w")
+        handler.setFormatter(logging.Formatter(FMT))
+    else:
+        handler = LokiHandler(
+            url, level="INFO", tags={"app": "benchmark"}, fmt=FMT, retry_backoff=0.1
+        )
+    logger.addHandler(handler)
+    exc_info = _exc_info()
+    per_thread = count // threads
+    latencies = [array("d", bytes(8 * per_thread)) for _ in range(threads)]
+
+    def produce(latency: array):
+        for i in range(len(latency)):
+            fmt = MESSAGES[i % len(MESSAGES)]
+            args = (i,) * fmt.count("{}")
+            started = time.perf_counter()
+            if i % ERROR_EVERY == 0:
+                logger.error(fmt.format(*args), exc_info=exc_info)
+            else:
+                logger.info(fmt.format(*args))
+            latency[i] = time.perf_counter() - started
+
+    cpu = time.process_time()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(produce, latencies))
+    emitted = time.perf_counter() - started
+    logger.removeHandler(handler)
+    handler.close()  # 推送(写入)剩余的日志
+    elapsed = time.perf_counter() - started
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = {
+        "records": per_thread * threads,
+        "emit_seconds": emitted,
+        "elapsed_seconds": elapsed,
+        "cpu_seconds": time.process_time() - cpu,
+        # Linux 上单位为 KB，macOS 上为字节
+        "peak_rss_mb": rss / (1 << 20 if sys.platform == "darwin" else 1 << 10),
+        "emit_us": _percentiles(latencies),
+    }
+    if handler_type == "file":
+        result["bytes"] = os.path.getsize(path)
+    else:
+        metrics = handler.metrics()
+        result["requests"] = metrics["requests_total"]
+        result["retries"] = metrics["retries_total"]
+        result["dropped"] = metrics["records_dropped_total"]
+        result["failed"] = metrics["records_failed_total"]
+    return result
+
+
+def scenario(name: str, count: int = 100_000, threads: int = 4) -> dict:
+    """运行一个场景，返回可以序列化为 JSON 的结果"""
+    options = dict(SCENARIOS[name])
+    handler_type = options.pop("handler")
+    ctx = multiprocessing.get_context("spawn")  # 子进程不继承 FakeLoki 的内存，峰值内存只包括记录日志本身
+    with FakeLoki(keep_requests=False, **options) as loki, tempfile.TemporaryDirectory() as tmp:
+        with ctx.Pool(1) as pool:
+            result = pool.apply(
+                run, (handler_type, loki.url, count, threads, os.path.join(tmp, "benchmark.log"))
+            )
+        if handler_type == "loki":
+            result["delivered"] = loki.entries
+            result["bytes"] = loki.bytes_received
+        else:
+            result["delivered"] = result["records"]
+    result.update(
+        scenario=name,
+        records_per_second=result["delivered"] / result["elapsed_seconds"],
+        bytes_per_record=result["bytes"] / max(result["delivered"], 1),
+    )
+    return result
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    count = int(args[0]) if args else 100_000
+    threads = int(args[1]) if len(args) > 1 else 4
+    names = args[2:] or list(SCENARIOS)
+    results = [scenario(name, count, threads) for name in names]
+    if "--json" in sys.argv:
+        print(
+            json.dumps(
+                {
+                    "version": __version__,
+                    "python": sys.version.split()[0],
+                    "count": count,
+                    "threads": threads,
+                    "results": results,
+                },
+                indent=2,
+            )
+        )
+        return
+    print(f"{count} records, {threads} threads")
+    print(
+        f"{'scenario':<13} {'delivered':>9} {'rec/s':>9} {'p50 us':>8} {'p99 us':>8} "
+        f"{'max us':>9} {'CPU s':>7} {'RSS MB':>7} {'B/rec':>7} {'retries':>7} {'failed':>7}"
+    )
+    for r in results:
+        emit = r["emit_us"]
+        print(
+            f"{r['scenario']:<13} {r['delivered']:>9} {r['records_per_second']:>9.0f} "
+            f"{emit['p50']:>8.1f} {emit['p99']:>8.1f} {emit['max']:>9.0f} "
+            f"{r['cpu_seconds']:>7.2f} {r['peak_rss_mb']:>7.1f} {r['bytes_per_record']:>7.1f} "
+            f"{r.get('retries', 0):>7} {r.get('failed', 0) + r.get('dropped', 0):>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
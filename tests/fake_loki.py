@@ -0,0 +1,154 @@
+"""本地的 Loki push 接口模拟，用于离线测试"""
+
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import snappy
+
+from logging_loki import loki_push_pb2
+
+
+class FakeLoki(ThreadingHTTPServer):
+    """在随机端口上监听 /loki/api/v1/push，解码并记录收到的 PushRequest
+
+    latency / error_rate / throttle_rate 用于模拟慢速或不稳定的服务端:
+    每个请求额外等待 latency 秒，并按比例随机返回 503 或 429。
+    max_body_size / max_line_size 模拟 Loki 的限制: 请求体过大时返回 413；
+    与 Loki 一样，行过长的日志被跳过，其余日志照常写入，并返回 400 与错误信息。
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: str = "1",  # 随机返回 429 时的 Retry-After
+        keep_requests: bool = True,  # False 时只计数，不保存解码后的请求
+        max_body_size: int = 0,  # 请求体的最大字节数，0 表示不限制
+        max_line_size: int = 0,  # 每行日志的最大字节数，0 表示不限制
+    ):
+        super().__init__((host, port), _PushHandler)
+        self.requests: list[loki_push_pb2.PushRequest] = []
+        # 依次返回的状态码(或 (状态码, 响应头))，用完后按比例随机返回错误或 204
+        self.statuses: list[int | tuple[int, dict]] = []
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.keep_requests = keep_requests
+        self.max_body_size = max_body_size
+        self.max_line_size = max_line_size
+        self.attempts = 0  # 收到的请求数，包括返回错误的请求
+        self.entries = 0  # 推送成功的日志条数
+        self.bytes_received = 0  # 推送成功的请求体字节数
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def lines(self) -> list[str]:
+        with self.lock:
+            return [
+                e.line for r in self.requests for s in r.streams for e in s.entries
+            ]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        self.server_close()
+
+
+class _PushHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeLoki
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if server.latency:
+            time.sleep(server.latency)
+        error = b""
+        with server.lock:
+            status = server.statuses.pop(0) if server.statuses else self.random_status()
+            status, headers = status if isinstance(status, tuple) else (status, {})
+            server.attempts += 1
+            if status == 204 and server.max_body_size and len(body) > server.max_body_size:
+                status = 413
+            if status == 204:
+                request = self.decode(body)
+                if server.max_line_size:
+                    error = self.validate(request)
+                    status = 400 if error else 204
+                server.entries += sum(len(s.entries) for s in request.streams)
+                server.bytes_received += len(body)
+                if server.keep_requests:
+                    server.requests.append(request)
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(error)))
+        self.end_headers()
+        self.wfile.write(error)
+
+    def validate(self, request: loki_push_pb2.PushRequest) -> bytes:
+        """移除行过长的日志，返回 Loki 格式的错误信息"""
+        limit = self.server.max_line_size
+        errors = []
+        for stream in request.streams:
+            entries = list(stream.entries)
+            del stream.entries[:]
+            for entry in entries:
+                size = len(entry.line.encode())
+                if size > limit:
+                    errors.append(
+                        f"Max entry size '{limit}' bytes exceeded for stream "
+                        f"'{stream.labels}' while adding an entry with length '{size}' bytes"
+                    )
+                else:
+                    stream.entries.append(entry)
+        return "\n".join(errors).encode()
+
+    def random_status(self) -> int | tuple[int, dict]:
+        value = random.random()
+        if value < self.server.error_rate:
+            return 503
+        if value < self.server.error_rate + self.server.throttle_rate:
+            return 429, {"Retry-After": self.server.retry_after}
+        return 204
+
+    def decode(self, body: bytes) -> loki_push_pb2.PushRequest:
+        """按 Content-Type/Content-Encoding 解码，JSON 请求转换为 PushRequest"""
+        if self.headers.get("Content-Type") != "application/json":
+            return loki_push_pb2.PushRequest.FromString(snappy.decompress(body))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        request = loki_push_pb2.PushRequest()
+        for stream in json.loads(body)["streams"]:
+            labels = ", ".join(f'{k}="{v}"' for k, v in stream["stream"].items())
+            entries = request.streams.add(labels=f"{{ {labels} }}").entries
+            for value in stream["values"]:
+                ts_ns = int(value[0])
+                entries.add(
+                    timestamp=loki_push_pb2.Timestamp(
+                        seconds=ts_ns // 1_000_000_000, nanos=ts_ns % 1_000_000_000
+                    ),
+                    line=value[1],
+                    structuredMetadata=value[2] if len(value) > 2 else {},
+                )
+        return request
+
+    def log_message(self, format, *args):
+        pass
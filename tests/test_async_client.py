@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import threading
+import time
+import unittest
+
+from logging_loki.async_client import AsyncLokiClient, AsyncLokiHandler
+
+from fake_loki import FakeLoki
+
+
+class TestAsyncLokiClient(unittest.TestCase):
+
+    def test_push_once(self):
+        async def main(url):
+            client = AsyncLokiClient(url, flush_interval=60)
+            await client.push_once(
+                dict(app="test_async"),
+                [[time.time_ns(), "line 1"], [time.time_ns(), "line 2", {"a": "p"}]],
+            )
+            await client.close()
+
+        with FakeLoki() as loki:
+            asyncio.run(main(loki.url))
+            self.assertEqual(loki.lines(), ["line 1", "line 2"])
+
+    def test_flush_interval_and_keep_alive(self):
+        async def main(url):
+            client = AsyncLokiClient(url, flush_interval=0.1)
+            for i in range(3):
+                client.push_wait(dict(app="test_async"), [[time.time_ns(), f"{i}"]])
+                await asyncio.sleep(0.3)
+            self.assertEqual(len(client.pool._idle), 1)
+            await client.close()
+
+        with FakeLoki() as loki:
+            asyncio.run(main(loki.url))
+            self.assertEqual(len(loki.requests), 3)
+
+    def test_request_timeout(self):
+        async def main(url):
+            client = AsyncLokiClient(
+                url, flush_interval=60, request_timeout=0.2, max_retries=1, retry_backoff=0.05
+            )
+            started = time.monotonic()
+            await client.push_once(dict(app="test_async"), [[time.time_ns(), "slow"]])
+            await client.close()
+            # 服务端迟迟不响应时按超时重试，close 不会一直等待
+            self.assertLess(time.monotonic() - started, 1)
+            metrics = client.metrics()
+            self.assertEqual(metrics["request_errors_total"], 2)
+            self.assertEqual(metrics["records_failed_total"], 1)
+
+        with FakeLoki(latency=1) as loki:
+            asyncio.run(main(loki.url))
+
+    def test_handler_from_other_thread(self):
+        async def main(url):
+            handler = AsyncLokiHandler(url, level="INFO", flush_interval=60)
+            logger = logging.getLogger("test_async_client")
+            logger.propagate = False
+            logger.addHandler(handler)
+            logger.setLevel("INFO")
+
+            logger.info("from loop")
+            thread = threading.Thread(target=logger.info, args=("from thread",))
+            thread.start()
+            await asyncio.to_thread(thread.join)
+            await asyncio.sleep(0)
+
+            logger.removeHandler(handler)
+            await handler.aclose()
+
+        with FakeLoki() as loki:
+            asyncio.run(main(loki.url))
+            self.assertEqual(sorted(loki.lines()), ["from loop", "from thread"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import time
+import unittest
+
+from logging_loki.batcher import BatchController
+
+from test_push_batch import CaptureClient
+
+KB = 1024
+
+
+class TestBatchController(unittest.TestCase):
+
+    def make(self, **kwargs):
+        kwargs.setdefault("burst_size", 1024 * KB)
+        return BatchController(100 * KB, 2, workers=2, **kwargs)
+
+    def test_grow_under_backlog(self):
+        bc = self.make()
+        for _ in range(50):
+            bc.record(bc.max_bytes, bc.max_bytes // 10, 100, 0.01, 204, backlog=3)
+        self.assertEqual(bc.max_bytes, 1024 * KB)
+
+        # 不再排队后回落到初始值
+        for _ in range(50):
+            bc.record(bc.max_bytes, bc.max_bytes // 10, 100, 0.01, 204, backlog=0)
+        self.assertEqual(bc.max_bytes, 100 * KB)
+
+    def test_hold_between(self):
+        bc = self.make()
+        bc.record(100 * KB, 10 * KB, 100, 0.01, 204, backlog=3)
+        size = bc.max_bytes
+        # 有排队但少于推送线程数，保持不变
+        bc.record(size, size // 10, 100, 0.01, 204, backlog=1)
+        self.assertEqual(bc.max_bytes, size)
+
+    def test_slow_push_grows(self):
+        bc = self.make()
+        bc.record(100 * KB, 10 * KB, 100, 1.5, 204, backlog=0)
+        self.assertGreater(bc.max_bytes, 100 * KB)
+
+    def test_too_large(self):
+        bc = self.make()
+        for _ in range(20):
+            bc.record(bc.max_bytes, bc.max_bytes // 10, 1000, 0.01, 204, backlog=3)
+        bc.record(400 * KB, 40 * KB, 1000, 0.01, 413, backlog=3)
+        self.assertEqual(bc.max_bytes, 320 * KB)
+        self.assertEqual(bc.max_entries, 800)
+        for _ in range(20):
+            bc.record(bc.max_bytes, bc.max_bytes // 10, 100, 0.01, 204, backlog=3)
+        self.assertEqual(bc.max_bytes, 320 * KB)
+
+    def test_request_size(self):
+        bc = self.make(max_request_size=50 * KB)
+        for _ in range(50):
+            bc.record(bc.max_bytes, bc.max_bytes // 4, 100, 0.01, 204, backlog=3)
+        self.assertLessEqual(bc.max_bytes, 200 * KB)
+        self.assertGreater(bc.max_bytes, 150 * KB)
+
+    def test_throttled(self):
+        bc = self.make()
+        for _ in range(5):
+            bc.record(100 * KB, 10 * KB, 100, 0.01, 429, backlog=0)
+        self.assertEqual(bc.flush_interval, 16)
+        for _ in range(20):
+            bc.record(100 * KB, 10 * KB, 100, 0.01, 204, backlog=0)
+        self.assertEqual(bc.flush_interval, 2)
+
+
+class TestClientBatcher(unittest.TestCase):
+
+    def test_max_entries(self):
+        lc = CaptureClient(flush_interval=60, max_cache_size=1 << 24, max_batch_entries=3)
+        for i in range(3):
+            lc.push_wait(dict(app="test"), [[time.time_ns(), f"line {i}"]])
+        deadline = time.monotonic() + 2
+        while not lc.bodies and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # 条数达到上限后由刷写线程立即刷写，不等待 flush_interval
+        self.assertEqual(len(lc.requests()[0].streams[0].entries), 3)
+        lc.close()
+
+    def test_batch_capped_while_draining(self):
+        lc = CaptureClient(flush_interval=60, max_cache_size=10000, max_batch_entries=1000)
+        key = lc.labels_key({"app": "test"})
+        now = time.time_ns()
+        # 刷写线程合并之前积压了大量日志，合并时按上限拆分为多个批次
+        with lc.p_lock:
+            for i in range(20000):
+                lc.push_entry(key, now + i, f"line {i}")
+        lc.close()
+        counts = [len(r.streams[0].entries) for r in lc.requests()]
+        self.assertEqual(sum(counts), 20000)
+        self.assertLessEqual(max(counts), 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import time
+import unittest
+
+from logging_loki.loki_client import LokiClient
+
+from benchmark_offline import scenario
+from fake_loki import FakeLoki
+from test_retry import wait_for
+
+
+class TestFakeLokiFaults(unittest.TestCase):
+
+    def test_error_rate(self):
+        with FakeLoki(error_rate=1, keep_requests=False) as loki:
+            lc = LokiClient(loki.url, thread_pool_size=1, max_retries=1, retry_backoff=0.01)
+            lc.push_once(dict(app="test_fake_loki"), [[time.time_ns(), "x"]])
+            self.assertTrue(wait_for(lambda: loki.attempts == 2))
+            self.assertEqual(loki.entries, 0)
+            lc.close()
+
+    def test_latency(self):
+        with FakeLoki(latency=0.2, keep_requests=False) as loki:
+            lc = LokiClient(loki.url, thread_pool_size=1)
+            lc.push_once(dict(app="test_fake_loki"), [[time.time_ns(), "x"]])
+            self.assertTrue(wait_for(lambda: loki.entries == 1))
+            self.assertGreaterEqual(lc.metrics()["push_rtt_seconds"]["sum"], 0.2)
+            self.assertEqual(loki.requests, [])
+            lc.close()
+
+
+class TestOfflineBenchmark(unittest.TestCase):
+
+    def test_scenarios(self):
+        for name in ("file", "loki"):
+            result = scenario(name, count=400, threads=2)
+            self.assertEqual(result["delivered"], 400)
+            self.assertGreater(result["records_per_second"], 0)
+            self.assertGreater(result["bytes_per_record"], 0)
+            self.assertGreater(result["peak_rss_mb"], 0)
+            self.assertLessEqual(result["emit_us"]["p50"], result["emit_us"]["max"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import warnings
+
+from logging_loki import LokiFormatter, LokiHandler
+from logging_loki.cardinality import CardinalityGuard
+
+from test_formatter import make_record
+
+
+class TestCardinalityGuard(unittest.TestCase):
+
+    def test_demote(self):
+        guard = CardinalityGuard(max_values=2)
+        for value in ("a", "b", "a"):
+            self.assertEqual(guard.split({"k": value, "app": "x"}), ({"k": value, "app": "x"}, None))
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            self.assertEqual(guard.split({"k": "c", "app": "x"}), ({"app": "x"}, {"k": "c"}))
+        self.assertEqual(len(caught), 1)
+        # 降级后之前见过的取值也写入 metadata
+        self.assertEqual(guard.split({"k": "a"}), ({}, {"k": "a"}))
+        self.assertEqual(guard.demoted, {"k"})
+
+
+class TestFormatterCardinality(unittest.TestCase):
+
+    def test_format_entry(self):
+        fmt = LokiFormatter(tags={"app": "test"}, max_label_values=3)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            entries = [
+                fmt.format_entry(make_record(tags={"user_id": i, "region": "eu"}))
+                for i in range(10)
+            ]
+        keys = {key for key, _, _, _ in entries}
+        # 前 3 个取值各自一个 stream，之后都合并到同一个 stream
+        self.assertEqual(len(keys), 4)
+        key, _, _, metadata = entries[-1]
+        self.assertEqual(dict(key)["region"], "eu")
+        self.assertNotIn("user_id", dict(key))
+        self.assertEqual(metadata["user_id"], "9")
+
+    def test_disabled(self):
+        fmt = LokiFormatter(max_label_values=0)
+        keys = {fmt.record_key(make_record(tags={"user_id": i})) for i in range(200)}
+        self.assertEqual(len(keys), 200)
+
+    def test_handler_metric(self):
+        handler = LokiHandler("http://127.0.0.1:9", max_label_values=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for i in range(3):
+                handler.formatter.format_entry(make_record(tags={"user_id": i}))
+        self.assertEqual(handler.metrics()["label_keys_demoted_total"], 1)
+        handler.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
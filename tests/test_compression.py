@@ -0,0 +1,104 @@
+import gzip
+import json
+import time
+import unittest
+
+from logging_loki.compression import (
+    AutoCodec,
+    GzipCodec,
+    SnappyCodec,
+    get_codec,
+    zstandard,
+)
+from logging_loki.loki_client import LokiClient
+from logging_loki.wire import StreamBuffer
+
+from fake_loki import FakeLoki
+
+BATCH = {(("app", "test"),): StreamBuffer(("json",))}
+BATCH[("app", "test"),].append(1_000_000_001, "hello")
+BATCH[("app", "test"),].append(1_000_000_002, "world", {"k": "v"})
+
+
+class TestCodecs(unittest.TestCase):
+
+    def test_get_codec(self):
+        self.assertIsInstance(get_codec("snappy"), SnappyCodec)
+        codec = get_codec("gzip:9")
+        self.assertIsInstance(codec, GzipCodec)
+        self.assertEqual(codec.level, 9)
+        self.assertEqual(get_codec("gzip", 1).level, 1)
+        self.assertEqual(get_codec("gzip").level, 6)
+        auto = get_codec("auto")
+        self.assertIsInstance(auto, AutoCodec)
+        # zstd 需要服务端支持，不会自动成为候选
+        self.assertEqual([c.name for c in auto.candidates], ["snappy", "gzip"])
+        with self.assertRaises(ValueError):
+            get_codec("lz4")
+
+    @unittest.skipIf(zstandard is not None, "已安装 zstandard")
+    def test_zstd_missing(self):
+        with self.assertRaises(ImportError):
+            get_codec("zstd")
+
+    def test_json(self):
+        raw = gzip.decompress(GzipCodec().compress(LokiClient.serialize(BATCH, "json")))
+        self.assertEqual(
+            json.loads(raw),
+            {
+                "streams": [
+                    {
+                        "stream": {"app": "test"},
+                        "values": [["1000000001", "hello"], ["1000000002", "world", {"k": "v"}]],
+                    }
+                ]
+            },
+        )
+
+    def test_auto_choose(self):
+        codec = AutoCodec(["snappy", "gzip"])
+        codec.record(codec.candidates[0], 1000, 500, 0.001)
+        codec.record(codec.candidates[1], 1000, 100, 0.004)
+        # 统计不足 1s，CPU 余量按 1 计算
+        codec.cpu_per_mb = 0
+        self.assertEqual(codec.choose().name, "snappy")
+        codec.cpu_per_mb = 100
+        self.assertEqual(codec.choose().name, "gzip")
+        self.assertEqual(codec.headers["Content-Encoding"], "gzip")
+        self.assertEqual(codec.format, "json")
+        self.assertEqual(gzip.decompress(codec.compress(b"hello")), b"hello")
+
+
+class TestClientCodec(unittest.TestCase):
+
+    def push(self, codec, lines=("a", "b")):
+        with FakeLoki() as loki:
+            lc = LokiClient(loki.url, thread_pool_size=1, codec=codec)
+            lc.push_once(dict(app="test_codec"), [[time.time_ns(), l, {"n": l}] for l in lines])
+            lc.close()
+            self.assertEqual(loki.lines(), list(lines))
+            self.assertEqual(
+                dict(loki.requests[0].streams[0].entries[0].structuredMetadata), {"n": "a"}
+            )
+            return lc
+
+    def test_gzip(self):
+        lc = self.push("gzip")
+        batches, raw_size, body_size, _ = lc.codec_stats["gzip"]
+        self.assertEqual(batches, 1)
+        self.assertLess(body_size, raw_size)
+
+    def test_gzipped_compat(self):
+        with FakeLoki() as loki:
+            lc = LokiClient(loki.url, gzipped=True)
+            self.assertEqual(lc.codec.name, "gzip")
+            lc.close()
+
+    def test_auto(self):
+        lc = self.push(AutoCodec(["snappy", "gzip"]))
+        self.assertEqual(set(lc.codec.stats), {"snappy", "gzip"})
+        self.assertEqual(sum(s[0] for s in lc.codec_stats.values()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import socket
+import threading
+import time
+import unittest
+
+import snappy
+
+from logging_loki.connection import ConnectionPool
+
+from fake_loki import FakeLoki
+
+EMPTY = snappy.compress(b"")
+
+
+class OneShotServer:
+    """每个连接只应答一次请求，然后关闭连接但不发送 Connection: close"""
+
+    def __init__(self):
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}"
+        self.accepted = 0
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            with conn:
+                data = b""
+                while b"\r\n\r\n" not in data:
+                    data += conn.recv(65536)
+                conn.sendall(b"HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n")
+
+    def close(self):
+        self.sock.close()
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def test_keep_alive(self):
+        with FakeLoki() as loki:
+            pool = ConnectionPool(loki.url)
+            for _ in range(5):
+                status, _, _ = pool.request("POST", "/loki/api/v1/push", EMPTY, {})
+                self.assertEqual(status, 204)
+            self.assertEqual(pool.created, 1)
+            pool.close()
+
+    def test_idle_timeout(self):
+        with FakeLoki() as loki:
+            pool = ConnectionPool(loki.url, idle_timeout=0.05)
+            pool.request("POST", "/loki/api/v1/push", EMPTY, {})
+            time.sleep(0.1)
+            pool.request("POST", "/loki/api/v1/push", EMPTY, {})
+            self.assertEqual(pool.created, 2)
+            pool.close()
+
+    def test_closed_by_server(self):
+        server = OneShotServer()
+        pool = ConnectionPool(server.url)
+        pool.request("POST", "/", b"1", {})
+        time.sleep(0.05)
+        self.assertEqual(pool.request("POST", "/", b"2", {})[0], 204)
+        self.assertEqual(pool.created, 2)
+        pool.close()
+        server.close()
+
+    def test_resend_on_half_closed(self):
+        server = OneShotServer()
+        pool = ConnectionPool(server.url)
+        pool.is_alive = lambda conn: True  # 模拟检查之后才被服务端关闭
+        pool.request("POST", "/", b"1", {})
+        time.sleep(0.05)
+        self.assertEqual(pool.request("POST", "/", b"2", {})[0], 204)
+        self.assertEqual(server.accepted, 2)
+        pool.close()
+        server.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import queue
+import time
+import unittest
+
+from logging_loki.async_client import AsyncLokiHandler
+from logging_loki.dedup import Deduplicator
+from logging_loki.handler import LokiHandler
+from logging_loki.shipper import LokiQueueHandler
+
+from fake_loki import FakeLoki
+from test_retry import wait_for
+
+
+class TestDeduplicator(unittest.TestCase):
+
+    def test_window(self):
+        dedup = Deduplicator(window=0.05)
+        self.assertTrue(dedup.offer("a", 1))
+        self.assertTrue(dedup.offer("b", 1))
+        for i in range(2, 5):
+            self.assertFalse(dedup.offer("a", i))
+        self.assertEqual(dedup.expire(), [])
+        time.sleep(0.06)
+        self.assertEqual(dedup.expire(), [(4, 3)])
+        # a 仍在重复，开始下一个窗口；b 没有重复，不再跟踪
+        self.assertEqual(len(dedup), 1)
+        self.assertFalse(dedup.offer("a", 5))
+        self.assertTrue(dedup.offer("b", 2))
+        self.assertEqual(dedup.expire(final=True), [(5, 1)])
+        self.assertEqual(len(dedup), 0)
+        self.assertEqual(dedup.suppressed, 4)
+
+    def test_max_keys(self):
+        dedup = Deduplicator(window=60, max_keys=1)
+        self.assertTrue(dedup.offer("a", 1))
+        self.assertTrue(dedup.offer("b", 1))
+        self.assertTrue(dedup.offer("b", 2))
+        self.assertFalse(dedup.offer("a", 2))
+
+
+class TestHandlerDedup(unittest.TestCase):
+
+    def test_storm(self):
+        with FakeLoki() as loki:
+            handler = LokiHandler(
+                loki.url, level="INFO", flush_interval=0.1, dedup_window=0.2
+            )
+            logger = logging.getLogger(f"test_dedup.{self.id()}")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            logger.addHandler(handler)
+            for i in range(1000):
+                logger.error("connection to %s failed", f"db-{i}")
+            logger.info("other")
+            self.assertTrue(wait_for(lambda: len(loki.lines()) == 3))
+            entries = [e for r in loki.requests for s in r.streams for e in s.entries]
+            self.assertEqual(entries[0].line, "connection to db-0 failed")
+            summary = next(e for e in entries if "repeat_count" in e.structuredMetadata)
+            self.assertEqual(summary.line, "connection to db-999 failed")
+            self.assertEqual(summary.structuredMetadata["repeat_count"], "999")
+            self.assertEqual(handler.metrics()["records_collapsed_total"], 999)
+            logger.removeHandler(handler)
+            handler.close()
+
+    def test_close_flushes_summary(self):
+        with FakeLoki() as loki:
+            handler = LokiHandler(loki.url, level="INFO", dedup_window=60)
+            logger = logging.getLogger(f"test_dedup.{self.id()}")
+            logger.propagate = False
+            logger.addHandler(handler)
+            for _ in range(3):
+                logger.error("boom")
+            logger.removeHandler(handler)
+            handler.close()
+            self.assertEqual(loki.lines(), ["boom", "boom"])
+
+    def test_queue_handler(self):
+        items = queue.Queue()
+        handler = LokiQueueHandler(items, level="INFO", dedup_window=0.1)
+        logger = logging.getLogger(f"test_dedup.{self.id()}")
+        logger.propagate = False
+        logger.addHandler(handler)
+        for _ in range(3):
+            logger.error("boom")
+        # 工作进程中由 QueueClient 的后台线程推送到期的汇总
+        self.assertTrue(wait_for(lambda: items.qsize() == 2))
+        _, _, line, metadata = items.queue[1]
+        self.assertEqual((line, metadata["repeat_count"]), ("boom", "2"))
+        logger.removeHandler(handler)
+        handler.close()
+
+    def test_async_handler(self):
+        async def main(url, loki):
+            handler = AsyncLokiHandler(url, level="INFO", flush_interval=0.05, dedup_window=0.1)
+            logger = logging.getLogger(f"test_dedup.{self.id()}")
+            logger.propagate = False
+            logger.addHandler(handler)
+            for _ in range(3):
+                logger.error("boom")
+            for _ in range(100):
+                if len(loki.lines()) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(loki.lines(), ["boom", "boom"])
+            logger.removeHandler(handler)
+            await handler.aclose()
+
+        with FakeLoki() as loki:
+            asyncio.run(main(loki.url, loki))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import time
+import unittest
+
+from logging_loki.labels import stream_hash
+from logging_loki.lanes import Lane
+from logging_loki.loki_client import LokiClient
+from logging_loki.wire import StreamBuffer
+
+from fake_loki import FakeLoki
+from test_retry import wait_for
+
+
+class TestPartition(unittest.TestCase):
+
+    def test_split_by_stream_hash(self):
+        lc = LokiClient("http://127.0.0.1:9", thread_pool_size=3)
+        batch = {}
+        for i in range(20):
+            key = lc.labels_key({"app": "dispatch", "i": i})
+            batch[key] = StreamBuffer()
+            batch[key].append(time.time_ns(), "x" * i)
+        parts = lc._partition(batch, 10000)
+        self.assertEqual(sum(size for _, _, size in parts), 10000)
+        self.assertEqual(sum(len(part) for _, part, _ in parts), 20)
+        for partition, part, _ in parts:
+            for key in part:
+                self.assertEqual(stream_hash(key) % 3, partition)
+        lc.close()
+
+    def test_single_partition(self):
+        lc = LokiClient("http://127.0.0.1:9", thread_pool_size=1)
+        batch = {lc.labels_key({"app": "dispatch"}): StreamBuffer()}
+        self.assertEqual(lc._partition(batch, 10), [(0, batch, 10)])
+        lc.close()
+
+
+class TestStreamOrder(unittest.TestCase):
+
+    def test_same_stream_waits_for_retry(self):
+        with FakeLoki() as loki:
+            loki.statuses = [503]
+            lc = LokiClient(loki.url, thread_pool_size=3, retry_backoff=0.4)
+            labels = {"app": "dispatch"}
+            lc.push_once(labels, [[time.time_ns(), "first"]])
+            self.assertTrue(wait_for(lambda: len(lc._retries) == 1))
+            lc.push_once(labels, [[time.time_ns(), "second"]])
+            # 同一 stream 之后的批次等待重试完成，不会先于它推送
+            time.sleep(0.15)
+            self.assertEqual(loki.lines(), [])
+            self.assertTrue(wait_for(lambda: loki.lines() == ["first", "second"]))
+            self.assertTrue(wait_for(lambda: lc.backlog_size == 0))
+            lc.close()
+
+    def test_retry_does_not_block_other_lane(self):
+        with FakeLoki() as loki:
+            loki.statuses = [503]
+            lc = LokiClient(
+                loki.url,
+                thread_pool_size=1,
+                retry_backoff=4,
+                lanes=[Lane("error", flush_interval=0)],
+            )
+            key = lc.labels_key({"app": "dispatch"})
+            lc.push_entry(key, time.time_ns(), "bulk")
+            lc.flush()
+            self.assertTrue(wait_for(lambda: len(lc._retries) == 1))
+            # 默认通道的分区在等待重试，error 通道同一分区的批次不受影响
+            lc.push_entry(key, time.time_ns(), "urgent", lane=0)
+            self.assertTrue(wait_for(lambda: loki.lines() == ["urgent"], 0.5))
+            lc.close()
+            self.assertEqual(loki.lines(), ["urgent", "bulk"])
+
+    def test_concurrent_threads_sorted(self):
+        with FakeLoki() as loki:
+            lc = LokiClient(loki.url, thread_pool_size=2, flush_interval=60)
+            key = lc.labels_key({"app": "dispatch"})
+            now = time.time_ns()
+            for ts_ns in (now + 2, now, now + 1):
+                lc.push_entry(key, ts_ns, str(ts_ns - now))
+            lc.close()
+            self.assertEqual(loki.lines(), ["0", "1", "2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import logging
+import sys
+import unittest
+
+from logging_loki import LokiFormatter, LokiHandler
+
+from fake_loki import FakeLoki
+
+logger = logging.getLogger("test_formatter")
+
+
+def make_record(msg="hello %s", args=("world",), exc_info=None, **extra):
+    record = logger.makeRecord(
+        "test_formatter", logging.INFO, "f.py", 10, msg, args, exc_info, extra=extra
+    )
+    return record
+
+
+class TestFormatter(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.fmt = LokiFormatter(
+            "%(asctime)s %(levelname)s %(message)s",
+            tags={"app": "test"},
+            metadata={"env": 1},
+            included_field=("levelname", "lineno", "missing"),
+        )
+
+    def test_entry(self):
+        key, ts_ns, line, metadata = self.fmt.format_entry(make_record())
+        self.assertEqual(key, (("app", "test"), ("instance", self.fmt.hostname)))
+        self.assertTrue(line.endswith("INFO hello world"))
+        self.assertEqual(metadata, {"env": "1", "levelname": "INFO", "lineno": "10"})
+
+        stream = self.fmt.format(make_record())
+        self.assertEqual(stream["stream"], dict(key))
+        self.assertEqual(stream["values"][0][2], metadata)
+
+    def test_record_tags(self):
+        key, _, _, metadata = self.fmt.format_entry(
+            make_record(tags={"app": "other", "k": 2}, metadata={"m": "v"})
+        )
+        self.assertEqual(dict(key)["app"], "other")
+        self.assertEqual(dict(key)["k"], "2")
+        self.assertEqual(metadata["m"], "v")
+
+    def test_asctime(self):
+        record = make_record()
+        expected = logging.Formatter().formatTime(record)
+        self.assertEqual(self.fmt.formatTime(record), expected)
+        self.assertEqual(self.fmt.formatTime(record), expected)
+        record.created += 1.5
+        record.msecs = 500
+        self.assertEqual(self.fmt.formatTime(record), logging.Formatter().formatTime(record))
+
+    def test_exception_cache(self):
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            exc_info = sys.exc_info()
+        first = self.fmt.formatException(exc_info)
+        self.assertIn("ZeroDivisionError", first)
+        self.assertIs(self.fmt.formatException(exc_info), first)
+        line = self.fmt.format_entry(make_record("boom", (), exc_info))[2]
+        self.assertTrue(line.endswith(first))
+
+    def test_compile(self):
+        self.fmt.tags["app"] = "changed"
+        self.fmt.compile()
+        self.assertEqual(dict(self.fmt.format_entry(make_record())[0])["app"], "changed")
+
+
+class SlowFormatter(LokiFormatter):
+    def format(self, record):
+        stream = super().format(record)
+        stream["values"][0][1] = "custom"
+        return stream
+
+
+class TestHandler(unittest.TestCase):
+
+    def log(self, formatter=None):
+        with FakeLoki() as loki:
+            handler = LokiHandler(loki.url, level="INFO", tags={"app": "test"})
+            if formatter is not None:
+                handler.setFormatter(formatter)
+            # 其他测试的 dictConfig 可能禁用已存在的 logger，这里使用新的 logger
+            _logger = logging.getLogger(f"test_formatter.{self.id()}")
+            _logger.propagate = False
+            _logger.addHandler(handler)
+            try:
+                _logger.warning("fast %d", 1)
+            finally:
+                _logger.removeHandler(handler)
+                handler.close()
+            return handler, loki.lines()
+
+    def test_fast_path(self):
+        handler, lines = self.log()
+        self.assertTrue(handler._fast_format)
+        self.assertEqual(lines, ["fast 1"])
+
+    def test_override_format(self):
+        handler, lines = self.log(SlowFormatter())
+        self.assertFalse(handler._fast_format)
+        self.assertEqual(lines, ["custom"])
+
+
+if __name__ == "__main__":
+    unittest.main()
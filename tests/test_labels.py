@@ -0,0 +1,51 @@
+import time
+import unittest
+
+from logging_loki.labels import labels_key, sanitize_name, stream_hash, stream_selector
+from logging_loki.loki_client import LokiClient
+
+from fake_loki import FakeLoki
+
+
+class TestLabels(unittest.TestCase):
+
+    def test_key(self):
+        key = labels_key({"b": 2, "a": "1"})
+        self.assertEqual(key, (("a", "1"), ("b", "2")))
+        # 相同顺序的标签命中缓存，返回同一个对象
+        self.assertIs(labels_key({"b": 2, "a": "1"}), key)
+        self.assertEqual(labels_key({"a": "1", "b": 2}), key)
+        self.assertEqual(labels_key({"a": ["x"]}), (("a", "['x']"),))
+
+    def test_sanitize(self):
+        self.assertEqual(sanitize_name("service.name"), "service_name")
+        self.assertEqual(sanitize_name("1st"), "_1st")
+        self.assertEqual(sanitize_name(""), "_")
+        self.assertEqual(labels_key({"a.b": "1", "a_b": "2"}), (("a_b", "2"),))
+
+    def test_selector(self):
+        key = labels_key({"path": 'C:\\dir "x"\nnext', "app": "a"})
+        self.assertEqual(
+            stream_selector(key), '{ app="a", path="C:\\\\dir \\"x\\"\\nnext" }'
+        )
+        self.assertEqual(LokiClient.label_to_string({"b": "2", "a": "1"}), '{ a="1", b="2" }')
+
+    def test_hash(self):
+        # 不随进程变化
+        self.assertEqual(stream_hash(labels_key({"app": "a"})), 7078295442501602125)
+        self.assertNotEqual(
+            stream_hash(labels_key({"app": "a"})), stream_hash(labels_key({"app": "b"}))
+        )
+
+    def test_push(self):
+        with FakeLoki() as loki:
+            lc = LokiClient(loki.url, thread_pool_size=0)
+            lc.push_once({"app": 'say "hi"'}, [[time.time_ns(), "x"]])
+            lc.close()
+            (stream,) = loki.requests[0].streams
+            self.assertEqual(stream.labels, '{ app="say \\"hi\\"" }')
+            self.assertEqual(stream.hash, stream_hash((("app", 'say "hi"'),)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import logging
+import time
+import unittest
+
+from logging_loki.handler import LokiHandler
+from logging_loki.lanes import Lane
+from logging_loki.loki_client import LokiClient
+
+from fake_loki import FakeLoki
+from test_retry import wait_for
+
+
+def make_record(level: int, msg: str = "m") -> logging.LogRecord:
+    return logging.LogRecord("test_lanes", level, __file__, 1, msg, None, None)
+
+
+class TestLane(unittest.TestCase):
+
+    def test_matches(self):
+        error = Lane("error", level="ERROR")
+        self.assertTrue(error.matches(make_record(logging.CRITICAL)))
+        self.assertFalse(error.matches(make_record(logging.INFO)))
+        audit = Lane("audit", predicate=lambda r: r.msg.startswith("audit"))
+        self.assertTrue(audit.matches(make_record(logging.INFO, "audit: login")))
+        self.assertFalse(audit.matches(make_record(logging.INFO, "login")))
+        self.assertFalse(Lane("any").matches(make_record(logging.INFO)))
+
+    def test_lane_for(self):
+        lc = LokiClient(
+            "http://127.0.0.1:9",
+            lanes=[Lane("error", level=logging.ERROR), Lane("warn", level=logging.WARNING)],
+        )
+        self.assertEqual(lc.lane_for(make_record(logging.ERROR)), 0)
+        self.assertEqual(lc.lane_for(make_record(logging.WARNING)), 1)
+        self.assertEqual(lc.lane_for(make_record(logging.INFO)), -1)
+        lc.close()
+
+    def test_ring_not_supported(self):
+        with self.assertRaises(ValueError):
+            LokiClient("http://127.0.0.1:9", lanes=[Lane("error")], ring_path="ring")
+
+
+class TestClientLanes(unittest.TestCase):
+
+    def test_error_not_batched_with_info(self):
+        with FakeLoki() as loki:
+            handler = LokiHandler(
+                loki.url,
+                level="INFO",
+                flush_interval=60,
+                lanes=[Lane("error", level=logging.ERROR, flush_interval=0)],
+            )
+            logger = logging.getLogger(f"test_lanes.{self.id()}")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            logger.addHandler(handler)
+            logger.info("bulk")
+            logger.error("urgent")
+            self.assertTrue(wait_for(lambda: loki.lines() == ["urgent"], 0.5))
+            logger.removeHandler(handler)
+            handler.close()
+            self.assertEqual(loki.lines(), ["urgent", "bulk"])
+
+    def test_workers_share(self):
+        with FakeLoki(latency=0.3) as loki:
+            lane = Lane("error", workers=1)
+            lc = LokiClient(loki.url, thread_pool_size=3, lanes=[lane])
+            for i in range(3):
+                lc.push_entry(lc.labels_key({"app": "test"}), time.time_ns(), str(i), lane=0)
+                lc.flush([lane])
+            time.sleep(0.45)
+            # 该通道同时只推送一个请求
+            self.assertEqual(loki.entries, 1)
+            self.assertTrue(wait_for(lambda: loki.entries == 3))
+            self.assertEqual(loki.lines(), ["0", "1", "2"])
+            lc.close()
+
+    def test_workers_reserved(self):
+        with FakeLoki(latency=1) as loki:
+            lane = Lane("error", flush_interval=0, workers=1)
+            lc = LokiClient(loki.url, thread_pool_size=3, flush_interval=60, lanes=[lane])
+            now = time.time_ns()
+            for i in range(20):
+                lc.push_entry(lc.labels_key({"app": "test", "i": i}), now, "bulk")
+            lc.flush()
+            time.sleep(0.1)
+            # 默认通道的慢请求占不满推送线程，error 通道不需要等待它们完成
+            started = time.monotonic()
+            lc.push_entry(lc.labels_key({"app": "test"}), time.time_ns(), "urgent", lane=0)
+            self.assertTrue(wait_for(lambda: "urgent" in loki.lines(), 3))
+            self.assertLess(time.monotonic() - started, 1.5)
+            lc.close()
+            self.assertEqual(loki.lines().count("bulk"), 20)
+
+    def test_drop_low_priority_first(self):
+        error = Lane("error")
+        lc = LokiClient(
+            "http://127.0.0.1:9", thread_pool_size=0, lanes=[error], max_buffer_size=1 << 20
+        )
+        with lc._space:
+            for lane in (error, lc.lane, lc.lane):
+                lane.outbox.append(({}, 600 << 10, None, 0))
+                lc.outbox_size += 600 << 10
+            lc._drop_oldest()
+            self.assertEqual((len(error.outbox), len(lc.lane.outbox)), (1, 0))
+            error.outbox.clear()
+            lc.outbox_size = 0
+        lc.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import queue
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from logging_loki.async_client import AsyncLokiHandler
+from logging_loki.handler import LokiHandler
+from logging_loki.loki_client import LokiClient
+from logging_loki.metrics import Histogram, ThreadLocalHistogram, prometheus_text
+from logging_loki.shipper import LokiQueueHandler
+
+from fake_loki import FakeLoki
+from test_retry import wait_for
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_observe(self):
+        h = Histogram((1, 10))
+        for value in (0.5, 1, 5, 50):
+            h.observe(value)
+        snapshot = h.snapshot()
+        self.assertEqual(snapshot["buckets"], {1: 2, 10: 3, float("inf"): 4})
+        self.assertEqual(snapshot["sum"], 56.5)
+        self.assertEqual(snapshot["count"], 4)
+
+    def test_thread_local(self):
+        h = ThreadLocalHistogram((1,))
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(lambda _: [h.observe(0.5) for _ in range(1000)], range(4)))
+        h.observe(2)
+        snapshot = h.snapshot()
+        self.assertEqual(snapshot["buckets"], {1: 4000, float("inf"): 4001})
+        self.assertEqual(snapshot["count"], 4001)
+
+    def test_prometheus_text(self):
+        h = Histogram((1,))
+        h.observe(0.5)
+        text = prometheus_text(
+            {"sent_total": 3, "queue": 1, "rtt": h.snapshot()}, labels={"app": "a"}
+        )
+        self.assertIn("# TYPE loki_client_sent_total counter", text)
+        self.assertIn('loki_client_sent_total{app="a"} 3', text)
+        self.assertIn("# TYPE loki_client_queue gauge", text)
+        self.assertIn('loki_client_rtt_bucket{app="a",le="1.0"} 1', text)
+        self.assertIn('loki_client_rtt_bucket{app="a",le="+Inf"} 1', text)
+        self.assertIn('loki_client_rtt_count{app="a"} 1', text)
+        text = prometheus_text({"queue": 1}, labels={"path": 'C:\\"x"\n'})
+        self.assertIn('loki_client_queue{path="C:\\\\\\"x\\"\\n"} 1', text)
+
+
+class TestClientMetrics(unittest.TestCase):
+
+    def test_sent(self):
+        with FakeLoki() as loki:
+            lc = LokiClient(loki.url, thread_pool_size=1)
+            lc.push_once(dict(app="test_metrics"), [[time.time_ns(), f"line {i}"] for i in range(5)])
+            self.assertTrue(wait_for(lambda: lc.metrics()["records_sent_total"] == 5))
+            metrics = lc.metrics()
+            self.assertEqual(metrics["records_enqueued_total"], 5)
+            self.assertEqual(metrics["requests_total"], 1)
+            self.assertEqual(metrics["batch_records"]["count"], 1)
+            self.assertEqual(metrics["push_rtt_seconds"]["count"], 1)
+            self.assertEqual(metrics["record_age_seconds"]["count"], 1)
+            self.assertGreater(metrics["bytes_raw_total"], 0)
+            self.assertEqual(metrics["bytes_sent_total"], metrics["bytes_compressed_total"])
+            self.assertEqual(metrics["backlog_bytes"], 0)
+            self.assertIn("loki_client_records_sent_total 5", lc.prometheus())
+            lc.close()
+
+    def test_retried_and_failed(self):
+        with FakeLoki() as loki:
+            loki.statuses = [(429, {"Retry-After": "0"}), 400]
+            lc = LokiClient(loki.url, thread_pool_size=1, retry_backoff=0.01)
+            lc.push_once(dict(app="test_metrics"), [[time.time_ns(), "rejected"]])
+            self.assertTrue(wait_for(lambda: lc.metrics()["records_failed_total"] == 1))
+            metrics = lc.metrics()
+            self.assertEqual(metrics["retries_total"], 1)
+            self.assertEqual(metrics["throttled_total"], 1)
+            self.assertEqual(metrics["request_errors_total"], 2)
+            self.assertEqual(metrics["records_sent_total"], 0)
+            lc.close()
+
+    def test_dropped(self):
+        lc = LokiClient(
+            "http://127.0.0.1:9", max_buffer_size=100, overflow_policy="drop_newest"
+        )
+        lc.push_wait(dict(app="test_metrics"), [[time.time_ns(), "x" * 200]] * 3)
+        metrics = lc.metrics()
+        self.assertEqual(metrics["records_dropped_total"], 3)
+        self.assertEqual(metrics["records_enqueued_total"], 0)
+        lc.close()
+
+
+class TestHandlerMetrics(unittest.TestCase):
+
+    def test_emit_seconds(self):
+        with FakeLoki() as loki:
+            handler = LokiHandler(loki.url, level="INFO", flush_interval=0.1)
+            logger = logging.getLogger(f"test_metrics.{self.id()}")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            logger.addHandler(handler)
+            for i in range(10):
+                logger.info("message %d", i)
+            self.assertTrue(wait_for(lambda: len(loki.lines()) == 10))
+            metrics = handler.metrics()
+            self.assertEqual(metrics["emit_seconds"]["count"], 10)
+            self.assertEqual(metrics["records_enqueued_total"], 10)
+            self.assertIn("loki_client_emit_seconds_count 10", handler.prometheus())
+            logger.removeHandler(handler)
+            handler.close()
+
+    def test_queue_handler(self):
+        handler = LokiQueueHandler(queue.Queue(), level="INFO")
+        handler.handle(logging.makeLogRecord({"msg": "queued", "levelno": logging.INFO}))
+        metrics = handler.metrics()
+        self.assertEqual(metrics["records_enqueued_total"], 1)
+        self.assertEqual(metrics["emit_seconds"]["count"], 1)
+        self.assertIn("loki_client_records_enqueued_total 1", handler.prometheus())
+        handler.close()
+
+    def test_async_handler(self):
+        async def main(url):
+            handler = AsyncLokiHandler(url, level="INFO", flush_interval=60)
+            handler.handle(logging.makeLogRecord({"msg": "async", "levelno": logging.INFO}))
+            await handler.loki_client.flush()
+            metrics = handler.metrics()
+            self.assertEqual(metrics["records_enqueued_total"], 1)
+            self.assertEqual(metrics["records_sent_total"], 1)
+            self.assertEqual(metrics["push_rtt_seconds"]["count"], 1)
+            self.assertIn("loki_client_records_sent_total 1", handler.prometheus())
+            await handler.aclose()
+
+        with FakeLoki() as loki:
+            asyncio.run(main(loki.url))
+
+
+if __name__ == "__main__":
+    unittest.main()
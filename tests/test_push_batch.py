@@ -0,0 +1,225 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import snappy
+
+from logging_loki import loki_push_pb2
+from logging_loki.loki_client import LokiClient
+
+
+class CaptureClient(LokiClient):
+    """不发送网络请求，只记录推送的请求体"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("loki_url", "http://127.0.0.1:3100")
+        kwargs.setdefault("thread_pool_size", 0)
+        super().__init__(**kwargs)
+        self.bodies = []
+        self.push_threads = []
+
+    def _request(self, method, url, body=None, headers=None, **kwargs):
+        self.bodies.append(body)
+        self.push_threads.append(threading.current_thread().name)
+        return 204, None
+
+    def requests(self) -> list[loki_push_pb2.PushRequest]:
+        return [
+            loki_push_pb2.PushRequest.FromString(snappy.decompress(b))
+            for b in self.bodies
+        ]
+
+
+class TestPushBatch(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.lc = CaptureClient(flush_interval=60, max_cache_size=1 << 24)
+
+    def tearDown(self) -> None:
+        self.lc.close()
+
+    def test_same_labels_one_stream(self):
+        for i in range(100):
+            self.lc.push_wait(
+                dict(app="test", type="batch"), [[time.time_ns(), f"line {i}"]]
+            )
+        self.lc.flush()
+
+        (req,) = self.lc.requests()
+        self.assertEqual(len(req.streams), 1)
+        self.assertEqual(len(req.streams[0].entries), 100)
+
+    def test_label_order_is_canonical(self):
+        self.lc.push_wait(dict(a="1", b="2"), [[time.time_ns(), "x"]])
+        self.lc.push_wait(dict(b="2", a="1"), [[time.time_ns(), "y"]])
+        self.lc.push_wait(dict(a="1", b="3"), [[time.time_ns(), "z", {"m": "v"}]])
+        self.lc.flush()
+
+        (req,) = self.lc.requests()
+        self.assertEqual(
+            sorted(len(s.entries) for s in req.streams),
+            [1, 2],
+        )
+
+    def test_batch_size_estimate(self):
+        for i in range(500):
+            self.lc.push_wait(
+                dict(app="test", i=str(i % 7)),
+                [[time.time_ns(), f"line {i}" * (i % 50), {"i": str(i)}]],
+            )
+        with self.lc.p_lock:
+            self.lc._drain()
+            real_size = len(self.lc.serialize(self.lc.streams, "protobuf"))
+        self.assertAlmostEqual(self.lc.batch_size / real_size, 1, delta=0.1)
+
+        self.lc.flush()
+        self.assertEqual(self.lc.batch_size, 0)
+
+    def test_many_threads(self):
+        def log(n):
+            for i in range(200):
+                self.lc.push_wait(dict(app="test"), [[time.time_ns(), f"{n}-{i}"]])
+
+        with ThreadPoolExecutor(20) as pool:
+            list(pool.map(log, range(20)))
+        self.lc.flush()
+
+        lines = [e.line for r in self.lc.requests() for s in r.streams for e in s.entries]
+        self.assertEqual(len(lines), 4000)
+        self.assertEqual(len(set(lines)), 4000)
+
+
+class TestFlusher(unittest.TestCase):
+
+    def wait_bodies(self, lc, count=1, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while len(lc.bodies) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return len(lc.bodies)
+
+    def test_flush_after_quiet(self):
+        lc = CaptureClient(flush_interval=0.2)
+        lc.push_wait(dict(app="test"), [[time.time_ns(), "burst"]])
+        self.assertEqual(lc.bodies, [])
+        self.assertEqual(self.wait_bodies(lc), 1)
+        lc.close()
+
+    def test_flush_on_size(self):
+        lc = CaptureClient(flush_interval=60, max_cache_size=1024)
+        for i in range(20):
+            lc.push_wait(dict(app="test"), [[time.time_ns(), "x" * 100]])
+        self.assertGreaterEqual(self.wait_bodies(lc), 1)
+        lc.close()
+
+    def test_encode_in_push_pool(self):
+        lc = CaptureClient(flush_interval=60, thread_pool_size=1)
+        lc.push_once(dict(app="test"), [[time.time_ns(), "pool", {"a": "b"}]])
+        lc.close()
+        self.assertTrue(lc.push_threads[0].startswith("loki-push"))
+        (req,) = lc.requests()
+        self.assertEqual(req.streams[0].labels, '{ app="test" }')
+        self.assertEqual(dict(req.streams[0].entries[0].structuredMetadata), {"a": "b"})
+
+    def test_close_flushes(self):
+        lc = CaptureClient(flush_interval=60)
+        lc.push_wait(dict(app="test"), [[time.time_ns(), "last"]])
+        lc.close()
+        self.assertEqual(len(lc.bodies), 1)
+        self.assertFalse(lc._flusher.is_alive())
+
+
+class BlockedClient(CaptureClient):
+    """推送被阻塞，直到 release 被设置，模拟 Loki 不可用"""
+
+    def __init__(self, **kwargs):
+        self.release = threading.Event()
+        super().__init__(**kwargs)
+
+    def _request(self, method, url, body=None, headers=None, **kwargs):
+        self.release.wait()
+        return super()._request(method, url, body, headers, **kwargs)
+
+    def lines(self):
+        return [e.line for r in self.requests() for s in r.streams for e in s.entries]
+
+
+class TestOverflow(unittest.TestCase):
+
+    def make(self, policy, **kwargs):
+        return BlockedClient(
+            flush_interval=60,
+            thread_pool_size=1,
+            max_buffer_size=2000,
+            overflow_policy=policy,
+            **kwargs,
+        )
+
+    def push(self, lc, count=100, flush_every=0):
+        for i in range(count):
+            lc.push_wait(dict(app="test"), [[time.time_ns(), f"{i:03d}" + "x" * 97]])
+            if flush_every and i % flush_every == flush_every - 1:
+                lc.flush()
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            CaptureClient(overflow_policy="drop_all")
+
+    def test_drop_newest(self):
+        lc = self.make("drop_newest")
+        self.push(lc)
+        lc.release.set()
+        lc.close()
+        lines = lc.lines()
+        self.assertGreater(lc.dropped_records, 0)
+        self.assertEqual(len(lines) + lc.dropped_records, 100)
+        self.assertEqual(lines[0][:3], "000")
+
+    def test_drop_oldest(self):
+        lc = self.make("drop_oldest")
+        self.push(lc, flush_every=5)
+        lc.release.set()
+        lc.close()
+        lines = lc.lines()
+        self.assertGreater(lc.dropped_records, 0)
+        self.assertEqual(len(lines) + lc.dropped_records, 100)
+        self.assertEqual(lines[-1][:3], "099")
+        self.assertLessEqual(lc.backlog_size, lc.max_buffer_size)
+
+    def test_sample(self):
+        lc = self.make("sample", sample_rate=10)
+        self.push(lc, count=300)
+        lc.release.set()
+        lc.close()
+        lines = lc.lines()
+        self.assertEqual(len(lines) + lc.dropped_records, 300)
+        self.assertGreater(len(lines), 20)
+
+    def test_block(self):
+        lc = self.make("block")
+        threading.Timer(0.3, lc.release.set).start()
+        started = time.monotonic()
+        self.push(lc, flush_every=5)
+        self.assertGreater(time.monotonic() - started, 0.2)
+        lc.close()
+        self.assertEqual(lc.dropped_records, 0)
+        self.assertEqual(len(lc.lines()), 100)
+
+    def test_block_oversized_record(self):
+        lc = self.make("block")
+        lc.release.set()
+        self.push(lc, count=5)
+        # 超过 max_buffer_size 的单条日志在缓存清空后接收，不会一直阻塞
+        producer = threading.Thread(
+            target=lc.push_wait, args=(dict(app="test"), [[time.time_ns(), "y" * 5000]])
+        )
+        producer.start()
+        producer.join(3)
+        self.assertFalse(producer.is_alive())
+        lc.close()
+        self.assertEqual(lc.dropped_records, 0)
+        self.assertEqual(lc.lines()[-1], "y" * 5000)
+
+
+if __name__ == "__main__":
+    unittest.main()
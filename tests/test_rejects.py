@@ -0,0 +1,119 @@
+import os
+import time
+import unittest
+
+from logging_loki.loki_client import LokiClient
+from logging_loki.rejects import bisect_batch, fit_line, parse_rejection, split_rejected
+from logging_loki.wire import StreamBuffer
+
+from fake_loki import FakeLoki
+
+KEY = (("app", "rejects"),)
+OTHER = (("app", "other"), ("level", "INFO"))
+
+
+def make_stream(lines, ts_ns=1_700_000_000_000_000_000) -> StreamBuffer:
+    stream = StreamBuffer(("protobuf",))
+    for i, line in enumerate(lines):
+        stream.append(ts_ns + i, line)
+    return stream
+
+
+class TestRejects(unittest.TestCase):
+
+    def test_fit_line(self):
+        self.assertEqual(fit_line("short", 10), ["short"])
+        # 不从多字节字符的中间截断
+        self.assertEqual(fit_line("ab中文", 6), ["ab中"])
+        chunks = fit_line("中文" * 10, 7, chunk=True)
+        self.assertEqual("".join(chunks), "中文" * 10)
+        self.assertTrue(all(len(c.encode()) <= 7 for c in chunks))
+
+    def test_bisect(self):
+        batch = {KEY: make_stream(["a"] * 3), OTHER: make_stream(["b"] * 3)}
+        self.assertEqual([list(half) for half in bisect_batch(batch)], [[KEY], [OTHER]])
+        halves = bisect_batch({KEY: make_stream("abcde")})
+        self.assertEqual([len(half[KEY]) for half in halves], [2, 3])
+        self.assertEqual(halves[1][KEY].entry(0)[1], "c")
+        self.assertEqual(bisect_batch({KEY: make_stream(["a"])}), [])
+
+    def test_parse(self):
+        text = "\n".join(
+            [
+                "Max entry size '10' bytes exceeded for stream '{app=\"rejects\"}' "
+                "while adding an entry with length '20' bytes",
+                "entry for stream '{app=\"rejects\"}' has timestamp too old: "
+                "2023-11-14T22:13:19Z, oldest acceptable timestamp is: 2023-11-14T22:13:20Z",
+                "stream '{app=\"other\", level=\"INFO\"}' has label value too long: 'INFO'",
+            ]
+        )
+        rejection = parse_rejection(text)
+        self.assertEqual(rejection.max_line_size, 10)
+        self.assertEqual(rejection.oldest_ns, 1_700_000_000_000_000_000)
+        self.assertEqual(rejection.streams, {frozenset(OTHER)})
+        self.assertIsNone(parse_rejection("error parsing push request"))
+
+    def test_split_rejected(self):
+        rejection = parse_rejection("Max entry size '5' bytes exceeded for stream '{}'")
+        rejection.oldest_ns = 1_700_000_000_000_000_001
+        batch = {KEY: make_stream(["old", "ok", "toolong"]), OTHER: make_stream(["x"])}
+        rejection.streams.add(frozenset(OTHER))
+        resend, fixed, rejected = split_rejected(batch, rejection)
+        self.assertEqual((fixed, rejected), (1, 2))
+        self.assertEqual(resend[KEY].entry(0)[1:], ("toolo", None))
+
+
+class TestClientRejects(unittest.TestCase):
+
+    def test_bisect_on_413(self):
+        with FakeLoki(max_body_size=2000) as loki:
+            lc = LokiClient(loki.url, thread_pool_size=1, flush_interval=60, codec="gzip")
+            key = lc.labels_key({"app": "rejects"})
+            lines = [f"{i} {os.urandom(25).hex()}" for i in range(200)]
+            now = time.time_ns()
+            for i, line in enumerate(lines):
+                lc.push_entry(key, now + i, line)
+            lc.close()
+            self.assertEqual(loki.lines(), lines)
+            metrics = lc.metrics()
+            self.assertGreater(metrics["batches_split_total"], 0)
+            self.assertEqual(metrics["records_sent_total"], 200)
+
+    def test_single_entry_too_large(self):
+        with FakeLoki(max_body_size=100) as loki:
+            lc = LokiClient(loki.url, thread_pool_size=0, codec="gzip")
+            line = os.urandom(600).hex()  # 不可压缩，请求体一定超过 max_body_size
+            lc.push_entry(lc.labels_key({"app": "rejects"}), time.time_ns(), line)
+            lc.close()
+            self.assertEqual(loki.lines(), [])
+            self.assertEqual(lc.metrics()["records_failed_total"], 1)
+
+    def test_truncate_on_400(self):
+        with FakeLoki(max_line_size=100) as loki:
+            lc = LokiClient(loki.url, thread_pool_size=1, flush_interval=60, max_line_size=0)
+            key = lc.labels_key({"app": "rejects"})
+            now = time.time_ns()
+            lines = ["a", "b" * 300, "c"]
+            for i, line in enumerate(lines):
+                lc.push_entry(key, now + i, line)
+            lc.close()
+            # 其余日志只推送一次，过长的行截断后重新推送
+            self.assertEqual(loki.lines(), ["a", "c", "b" * 100])
+            metrics = lc.metrics()
+            self.assertEqual(metrics["records_sent_total"], 3)
+            self.assertEqual(metrics["lines_truncated_total"], 1)
+            self.assertEqual(lc.max_line_size, 100)
+
+    def test_max_line_size(self):
+        with FakeLoki() as loki:
+            lc = LokiClient(loki.url, thread_pool_size=0, max_line_size=8, line_overflow="chunk")
+            lc.push_entry(lc.labels_key({"app": "rejects"}), time.time_ns(), "0123456789abc")
+            lc.close()
+            self.assertEqual(loki.lines(), ["01234567", "89abc"])
+            self.assertEqual(lc.metrics()["lines_truncated_total"], 1)
+        with self.assertRaises(ValueError):
+            LokiClient("http://127.0.0.1:9", line_overflow="drop")
+
+
+if __name__ == "__main__":
+    unittest.main()
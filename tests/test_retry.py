@@ -0,0 +1,135 @@
+import time
+import unittest
+from email.utils import formatdate
+
+from logging_loki.labels import stream_hash
+from logging_loki.loki_client import LokiClient
+from logging_loki.retry import RetryPolicy, RetryQueue, parse_retry_after
+
+from fake_loki import FakeLoki
+
+
+def wait_for(predicate, timeout=3):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_backoff(self):
+        policy = RetryPolicy(backoff=1, max_backoff=8)
+        for attempt, upper in enumerate([1, 2, 4, 8, 8]):
+            delay = policy.delay(attempt, 503)
+            self.assertGreaterEqual(delay, upper / 2)
+            self.assertLessEqual(delay, upper)
+
+    def test_retry_after(self):
+        policy = RetryPolicy(backoff=0.01)
+        self.assertEqual(policy.delay(0, 503, 7), 7)
+        self.assertGreaterEqual(policy.delay(0, 429), 1)
+        self.assertEqual(parse_retry_after("3"), 3)
+        self.assertEqual(parse_retry_after("86400"), 300)
+        self.assertAlmostEqual(parse_retry_after(formatdate(time.time() + 10)), 10, delta=1.5)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertIsNone(parse_retry_after(None))
+
+    def test_should_retry(self):
+        for status in (None, 500, 503, 408, 429):
+            self.assertTrue(RetryPolicy.should_retry(status))
+        for status in (400, 401, 413):
+            self.assertFalse(RetryPolicy.should_retry(status))
+
+    def test_queue(self):
+        queue = RetryQueue()
+        queue.push("b", 0.02)
+        queue.push("a", 0)
+        queue.push("c", 60)
+        self.assertEqual(queue.pop_due(), ["a"])
+        self.assertEqual(queue.pop_due(time.monotonic() + 1), ["b"])
+        self.assertEqual(queue.drain(), ["c"])
+        self.assertIsNone(queue.next_due())
+
+
+class TestClientRetry(unittest.TestCase):
+
+    def push(self, lc, line):
+        lc.push_once(dict(app="test_retry"), [[time.time_ns(), line]])
+
+    def test_retry_does_not_block_worker(self):
+        with FakeLoki() as loki:
+            loki.statuses = [503]
+            lc = LokiClient(loki.url, thread_pool_size=2, retry_backoff=2)
+            self.push(lc, "failed")
+            self.assertTrue(wait_for(lambda: len(lc._retries) == 1))
+            # 推送线程没有被等待重试占用，其他分区的 stream 照常推送
+            other = next(
+                {"app": f"other{i}"}
+                for i in range(100)
+                if stream_hash(lc.labels_key({"app": f"other{i}"})) % 2
+                != stream_hash(lc.labels_key({"app": "test_retry"})) % 2
+            )
+            lc.push_once(other, [[time.time_ns(), "healthy"]])
+            self.assertTrue(wait_for(lambda: loki.lines() == ["healthy"], 0.8))
+            self.assertTrue(wait_for(lambda: loki.lines() == ["healthy", "failed"]))
+            self.assertTrue(wait_for(lambda: lc.backlog_size == 0))
+            lc.close()
+
+    def test_give_up(self):
+        with FakeLoki() as loki:
+            loki.statuses = [500, 500, 500]
+            lc = LokiClient(loki.url, thread_pool_size=1, max_retries=2, retry_backoff=0.01)
+            self.push(lc, "lost")
+            self.assertTrue(wait_for(lambda: loki.attempts == 3))
+            self.assertTrue(wait_for(lambda: lc.backlog_size == 0))
+            self.assertEqual(loki.lines(), [])
+            lc.close()
+
+    def test_throttled(self):
+        with FakeLoki() as loki:
+            loki.statuses = [(429, {"Retry-After": "1"})]
+            lc = LokiClient(loki.url, thread_pool_size=1)
+            self.push(lc, "first")
+            self.push(lc, "second")
+            time.sleep(0.5)
+            # 限流期间之后的批次也不推送
+            self.assertEqual(loki.attempts, 1)
+            self.assertTrue(wait_for(lambda: sorted(loki.lines()) == ["first", "second"]))
+            lc.close()
+
+    def test_close_flushes_retries(self):
+        with FakeLoki() as loki:
+            loki.statuses = [503]
+            lc = LokiClient(loki.url, thread_pool_size=1, retry_backoff=60)
+            self.push(lc, "pending")
+            self.assertTrue(wait_for(lambda: len(lc._retries) == 1))
+            lc.close()
+            self.assertEqual(loki.lines(), ["pending"])
+
+    def test_retry_during_close(self):
+        with FakeLoki() as loki:
+            loki.statuses = [503, 503]
+            lc = LokiClient(loki.url, thread_pool_size=1, flush_interval=60, retry_backoff=0.05)
+            lc.push_wait(dict(app="test_retry"), [[time.time_ns(), "closing"]])
+            lc.close()
+            # 关闭时刷写的批次失败后同步重试，而不是只推送一次
+            self.assertEqual(loki.attempts, 3)
+            self.assertEqual(loki.lines(), ["closing"])
+            self.assertEqual(lc.metrics()["records_failed_total"], 0)
+
+    def test_close_timeout(self):
+        with FakeLoki() as loki:
+            loki.statuses = [503] * 10
+            lc = LokiClient(
+                loki.url, thread_pool_size=1, flush_interval=60, retry_backoff=1, close_timeout=0.3
+            )
+            lc.push_wait(dict(app="test_retry"), [[time.time_ns(), "lost"]])
+            started = time.monotonic()
+            lc.close()
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertEqual(lc.metrics()["records_failed_total"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from logging_loki.loki_client import LokiClient
+from logging_loki.ring import MmapRing, decode_record, encode_record
+
+from fake_loki import FakeLoki
+from test_retry import wait_for
+
+PROJECT_DIR = Path(__file__).parent.parent
+
+
+class TestMmapRing(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "ring"
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def read(self, ring: MmapRing, start: int):
+        records = []
+        for record, end in ring.read(start):
+            records.append(decode_record(record))
+            record.release()
+            start = end
+        return records, start
+
+    def test_record_roundtrip(self):
+        record = ((("app", "测试"), ("env", "dev")), 123, "line\n2", {"a": "b"})
+        self.assertEqual(decode_record(memoryview(encode_record(*record))), record)
+        record = ((), -1, "", None)
+        self.assertEqual(decode_record(memoryview(encode_record(*record))), record)
+
+    def test_wrap_and_full(self):
+        ring = MmapRing(self.path, 256)
+        payload = encode_record((("app", "x"),), 1, "y" * 30, None)
+        written = 0
+        while ring.append(payload):
+            written += 1
+        self.assertEqual(written, 256 // (len(payload) + 4))
+
+        records, end = self.read(ring, ring.head)
+        self.assertEqual(len(records), written)
+        ring.head = end
+        for _ in range(written):
+            self.assertTrue(ring.append(payload))
+        records, end = self.read(ring, end)
+        self.assertEqual(len(records), written)
+        ring.close()
+
+    def test_wrap_on_empty_ring(self):
+        ring = MmapRing(self.path, 1000)
+        first = encode_record((), 1, "x" * 500, None)
+        self.assertTrue(ring.append(first))
+        _, end = self.read(ring, ring.head)
+        ring.head = end
+        # 数据区末尾放不下，环形缓存为空时跳到开头写入
+        large = encode_record((), 2, "y" * 700, None)
+        self.assertTrue(ring.fits(large))
+        self.assertTrue(ring.append(large))
+        records, _ = self.read(ring, end)
+        self.assertEqual([r[2] for r in records], ["y" * 700])
+        ring.close()
+
+        ring = MmapRing(self.path)
+        records, _ = self.read(ring, ring.head)
+        self.assertEqual([r[2] for r in records], ["y" * 700])
+        ring.close()
+
+    def test_reopen(self):
+        ring = MmapRing(self.path, 1024)
+        for i in range(5):
+            ring.append(encode_record((), i, f"line {i}", None))
+        _, end = self.read(ring, 0)
+        ring.head = len(encode_record((), 0, "line 0", None)) + 4
+        ring.close()
+
+        ring = MmapRing(self.path, 4096)
+        self.assertEqual(ring.capacity, 1024)
+        records, _ = self.read(ring, ring.head)
+        self.assertEqual([r[2] for r in records], [f"line {i}" for i in range(1, 5)])
+        ring.close()
+
+
+CRASH_SCRIPT = """
+import os, sys, time
+from logging_loki.loki_client import LokiClient
+lc = LokiClient(sys.argv[1], flush_interval=60, ring_path=sys.argv[2])
+for i in range(100):
+    lc.push_wait(dict(app="test_ring"), [[time.time_ns(), f"line {i}"]])
+os._exit(1)
+"""
+
+
+class TestClientRing(unittest.TestCase):
+
+    def test_recover_after_crash(self):
+        with tempfile.TemporaryDirectory() as tmp, FakeLoki() as loki:
+            ring_path = os.path.join(tmp, "ring")
+            subprocess.run(
+                [sys.executable, "-c", CRASH_SCRIPT, loki.url, ring_path],
+                cwd=PROJECT_DIR,
+                check=False,
+            )
+            self.assertEqual(loki.lines(), [])
+
+            lc = LokiClient(loki.url, flush_interval=0.1, ring_path=ring_path)
+            deadline = time.monotonic() + 2
+            while len(loki.lines()) < 100 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            lc.push_once(dict(app="test_ring"), [[time.time_ns(), "after"]])
+            lc.close()
+            self.assertEqual(loki.lines()[:100], [f"line {i}" for i in range(100)])
+            self.assertEqual(loki.lines()[100:], ["after"])
+
+            lc = LokiClient(loki.url, flush_interval=0.1, ring_path=ring_path)
+            self.assertEqual(lc.ring.head, lc.ring.tail)
+            lc.close()
+
+    def test_oversized_record(self):
+        with tempfile.TemporaryDirectory() as tmp, FakeLoki() as loki:
+            lc = LokiClient(
+                loki.url,
+                ring_path=os.path.join(tmp, "ring"),
+                ring_size=4096,
+                overflow_policy="block",
+            )
+            started = time.monotonic()
+            lc.push_wait(dict(app="test_ring"), [[time.time_ns(), "x" * 5000]])
+            lc.push_wait(dict(app="test_ring"), [[time.time_ns(), "small"]])
+            self.assertLess(time.monotonic() - started, 1)
+            lc.close()
+            self.assertEqual(loki.lines(), ["small"])
+            self.assertEqual(lc.dropped_records, 1)
+
+    def test_wrap_large_record(self):
+        with tempfile.TemporaryDirectory() as tmp, FakeLoki() as loki:
+            lc = LokiClient(
+                loki.url,
+                flush_interval=0.05,
+                ring_path=os.path.join(tmp, "ring"),
+                ring_size=1000,
+                overflow_policy="block",
+            )
+            lc.push_wait(dict(app="test_ring"), [[time.time_ns(), "x" * 500]])
+            self.assertTrue(wait_for(lambda: lc.ring.head == lc.ring.tail > 0))
+            started = time.monotonic()
+            lc.push_wait(dict(app="test_ring"), [[time.time_ns(), "y" * 700]])
+            self.assertLess(time.monotonic() - started, 1)
+            lc.close()
+            self.assertEqual(loki.lines(), ["x" * 500, "y" * 700])
+
+
+if __name__ == "__main__":
+    unittest.main()
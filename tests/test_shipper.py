@@ -0,0 +1,36 @@
+import logging
+import multiprocessing
+import unittest
+
+from logging_loki.shipper import LokiShipper
+
+from fake_loki import FakeLoki
+
+
+def worker(shipper: LokiShipper, n: int):
+    logger = logging.getLogger(f"test_shipper.{n}")
+    logger.propagate = False
+    logger.addHandler(shipper.handler(level="INFO", tags={"app": "test_shipper"}))
+    logger.setLevel("INFO")
+    for i in range(50):
+        logger.info(f"worker {n} line {i}")
+
+
+class TestShipper(unittest.TestCase):
+
+    def test_workers_share_one_client(self):
+        ctx = multiprocessing.get_context("fork")
+        with FakeLoki() as loki:
+            shipper = LokiShipper(loki.url, flush_interval=60, context=ctx).start()
+            workers = [ctx.Process(target=worker, args=(shipper, n)) for n in range(4)]
+            [p.start() for p in workers]
+            [p.join() for p in workers]
+            shipper.stop()
+
+            self.assertEqual(len(loki.requests), 1)
+            self.assertEqual(len(loki.requests[0].streams), 1)
+            self.assertEqual(len(loki.lines()), 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
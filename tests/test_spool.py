@@ -0,0 +1,113 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from logging_loki.loki_client import LokiClient
+from logging_loki.spool import DiskSpool
+
+from fake_loki import FakeLoki
+
+HEADERS = {"Content-Type": "application/x-protobuf", "Content-Encoding": "snappy"}
+
+
+class TestDiskSpool(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def drain(self, spool: DiskSpool) -> list[bytes]:
+        bodies = []
+        while (record := spool.peek()) is not None:
+            bodies.append(record[0])
+            spool.commit()
+        return bodies
+
+    def test_replay_in_order(self):
+        spool = DiskSpool(self.dir, segment_size=100)
+        for i in range(10):
+            spool.append(f"body-{i}".encode() * 5, HEADERS)
+        self.assertEqual(spool.peek(), (b"body-0" * 5, HEADERS))
+        self.assertEqual(self.drain(spool), [f"body-{i}".encode() * 5 for i in range(10)])
+        self.assertFalse(spool)
+        spool.close()
+
+    def test_resume_after_restart(self):
+        spool = DiskSpool(self.dir, segment_size=100)
+        for i in range(6):
+            spool.append(f"body-{i}".encode(), HEADERS)
+        spool.peek()
+        spool.commit()
+        spool.close()
+
+        spool = DiskSpool(self.dir)
+        self.assertEqual(self.drain(spool), [f"body-{i}".encode() for i in range(1, 6)])
+        spool.append(b"after", HEADERS)
+        self.assertEqual(self.drain(spool), [b"after"])
+        spool.close()
+
+    def test_max_size(self):
+        spool = DiskSpool(self.dir, max_size=1000, segment_size=200)
+        for i in range(50):
+            spool.append(f"{i:04d}".encode() * 10, HEADERS)
+        self.assertLessEqual(spool.size, 1000)
+        bodies = self.drain(spool)
+        self.assertEqual(len(bodies) + spool.dropped, 50)
+        self.assertEqual(bodies[-1], b"0049" * 10)
+        spool.close()
+
+    def test_truncated_tail(self):
+        spool = DiskSpool(self.dir)
+        spool.append(b"good", HEADERS)
+        spool.append(b"torn", HEADERS)
+        spool.close()
+        (segment,) = self.dir.glob("*.spool")
+        segment.write_bytes(segment.read_bytes()[:-2])
+
+        spool = DiskSpool(self.dir)
+        self.assertEqual(self.drain(spool), [b"good"])
+        spool.close()
+
+
+class TestClientSpool(unittest.TestCase):
+
+    def test_spool_and_replay(self):
+        with tempfile.TemporaryDirectory() as tmp, FakeLoki() as loki:
+            loki.statuses = [429]
+            lc = LokiClient(
+                loki.url, flush_interval=60, thread_pool_size=0, spool_dir=tmp, max_retries=0
+            )
+            lc.push_once(dict(app="test_spool"), [[time.time_ns(), "first"]])
+            self.assertEqual(loki.lines(), [])
+            self.assertTrue(lc.spool)
+
+            lc.push_once(dict(app="test_spool"), [[time.time_ns(), "second"]])
+            self.assertEqual(loki.lines(), ["second", "first"])
+            self.assertFalse(lc.spool)
+            lc.close()
+
+    def test_replay_on_restart(self):
+        with tempfile.TemporaryDirectory() as tmp, FakeLoki() as loki:
+            loki.statuses = [429]
+            lc = LokiClient(
+                loki.url, flush_interval=60, thread_pool_size=0, spool_dir=tmp, max_retries=0
+            )
+            lc.push_once(dict(app="test_spool"), [[time.time_ns(), "lost"]])
+            lc.close()
+
+            lc = LokiClient(
+                loki.url, flush_interval=60, thread_pool_size=0, spool_dir=tmp, max_retries=0
+            )
+            deadline = time.monotonic() + 2
+            while not loki.lines() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            lc.close()
+            self.assertEqual(loki.lines(), ["lost"])
+
+
+if __name__ == "__main__":
+    unittest.main()
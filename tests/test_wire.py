@@ -0,0 +1,156 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import unittest
+
+from logging_loki import loki_push_pb2
+from logging_loki.loki_client import LokiClient
+from logging_loki.wire import (
+    StreamBuffer,
+    encode_entry,
+    encode_varint,
+    finalize_json,
+    finalize_protobuf,
+)
+
+ENTRIES = [
+    (1_700_000_000_123_456_789, "hello", None),
+    (1_700_000_001_000_000_000, "", {"k": "v"}),
+    (0, "中文 ünïcode", {"": "b"}),
+    (-1, "before epoch", None),
+    (1_700_000_002_000_000_001, "x" * 20000, {"long": "y" * 300}),
+]
+
+
+class TestWire(unittest.TestCase):
+
+    def test_varint(self):
+        for value in (1, 127, 128, 300, 16383, 16384, 1 << 35, -1):
+            field = loki_push_pb2.Timestamp(seconds=value).SerializeToString()
+            self.assertEqual(b"\x08" + encode_varint(value), field)
+
+    def test_entry(self):
+        for ts_ns, line, metadata in ENTRIES:
+            entry = loki_push_pb2.EntryAdapter(
+                timestamp=loki_push_pb2.Timestamp(
+                    seconds=ts_ns // 1_000_000_000, nanos=ts_ns % 1_000_000_000
+                ),
+                line=line,
+                structuredMetadata=metadata or {},
+            )
+            self.assertEqual(
+                encode_entry(ts_ns, line, metadata),
+                entry.SerializeToString(deterministic=True),
+            )
+
+    def test_random(self):
+        rand = random.Random(16)
+        chars = "ab中\n\x00é"
+        batch, tuples = {}, {}
+        for _ in range(2000):
+            key = LokiClient.labels_key({"app": "wire", "n": rand.randrange(5)})
+            ts_ns = rand.choice([0, rand.randrange(1 << 62), rand.randrange(10**9)])
+            line = "".join(rand.choices(chars, k=rand.choice([0, 1, 100, 200, 20000])))
+            metadata = (
+                {"".join(rand.choices(chars, k=rand.randrange(4))): line[:50]}
+                if rand.random() < 0.3
+                else None
+            )
+            batch.setdefault(key, StreamBuffer()).append(ts_ns, line, metadata)
+            tuples.setdefault(key, []).append((ts_ns, line, metadata))
+        self.assertEqual(
+            bytes(finalize_protobuf(batch)),
+            LokiClient.build_push_request(tuples).SerializeToString(deterministic=True),
+        )
+
+    def test_without_protobuf(self):
+        # 没有安装 protobuf 时依旧可以编码与推送
+        code = (
+            "import sys; sys.modules['google'] = None\n"
+            "from logging_loki.loki_client import LokiClient, loki_push_pb2\n"
+            "from logging_loki.wire import StreamBuffer\n"
+            "assert loki_push_pb2 is None\n"
+            "s = StreamBuffer(); s.append(1, 'x')\n"
+            "print(LokiClient.serialize({(('a', 'b'),): s}, 'protobuf').hex())\n"
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout
+        stream = StreamBuffer()
+        stream.append(1, "x")
+        expected = LokiClient.serialize({(("a", "b"),): stream}, "protobuf")
+        self.assertEqual(out.strip(), expected.hex())
+
+    def test_metadata_order(self):
+        # map 的顺序不影响解码结果
+        metadata = {"b": "2", "a": "", "": "0"}
+        entry = loki_push_pb2.EntryAdapter.FromString(encode_entry(1, "x", metadata))
+        self.assertEqual(dict(entry.structuredMetadata), metadata)
+
+    def test_push_request(self):
+        batch = {}
+        tuples = {}
+        for i, (ts_ns, line, metadata) in enumerate(ENTRIES * 3):
+            key = LokiClient.labels_key({"app": "wire", "i": i % 2})
+            batch.setdefault(key, StreamBuffer(("protobuf", "json"))).append(
+                ts_ns, line, metadata
+            )
+            tuples.setdefault(key, []).append((ts_ns, line, metadata))
+        expected = LokiClient.build_push_request(tuples).SerializeToString(
+            deterministic=True
+        )
+        self.assertEqual(bytes(finalize_protobuf(batch)), expected)
+
+        body = json.loads(finalize_json(batch))
+        self.assertEqual(len(body["streams"]), 2)
+        self.assertEqual(body["streams"][0]["stream"], {"app": "wire", "i": "0"})
+        # 各 stream 内按时间戳排序
+        self.assertEqual(
+            body["streams"][0]["values"][0], [str(ENTRIES[3][0]), ENTRIES[3][1]]
+        )
+        self.assertEqual(sum(len(s["values"]) for s in body["streams"]), 15)
+
+    def test_sort(self):
+        stream = StreamBuffer(("protobuf", "json"))
+        for ts_ns, line in ((3, "c"), (1, "a1"), (2, "b"), (1, "a2")):
+            stream.append(ts_ns, line)
+        self.assertFalse(stream.ordered)
+        batch = {(("app", "wire"),): stream}
+        values = json.loads(finalize_json(batch))["streams"][0]["values"]
+        # 时间戳相同时保持到达顺序
+        self.assertEqual([v[1] for v in values], ["a1", "a2", "b", "c"])
+        request = loki_push_pb2.PushRequest.FromString(bytes(finalize_protobuf(batch)))
+        self.assertEqual([e.line for e in request.streams[0].entries], ["a1", "a2", "b", "c"])
+        self.assertEqual(list(stream.ts), [1, 1, 2, 3])
+
+    def test_entry_take(self):
+        stream = StreamBuffer(("protobuf", "json"))
+        for entry in ENTRIES:
+            stream.append(*entry)
+        for i, entry in enumerate(ENTRIES):
+            self.assertEqual(stream.entry(i), entry)
+        part = stream.take([4, 1])
+        self.assertEqual([part.entry(i) for i in range(2)], [ENTRIES[4], ENTRIES[1]])
+        self.assertFalse(part.ordered)
+        stream.release("protobuf")
+        # 释放一种格式后从另一种格式解码
+        self.assertEqual(stream.entry(2), ENTRIES[2])
+        self.assertEqual(stream.take([0]).entry(0), ENTRIES[0])
+
+    def test_release(self):
+        stream = StreamBuffer()
+        stream.append(1, "a")
+        batch = {(("app", "wire"),): stream}
+        self.assertTrue(finalize_protobuf(batch, release=True))
+        self.assertEqual(len(stream.data["protobuf"]), 0)
+        self.assertEqual(len(stream), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()